@@ -58,17 +58,42 @@ if sys.version_info[0] < 3:
     import tkFileDialog
 else:
     from tkinter import *
-    import messagebox as tkMessageBox
-    import filedialog as tkFileDialog
+    import tkinter.messagebox as tkMessageBox
+    import tkinter.filedialog as tkFileDialog
 from PIL import Image, ImageTk
+import argparse
 import os
-import glob
 import random
+import sqlite3
+import tarfile
+import threading
+import time
+import zipfile
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+from euclidcore import dedup, formats, scan
+from euclidcore.dataset import Dataset
+from euclidcore.prefetch import ImagePrefetcher
+from euclidcore.pyramid import TILE_SIZE, VIEW_MAX_WIDTH, VIEW_MAX_HEIGHT, decodeForView
+from euclidcore.overlay import CanvasOverlay
+from euclidcore.boxes import BoxList
+from euclidcore.writer import LabelWriter
+from euclidcore import timing
+from euclidcore.dims import ImageSizeCache
+from euclidcore.video import VideoSource, isVideoPath, interpolateBoxes
+from euclidcore.archive import ArchiveSource, isArchivePath, listArchives
+from euclidcore.lease import LeaseTable, HEARTBEAT_SECONDS
+from euclidcore.locking import FileLock
+from euclidcore.session import SessionState
+from euclidcore.journal import EditJournal
 
     
 # Usage
 USAGE = " \
-1. Select a Directory of images in bottom control panel \n \
+1. Select a Directory of images in bottom control panel, or enter the path of a video file \
+or of a tar / zip archive of images \n \
 2. Click Load \n \
 3. The first image in the directory should load, along with existing labels if any. \n \
 4. Select a Class label to be used for next bounding box, in class-control panel \n \
@@ -76,12 +101,44 @@ USAGE = " \
 6. Click Save in the File Navigation panel in bottom, to save the bounding boxes \n \
 7. Labels are saved in folder named LabelData in same directory as the images \n \
 8. Can use Left/Right arrows for navigating prev/next images \n \
+9. Mouse wheel or +/- keys to zoom, right mouse button drag to pan, f key to fit the image \n \
+10. Ctrl+click selects the box under the cursor, Delete key removes the selected box. \
+Ctrl+z / Ctrl+y undo / redo box edits. Edits are journaled as they are made, \
+boxes not saved when Euclid was closed or crashed are saved the next time the folder is loaded \n \
+11. Tick 'One image per near-duplicate group' to skip repeated video frames, \
+'Copy labels to duplicates' gives the whole group the boxes of the shown image \n \
+12. Videos: only labelled frames are saved, into a <video>_frames folder. Press i to interpolate \
+the boxes of the previous labelled frame and the shown one onto the frames between them \n \
+13. F2 shows stage timings in the status bar, F3 starts / stops a cProfile capture \n \
+14. Ctrl+Right / Ctrl+Left go to the next / previous image without labels. A folder opens \
+on the image last shown, and Euclid opens the last folder on start \n \
+15. Several annotators can label one shared folder: each ticks 'Share the folder' and gets \
+chunks of images no one else is labelling, the next chunk comes after the last image \n \
 Note: Default is KITTI format \
 "
 
 
-# Object Classes (No spaces in name)
-CLASSES = ['Class0', 'Class1', 'Class2', 'Class3', 'Class4', 'Class5', 'Class6', 'Class7']
+# Object Classes (No spaces in name), see euclidcore/formats.py
+CLASSES = formats.CLASSES
+
+# Background decode of neighbouring images
+PREFETCH_AHEAD = 4              # images after the current one
+PREFETCH_BEHIND = 2             # images before the current one
+PREFETCH_CACHE_BYTES = 512 << 20  # decoded images kept in memory
+
+# How often the listing of a folder being scanned is picked up
+SCAN_POLL_MS = 50
+
+# Largest image view (VIEW_MAX_WIDTH x VIEW_MAX_HEIGHT, see euclidcore/pyramid.py),
+# bigger images are shown scaled down and can be zoomed
+ZOOM_STEP = 1.25
+ZOOM_MAX = 8.0
+
+# Mouse motion is drawn at most once per frame
+FRAME_MS = 16
+
+# Recent folders kept in euclidconfig.txt
+CONFIG_MAX_PATHS = 10
 
 class Euclid():
 
@@ -104,65 +161,470 @@ class Euclid():
         self.currClassLabel=7;
 
     def askDirectory(self):
-      self.imageDir = tkFileDialog.askdirectory()
-      self.SavePathToConfig(self.imageDir)
-      self.entry.insert(0, self.imageDir)
+      imageDir = tkFileDialog.askdirectory()
+      if not imageDir:
+          return # cancelled, the folder loaded stays
+      self.entry.delete(0, END)
+      self.entry.insert(0, imageDir)
       self.loadDir(self)
         
+    # Recent folders, latest last. Every Euclid started from this install
+    # shares the file, so it is rewritten whole under a lock.
     def SavePathToConfig(self, newPath):
         #config file
-        configFile = open(os.path.join(sys.path[0], "euclidconfig.txt"), "a+")
-        lines = configFile.readlines()
-        if(len(lines) > 10):
-            configFile.close()
-            configFile = open(os.path.join(sys.path[0], "euclidconfig.txt"), "w+")
-            configFile.write(newPath + "\n")
-            configFile.close()
-        else:
-            configFile.write(newPath + "\n")
-            configFile.close()
+        configPath = os.path.join(sys.path[0], "euclidconfig.txt")
+        try:
+            with FileLock(configPath + '.lock'):
+                lines = []
+                if os.path.exists(configPath):
+                    with open(configPath) as configFile:
+                        lines = [line.strip() for line in configFile if line.strip() not in ('', newPath)]
+                lines = (lines + [newPath])[-CONFIG_MAX_PATHS:]
+                with open(formats.getTempPath(configPath), 'w') as configFile:
+                    configFile.write(''.join(line + '\n' for line in lines))
+                os.replace(formats.getTempPath(configPath), configPath)
+        except (IOError, OSError):
+            pass # read-only install, nothing to remember
 
-    def AddFileToTrainingList(self, newFile):
-        #training file
-        trainfile = open(os.path.join(sys.path[0], "train.txt"), "ab+")
-        trainfile.write(newFile + "\n")
-        trainfile.close()
+    def GetPathsFromConfig(self):
+        try:
+            with open(os.path.join(sys.path[0], "euclidconfig.txt")) as configFile:
+                return [line.strip() for line in configFile if line.strip() != '']
+        except (IOError, OSError):
+            return []
 
+    # Opens the folder used last, if it is still there
+    def loadLastDir(self):
+        paths = self.GetPathsFromConfig()
+        if len(paths) > 0 and os.path.exists(paths[-1]):
+            self.entry.delete(0, END)
+            self.entry.insert(0, paths[-1])
+            self.loadDir()
 
     def loadDir(self, dbg = False):
         self.imageDir = self.entry.get()
         self.parent.focus()
-        if not os.path.isdir(self.imageDir):
+        isVideo = isVideoPath(self.imageDir) and os.path.isfile(self.imageDir)
+        archivePath = None
+        if isArchivePath(self.imageDir) and os.path.isfile(self.imageDir):
+            # images are read from the archive, labels go next to it
+            archivePath = self.imageDir
+            self.imageDir = os.path.dirname(os.path.abspath(archivePath))
+        if not isVideo and not os.path.isdir(self.imageDir):
             tkMessageBox.showerror("Folder error", message = "The specified directory doesn't exist!")
             return        
         self.SavePathToConfig(self.imageDir)
-         #get image list
-        imageFileTypes = ('*.JPEG', '*.JPG', '*.PNG') # the tuple of file types
+
+        # the boxes of the image shown belong to the previous folder, saved before its dataset goes
+        if self.dirty:
+            self.saveLabel()
+        self.dirty = False
+        self.labelfilename = ''
+
+        # a video is labelled frame by frame, its labelled frames go to a folder of their own
+        if self.video is not None:
+            self.video.close()
+            self.video = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+        if isVideo:
+            try:
+                self.video = VideoSource(self.imageDir)
+            except ImportError as e:
+                tkMessageBox.showerror("Video error", message = str(e))
+                return
+            self.imageDir = self.video.framesDir
+            formats.makeDirs(self.imageDir)
+
+         # set up output dir
+        self.outDir = formats.getLabelDir(self.imageDir)
+        if not os.path.exists(self.outDir):
+            os.mkdir(self.outDir)
+
+        # boxes go to the SQLite store instead of text files when the dataset has one
+        if self.dataset:
+            self.dataset.close()
+        self.dataset = Dataset(self.imageDir, writer = self.labelWriter)
+        self.saveSession()
+        self.closeJournal()
+        try:
+            self.journal = EditJournal(self.imageDir)
+        except (IOError, OSError):
+            self.journal = None # read-only dataset, edits live until saved
+        self.session = SessionState(self.imageDir)
+        self.resumePath = self.session.getLastPath()
+        if self.prefetcher:
+            self.prefetcher.close()
+        if self.sizeCache:
+            self.sizeCache.close()
+        self.sizeCache = ImageSizeCache(self.imageDir)
+        self.prefetcher = ImagePrefetcher(self.decodeImage, self.readLabels, PREFETCH_CACHE_BYTES)
+
+        # list the images in the background, the first one is shown as soon as found
+        self.fullList = None
+        self.clusters = None
+        self.representativeOf = {}
+        self.dedupQueue = None
+        self.skipDuplicates.set(0)
+        self.useLeases.set(0)
+        self.scanDone = False
         self.imageList = []
-        for files in imageFileTypes:
-            self.imageList.extend(glob.glob(os.path.join(self.imageDir, files.lower())) )
-            if (False == self.is_windows):
-                self.imageList.extend(glob.glob(os.path.join(self.imageDir, files)) )
-            
-        if len(self.imageList) == 0:
+        self.cur = 0
+        self.total = 0
+        self.scanQueue = queue.Queue()
+        if self.video is not None:
+            scanThread = threading.Thread(target = self.openVideo, args = (self.video, self.scanQueue))
+        else:
+            scanThread = threading.Thread(target = self.scanDir, args = (self.imageDir, self.scanQueue, archivePath))
+        scanThread.daemon = True
+        scanThread.start()
+        self.updateStatus('Listing images in %s ...' %(self.imageDir))
+        self.parent.after(SCAN_POLL_MS, self.pollScan, self.scanQueue)
+
+    # Runs on the scan thread, must not touch any Tk object. A folder
+    # without images is searched for tar / zip archives of images.
+    def scanDir(self, imageDir, scanQueue, archivePath = None):
+        try:
+            found = 0
+            if archivePath is None:
+                for batch in scan.scanImages(imageDir):
+                    found += len(batch)
+                    scanQueue.put(batch)
+            archivePaths = [archivePath] if archivePath is not None else []
+            if found == 0 and archivePath is None:
+                archivePaths = listArchives(imageDir)
+            if len(archivePaths) > 0:
+                archiveSource = ArchiveSource(archivePaths)
+                scanQueue.put(archiveSource)
+                scanQueue.put(archiveSource.open())
+        except OSError as e:
+            scanQueue.put(e)
+        except (tarfile.TarError, zipfile.BadZipfile) as e:
+            scanQueue.put(OSError(str(e)))
+        scanQueue.put(None)
+
+    # Runs on the scan thread, reads or builds the seek index of the video
+    def openVideo(self, videoSource, scanQueue):
+        try:
+            videoSource.open()
+            scanQueue.put(videoSource.framePaths())
+        except (OSError, ValueError, videoSource.av.FFmpegError) as e:
+            scanQueue.put(e if isinstance(e, OSError) else OSError(str(e)))
+        scanQueue.put(None)
+
+    def pollScan(self, scanQueue):
+        if scanQueue is not self.scanQueue:
+            return # a newer Load replaced this scan
+        done = False
+        error = None
+        resume = False
+        while True:
+            try:
+                batch = scanQueue.get_nowait()
+            except queue.Empty:
+                break
+            if batch is None:
+                done = True
+            elif isinstance(batch, ArchiveSource):
+                self.archive = batch
+            elif isinstance(batch, OSError):
+                error = batch
+            else:
+                if self.resumePath in batch:
+                    # back to the image shown last time
+                    self.cur = len(self.imageList) + batch.index(self.resumePath) + 1
+                    self.resumePath = None
+                    resume = True
+                self.imageList.extend(batch)
+        self.total = len(self.imageList)
+        # Change title
+        self.parent.title("Euclid Labeller (" + self.imageDir + ") " + str(self.total) + " images")
+
+        if resume:
+            if self.dirty:
+                self.saveLabel() # boxes drawn on the first image of this folder while listing
+            self.loadImageAndLabels()
+        elif self.cur == 0 and self.total > 0:
+            # default to the 1st image in the collection
+            self.cur = 1
+            self.loadImageAndLabels()
+        elif self.cur > 0:
+            self.progLabel.config(text = "Progress: [ %04d / %04d ]" %(self.cur, self.total))
+
+        self.scanDone = done
+        if done and self.total > 0:
+            self.resumePath = None
+            self.session.attach(self.imageList, self.getLabelledNames)
+        if not done:
+            self.parent.after(SCAN_POLL_MS, self.pollScan, scanQueue)
+        elif error is not None:
+            tkMessageBox.showerror("Folder error", message = str(error))
+        elif self.total == 0:
             tkMessageBox.showerror("File not found", message = "No images (png, jpeg, jpg) found in folder!")
             self.updateStatus( 'No image files found in the specified dir!')
+        else:
+            self.updateStatus( '%d images loaded from %s' %(self.total, self.imageDir))
+            self.recoverEdits()
+
+    def duplicatesChanged(self, *args):
+        if self.skipDuplicates.get() == 0:
+            if self.fullList is not None and self.lease is None:
+                fullList, self.fullList = self.fullList, None
+                self.setImageList(fullList, self.imagefilename)
             return
-        # Change title
-        self.parent.title("Euclid Labeller (" + self.imageDir + ") " + str(len(self.imageList)) + " images")
+        if self.lease is not None:
+            self.updateStatus('Near-duplicate groups are not available while sharing the folder')
+            self.skipDuplicates.set(0)
+        elif self.clusters is not None:
+            self.showRepresentatives()
+        elif self.video is not None or self.archive is not None:
+            self.updateStatus('Near-duplicate groups are not available for videos and archives')
+            self.skipDuplicates.set(0)
+        elif not self.scanDone or self.total == 0:
+            self.updateStatus('Near-duplicates can be grouped once all images are listed')
+            self.skipDuplicates.set(0)
+        elif self.dedupQueue is None:
+            # hashing runs on a process pool, started from a thread to keep Tk responsive
+            self.dedupQueue = queue.Queue()
+            dedupThread = threading.Thread(target = self.findDuplicates, \
+                                           args = (self.imageDir, list(self.imageList), self.dedupQueue))
+            dedupThread.daemon = True
+            dedupThread.start()
+            self.updateStatus('Finding near-duplicate images ...')
+            self.parent.after(SCAN_POLL_MS, self.pollDuplicates, self.dedupQueue)
 
+    # Runs on the dedup thread, must not touch any Tk object
+    def findDuplicates(self, imageDir, imagePaths, dedupQueue):
+        hashCache = dedup.HashCache(imageDir)
+        try:
+            dedupQueue.put(dedup.clusterImages(imagePaths, hashCache.getHashes(imagePaths)))
+        except (OSError, IOError) as e:
+            dedupQueue.put(e)
+        finally:
+            hashCache.close()
 
-        # default to the 1st image in the collection
-        self.cur = 1
-        self.total = len(self.imageList)
+    def pollDuplicates(self, dedupQueue):
+        if dedupQueue is not self.dedupQueue:
+            return # a newer Load replaced this pass
+        try:
+            result = dedupQueue.get_nowait()
+        except queue.Empty:
+            self.parent.after(SCAN_POLL_MS, self.pollDuplicates, dedupQueue)
+            return
+        self.dedupQueue = None
+        if isinstance(result, Exception):
+            self.skipDuplicates.set(0)
+            tkMessageBox.showerror("Near-duplicate error", message = str(result))
+            return
+        self.clusters = result
+        self.representativeOf = {}
+        for representative, members in result.items():
+            for member in members:
+                self.representativeOf[member] = representative
+        if self.skipDuplicates.get() == 1:
+            self.showRepresentatives()
 
-         # set up output dir
-        self.outDir = os.path.join(self.imageDir + '/LabelData')
-        if not os.path.exists(self.outDir):
-            os.mkdir(self.outDir)
+    def showRepresentatives(self):
+        if self.fullList is not None:
+            return
+        self.fullList = self.imageList
+        current = self.representativeOf.get(self.imagefilename, self.imagefilename)
+        self.setImageList(list(self.clusters), current)
+        self.updateStatus('%d images in %d near-duplicate groups' %(len(self.fullList), self.total))
 
-        self.updateStatus( '%d images loaded from %s' %(self.total, self.imageDir))
-        self.loadImageAndLabels()
+    # Shows another list of the same folder, staying on currentPath
+    def setImageList(self, imageList, currentPath):
+        if self.dirty:
+            self.saveLabel()
+        self.imageList = imageList
+        self.total = len(imageList)
+        self.parent.title("Euclid Labeller (" + self.imageDir + ") " + str(self.total) + " images")
+        self.cur = imageList.index(currentPath) + 1 if currentPath in imageList else 1
+        if self.total > 0:
+            self.loadImageAndLabels()
+
+    # Shared folder: the image list becomes the chunk leased to this annotator
+    def leasesChanged(self, *args):
+        if self.useLeases.get() == 0:
+            if self.lease is not None:
+                self.stopLeasing()
+                if self.fullList is not None:
+                    fullList, self.fullList = self.fullList, None
+                    self.setImageList(fullList, self.imagefilename)
+            return
+        if self.lease is not None:
+            return
+        if self.video is not None:
+            self.updateStatus('Videos cannot be shared between annotators')
+            self.useLeases.set(0)
+            return
+        if not self.scanDone or self.total == 0:
+            self.updateStatus('The folder can be shared once all images are listed')
+            self.useLeases.set(0)
+            return
+        self.skipDuplicates.set(0)
+        imageList = self.fullList if self.fullList is not None else self.imageList
+        try:
+            self.lease = LeaseTable(self.imageDir)
+            self.lease.register(self.dataset.getRelPath(imagePath) for imagePath in imageList)
+        except (OSError, sqlite3.Error) as e:
+            self.stopLeasing()
+            self.useLeases.set(0)
+            tkMessageBox.showerror("Sharing error", message = str(e))
+            return
+        self.fullList = imageList
+        self.pathOf = dict((self.dataset.getRelPath(imagePath), imagePath) for imagePath in imageList)
+        self.parent.after(HEARTBEAT_SECONDS * 1000, self.renewLease, self.lease)
+        self.claimChunk()
+
+    # Leases the next images to label, returns False once there are none
+    def claimChunk(self):
+        try:
+            names = self.lease.claim()
+        except sqlite3.Error as e:
+            self.updateStatus('Leasing failed ' + str(e))
+            return False
+        chunk = [self.pathOf[name] for name in names if name in self.pathOf]
+        done, total = self.lease.progress()
+        if len(chunk) == 0:
+            self.updateStatus('Every image of the folder is labelled or leased, %d of %d done' %(done, total))
+            return False
+        self.setImageList(chunk, None)
+        self.updateStatus('%d images leased, %d of %d done' %(len(chunk), done, total))
+        return True
+
+    def renewLease(self, lease):
+        if lease is not self.lease:
+            return # stopped sharing
+        try:
+            lease.renew()
+        except sqlite3.Error as e:
+            self.updateStatus('Lease renewal failed ' + str(e))
+        self.parent.after(HEARTBEAT_SECONDS * 1000, self.renewLease, lease)
+
+    # Hands the images not done back to the other annotators
+    def stopLeasing(self):
+        if self.lease is None:
+            return
+        try:
+            self.lease.release()
+        except sqlite3.Error:
+            pass # the leases run out on their own
+        self.lease.close()
+        self.lease = None
+        self.pathOf = {}
+
+    # Gives every near-duplicate of the shown image its boxes, scaled to the image size
+    def copyToDuplicates(self):
+        if self.imagefilename == '':
+            return
+        if self.clusters is None:
+            self.updateStatus('Tick "One image per near-duplicate group" first')
+            return
+        members = self.clusters.get(self.imagefilename, [])
+        if len(members) == 0:
+            self.updateStatus('The shown image has no near-duplicates')
+            return
+        if not tkMessageBox.askyesno("Copy labels", message = "Replace the labels of %d near-duplicate images " \
+                                     "with the boxes of this image?" %(len(members))):
+            return
+        self.saveLabel()
+        classIds, bboxes = self.boxes.classIdList(), self.boxes.bboxList()
+        size = (self.pyramid.width, self.pyramid.height)
+        copied = 0
+        for member, memberSize in zip(members, self.sizeCache.getSizes(members)):
+            if memberSize is not None:
+                self.writeLabels(member, classIds, dedup.scaleBoxes(bboxes, size, memberSize), memberSize)
+                copied += 1
+        self.updateStatus('Labels copied to %d near-duplicate images' %(copied))
+
+    # Runs on prefetch worker threads, must not touch any Tk object
+    def decodeImage(self, imagepath):
+        with timing.span('decode'):
+            if self.video is not None:
+                index = self.video.frameIndex(imagepath)
+                return decodeForView(imagepath, self.video.size, lambda: self.video.getFrame(index))
+            elif self.archive is not None and imagepath in self.archive:
+                return decodeForView(imagepath, self.archive.getSize(imagepath), \
+                                     lambda: self.archive.openImage(imagepath))
+            return decodeForView(imagepath, self.sizeCache.getSize(imagepath))
+
+    def getLabelFileName(self, imagepath):
+        return self.dataset.getLabelPath(imagepath)
+
+    # Returns (format or None, classIds, bboxes in image pixels)
+    def readLabels(self, imagepath, pyramid):
+        with timing.span('labels.read'):
+            return self.dataset.readLabels(imagepath, (pyramid.width, pyramid.height))
+
+    def hasLabels(self, imagepath):
+        return self.dataset.hasLabels(imagepath)
+
+    # Saves the boxes journaled but never saved, left by a crash or a killed window
+    def recoverEdits(self):
+        if self.journal is None:
+            return
+        imagePaths = set(self.imageList)
+        recovered = 0
+        for imagepath, (labelMode, size, classIds, bboxes) in self.journal.recover().items():
+            if imagepath in imagePaths and self.writeLabels(imagepath, classIds, bboxes, size, labelMode):
+                recovered += 1
+        if recovered > 0:
+            if self.imagefilename != '' and not self.dirty:
+                self.loadImageAndLabels()
+            self.updateStatus('Recovered the unsaved boxes of %d images' %(recovered))
+
+    def closeJournal(self):
+        if self.journal is not None:
+            self.labelWriter.flush()  # pending saved marks
+            try:
+                self.journal.close()
+            except (IOError, OSError):
+                pass
+            self.journal = None
+
+    # Names of the images with labels, for a session bitmap that has to be rebuilt
+    def getLabelledNames(self):
+        self.labelWriter.flush()
+        return self.dataset.labelledNames()
+
+    # The session file is merged in the background, after the label files queued before
+    def saveSession(self):
+        if self.session is not None and self.session.queueSave():
+            self.labelWriter.submitTask(self.session.save)
+
+    def prefetchAround(self):
+        keys = []
+        for step in range(1, max(PREFETCH_AHEAD, PREFETCH_BEHIND) + 1):
+            if step <= PREFETCH_AHEAD and self.cur + step <= self.total:
+                keys.append(self.imageList[self.cur + step - 1])
+            if step <= PREFETCH_BEHIND and self.cur - step >= 1:
+                keys.append(self.imageList[self.cur - step - 1])
+        self.prefetcher.schedule(keys)
+
+    def onClose(self):
+        if self.prefetcher:
+            self.prefetcher.close()
+        if self.dirty:
+            self.saveLabel()
+        self.stopLeasing()
+        self.saveSession()
+        self.closeJournal()
+        if self.dataset:
+            self.dataset.close()
+        self.labelWriter.close()
+        if self.sizeCache:
+            self.sizeCache.close()
+        if self.video is not None:
+            self.video.close()
+        if self.archive is not None:
+            self.archive.close()
+        if self.profiler.running():
+            self.profiler.stop(os.path.abspath(time.strftime('euclid-%Y%m%d-%H%M%S.prof')))
+        if self.tracePath is not None and timing.enabled():
+            timing.recorder.writeTrace(self.tracePath)
+        self.parent.destroy()
 
         
     def __init__(self, master):
@@ -172,7 +634,7 @@ class Euclid():
         self.frame = Frame(self.parent)
         self.frame.pack(fill=BOTH, expand=1)
         self.parent.resizable(width = TRUE, height = TRUE)
-        self.is_windows = hasattr(sys, 'getwindowsversion')
+        self.parent.protocol("WM_DELETE_WINDOW", self.onClose)
 
 
         # initialize global state
@@ -185,7 +647,38 @@ class Euclid():
         self.labelfilename = ''
         self.currLabelMode = 'YOLO' #'KITTI' #'YOLO' # Other modes TODO
         self.imagefilename = ''
-        self.tkimg = None
+        self.pyramid = None
+        self.tileImages = {}
+
+        # view state, the canvas shows the image from (viewX, viewY) scaled by zoom
+        self.zoom = 1.0
+        self.viewX = self.viewY = 0.0
+        self.viewWidth = self.viewHeight = 400
+        self.panFrom = None
+        self.prefetcher = None
+        self.scanQueue = None
+        self.dataset = None    # labels, store and train.txt of the loaded folder
+        self.sizeCache = None
+        self.scanDone = False
+        self.fullList = None   # all images, while imageList shows group representatives
+        self.clusters = None   # {representative: [near-duplicates]}
+        self.representativeOf = {}
+        self.dedupQueue = None
+        self.video = None      # VideoSource when a video file was loaded
+        self.archive = None    # ArchiveSource when images come from tar / zip files
+        self.lease = None      # LeaseTable while the folder is shared between annotators
+        self.pathOf = {}       # image name -> path, for the leased names
+        self.session = None    # SessionState: last image shown, images with labels
+        self.resumePath = None # image to go back to once the scan lists it
+        self.journal = None    # EditJournal of the box edits
+        self.journaled = False # the boxes the current image started from are in the journal
+        self.undoStack = []    # inverse edits of the current image, latest last
+        self.redoStack = []
+        self.tracePath = None  # session trace written on close, see --trace
+        self.timingsShown = False
+        self.profiler = timing.Profiler()
+        self.labelWriter = LabelWriter()
+        self.dirty = False  # boxes of the current image changed since loaded / saved
 
         # initialize mouse state
         self.STATE = {}
@@ -197,14 +690,10 @@ class Euclid():
         #colors
         self.redColor = self.blueColor = self.greenColor = 128
         
-        # reference to bbox
-        self.bboxIdList = []
-        self.bboxId = None
-        self.bboxList = []
+        # boxes of the current image, with their class and canvas item
+        self.boxes = BoxList()
         self.currClassLabel = 0
-        self.classLabelList = []
-        self.hl = None
-        self.vl = None
+        self.pointerRedraw = None
 
         # ----------------- GUI stuff ---------------------
 
@@ -216,14 +705,32 @@ class Euclid():
         self.imageLabel.grid(row = 0, column = 0,  sticky = W+N)        
         self.mainPanel = Canvas(self.imagePanelFrame, cursor='tcross', borderwidth=2, background='light blue')
         self.mainPanel.bind("<Button-1>", self.mouseClick)
+        self.mainPanel.bind("<Control-Button-1>", self.selectBoxAt) # select the box under the cursor
         self.mainPanel.bind("<Motion>", self.mouseMove)
         self.parent.bind("n", self.nextImage)    
         self.parent.bind("x", self.selectPointXY)
         self.parent.bind("<Escape>", self.cancelBBox)  # press <Escape> to cancel current bbox
         self.parent.bind("<F1>", self.showHelp)  # press <F1> to show help
+        self.parent.bind("<F2>", self.toggleTimings)  # stage timings in the status bar
+        self.parent.bind("<F3>", self.toggleProfile)  # start / stop a cProfile capture
         self.parent.bind("<Left>", self.prevImage) # press 'Left Arrow' to go backforward
         self.parent.bind("<Right>", self.nextImage) # press 'Right Arrow' to go forward
+        self.parent.bind("<Control-z>", self.undo)
+        self.parent.bind("<Control-y>", self.redo)
+        self.parent.bind("<Control-Left>", self.prevUnlabelled)
+        self.parent.bind("<Control-Right>", self.nextUnlabelled)
+        self.mainPanel.bind("<MouseWheel>", self.mouseWheel) # zoom, Windows and Mac
+        self.mainPanel.bind("<Button-4>", self.mouseWheel)   # zoom, Linux
+        self.mainPanel.bind("<Button-5>", self.mouseWheel)
+        self.mainPanel.bind("<ButtonPress-3>", self.panStart) # drag with right button to pan
+        self.mainPanel.bind("<B3-Motion>", self.panMove)
+        self.parent.bind("<plus>", self.zoomIn)
+        self.parent.bind("<equal>", self.zoomIn)
+        self.parent.bind("<minus>", self.zoomOut)
+        self.parent.bind("f", self.zoomFit)
+        self.parent.bind("i", self.interpolateFrames) # videos: fill in the frames since the last labelled one
         self.mainPanel.grid(row = 1, column = 0, rowspan = 4, sticky = W+N)
+        self.overlay = CanvasOverlay(self.mainPanel)
 
         # Boundingbox info panel
         self.bboxControlPanelFrame = Frame(self.frame)
@@ -233,6 +740,8 @@ class Euclid():
         self.lb1.grid(row = 0, column = 0,  sticky = W+N)
         self.listbox = Listbox(self.bboxControlPanelFrame, width = 40, height = 12,  background='white')
         self.listbox.grid(row = 1, column = 0, sticky = N)
+        self.listbox.bind("<<ListboxSelect>>", self.listboxSelect)
+        self.listbox.bind("<Delete>", lambda event: self.delBBox())
         self.btnDel = Button(self.bboxControlPanelFrame, text = 'Delete', command = self.delBBox)
         self.btnDel.grid(row = 2, column = 0, sticky = W+E+N)
         self.btnClear = Button(self.bboxControlPanelFrame, text = 'Clear All', command = self.clearBBox)
@@ -272,10 +781,26 @@ class Euclid():
         self.FormatLabel.grid(row = 2, column = 0, sticky = W+N)
         self.isYoloCheckBox = IntVar()
         self.isYoloCheckBox.set(0)    
+        self.isYoloCheckBox.trace('w', self.formatChanged)
         self.yoloCheckBox = Radiobutton(self.FileControlPanelFrame, variable=self.isYoloCheckBox, value=1, text="Yolo Format")
         self.yoloCheckBox.grid(row = 3, column = 0, sticky = N)
         self.kittiCheckBox = Radiobutton(self.FileControlPanelFrame, variable=self.isYoloCheckBox, value=0, text="KITTI Format")
         self.kittiCheckBox.grid(row = 3, column = 1, sticky = N)
+        self.skipDuplicates = IntVar()
+        self.skipDuplicates.set(0)
+        self.skipDuplicates.trace('w', self.duplicatesChanged)
+        self.skipDuplicatesCheckBox = Checkbutton(self.FileControlPanelFrame, variable = self.skipDuplicates, \
+                                                  text = "One image per near-duplicate group")
+        self.skipDuplicatesCheckBox.grid(row = 4, column = 0, sticky = W)
+        self.copyDuplicatesBtn = Button(self.FileControlPanelFrame, text = "Copy labels to duplicates", \
+                                        command = self.copyToDuplicates)
+        self.copyDuplicatesBtn.grid(row = 4, column = 1, sticky = N)
+        self.useLeases = IntVar()
+        self.useLeases.set(0)
+        self.useLeases.trace('w', self.leasesChanged)
+        self.useLeasesCheckBox = Checkbutton(self.FileControlPanelFrame, variable = self.useLeases, \
+                                             text = "Share the folder: label leased chunks")
+        self.useLeasesCheckBox.grid(row = 5, column = 0, sticky = W)
        
             
             
@@ -306,6 +831,9 @@ class Euclid():
         self.statusText = StringVar()
         self.statusLabel = Label(self.statusPanel, textvariable = self.statusText)
         self.statusLabel.grid(row = 0, column = 0, sticky = W+E+N)
+        self.timingText = StringVar()
+        self.timingLabel = Label(self.statusPanel, textvariable = self.timingText)
+        self.timingLabel.grid(row = 0, column = 1, padx = 10, sticky = W+E+N)
         self.updateStatus("Directory not selected.")
 
         # display mouse position
@@ -319,207 +847,402 @@ class Euclid():
 
 
     def loadImageAndLabels(self):
-        # load image
-        imagepath = self.imageList[self.cur - 1]
-        self.imagefilename = imagepath
-        self.img = Image.open(imagepath)
-        self.tkimg = ImageTk.PhotoImage(self.img)
-        self.mainPanel.config(width = max(self.tkimg.width(), 400), height = max(self.tkimg.height(), 400))
-        self.mainPanel.create_image(0, 0, image = self.tkimg, anchor=NW)
-        self.progLabel.config(text = "Progress: [ %04d / %04d ]" %(self.cur, self.total))
-        self.updateStatus("Loaded file " + imagepath)
-        
-        if self.tkimg.width() > 1024 or self.tkimg.height() > 1024:
-            tkMessageBox.showwarning("Too large image", message = "Image dimensions not suited for Deep Learning frameworks!")
+        with timing.span('load'):
+            # load image
+            imagepath = self.imageList[self.cur - 1]
+            if self.pyramid is not None:
+                # the image left keeps its display level only, the levels decoded for zooming go
+                self.pyramid.releaseLevels((self.pyramid.fitLevel(),))
+                self.prefetcher.updateBytes(self.imagefilename)
+            self.imagefilename = imagepath
+            with timing.span('load.wait'):
+                entry = self.prefetcher.get(imagepath)
+            self.pyramid = entry.image
+            self.prefetchAround()
+            self.viewWidth = max(min(self.pyramid.width, VIEW_MAX_WIDTH), 400)
+            self.viewHeight = max(min(self.pyramid.height, VIEW_MAX_HEIGHT), 400)
+            self.mainPanel.config(width = self.viewWidth, height = self.viewHeight)
+            self.zoom = self.pyramid.fitScale(VIEW_MAX_WIDTH, VIEW_MAX_HEIGHT)
+            self.viewX = self.viewY = 0.0
+            self.tileImages = {}
+            self.renderView()
+            self.overlay.setView(self.viewX, self.viewY, self.zoom)
+            self.progLabel.config(text = "Progress: [ %04d / %04d ]" %(self.cur, self.total))
+            self.updateStatus("Loaded file " + imagepath)
             
-        # load labels
-        self.clearBBox()
-        self.classLabelList = []
-        lastPartFileName, lastPartFileExtension = os.path.splitext(os.path.split(imagepath)[-1])      
-        self.imagename = lastPartFileName
-        labelname = self.imagename + '.txt'
-        self.labelfilename = os.path.join(self.outDir, labelname)
-        bbox_cnt = 0
-        if os.path.exists(self.labelfilename):
-            with open(self.labelfilename) as f:
-                for (i, line) in enumerate(f):
-                    bbox_cnt = len(line)
-                    tmp = [elements.strip() for elements in line.split()]
-                    
-                    if(len(tmp) > 5):
-                        self.currLabelMode='KITTI'
-                        bbTuple = (int(float(tmp[4])),int(float(tmp[5])), int(float(tmp[6])),int(float(tmp[7])) )
-                        self.classLabelList.append(CLASSES.index(tmp[0]))
-                        
-                    else:
-                        self.currLabelMode='YOLO'
-                        bbTuple = self.GetBoundariesFromYoloFile(float(tmp[1]),float(tmp[2]), float(tmp[3]),float(tmp[4]), 
-                                                            self.tkimg.width(), self.tkimg.height() )
-                        self.classLabelList.append(tmp[0])                        
-                    
-
-                    self.bboxList.append( bbTuple  )
+            # load labels
+            self.resetBoxes()
+            self.journaled = False
+            self.undoStack = []
+            self.redoStack = []
+            lastPartFileName, lastPartFileExtension = os.path.splitext(os.path.split(imagepath)[-1])      
+            self.imagename = lastPartFileName
+            self.labelfilename = self.getLabelFileName(imagepath)
+            labelMode, classIds, bboxes = entry.labels
+            if labelMode is not None:
+                self.currLabelMode = labelMode
+            with timing.span('load.boxes'):
+                for classId, bbTuple in zip(classIds, bboxes):
                     #color set
                     currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
                     self.greenColor = (self.greenColor + 45) % 255
-                    tmpId = self.mainPanel.create_rectangle(int(bbTuple[0]), int(bbTuple[1]), \
-                                                            int(bbTuple[2]), int(bbTuple[3]), \
-                                                            width = 2, \
-                                                            outline = currColor)
-                    self.bboxIdList.append(tmpId)
+                    tmpId = self.overlay.addBox(bbTuple, currColor)
+                    self.boxes.append(bbTuple, classId, tmpId)
                     self.listbox.insert(END, '(%d, %d) -> (%d, %d) [%s]' %(int(bbTuple[0]), int(bbTuple[1]), \
-                                                            int(bbTuple[2]), int(bbTuple[3]), tmp[0]))
-                    self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
+                                                            int(bbTuple[2]), int(bbTuple[3]), \
+                                                            CLASSES[classId] if labelMode == 'KITTI' else classId))
+                    self.listbox.itemconfig(len(self.boxes) - 1, fg = currColor)
+            self.dirty = False
+        self.session.setLastPath(imagepath)
+        self.saveSession()
+        self.showTimings()
+
+    # Image pixel <-> canvas coordinates for the current zoom and pan
+    def toCanvas(self, x, y):
+        return (x - self.viewX) * self.zoom, (y - self.viewY) * self.zoom
+
+    def toImage(self, x, y):
+        return self.viewX + x / self.zoom, self.viewY + y / self.zoom
+
+    # Shows the tiles of the pyramid level matching the zoom that are in view
+    def renderView(self):
+        level = self.pyramid.levelFor(self.zoom)
+        self.pyramid.releaseLevels((level, self.pyramid.fitLevel()))
+        right, bottom = self.toImage(self.viewWidth, self.viewHeight)
+        span = TILE_SIZE << level
+        tileImages = {}
+        self.mainPanel.delete('tile')
+        with timing.span('render'):
+            for tx, ty in self.pyramid.tilesInView(level, self.viewX, self.viewY, right, bottom):
+                left, top = self.toCanvas(tx * span, ty * span)
+                tileRight, tileBottom = self.toCanvas(min((tx + 1) * span, self.pyramid.width), \
+                                                      min((ty + 1) * span, self.pyramid.height))
+                left, top = int(round(left)), int(round(top))
+                size = (max(1, int(round(tileRight)) - left), max(1, int(round(tileBottom)) - top))
+                key = (level, tx, ty) + size
+                tkTile = self.tileImages.get(key)
+                if tkTile is None:
+                    tile = self.pyramid.getTile(level, tx, ty)
+                    if tile.size != size:
+                        tile = tile.resize(size, Image.NEAREST if self.zoom > 1 else Image.BILINEAR)
+                    tkTile = ImageTk.PhotoImage(tile)
+                tileImages[key] = tkTile
+                self.mainPanel.create_image(left, top, image = tkTile, anchor = NW, tags = 'tile')
+        # keeps the Tk images in view alive, drops the others
+        self.tileImages = tileImages
+        self.mainPanel.tag_lower('tile')
+        self.prefetcher.updateBytes(self.imagefilename)
+
+    def updateView(self):
+        maxX = self.pyramid.width - self.viewWidth / self.zoom
+        maxY = self.pyramid.height - self.viewHeight / self.zoom
+        self.viewX = max(0.0, min(self.viewX, maxX))
+        self.viewY = max(0.0, min(self.viewY, maxY))
+        self.renderView()
+        self.overlay.setView(self.viewX, self.viewY, self.zoom)
+
+    # Zooms by factor, keeping the image point under (x, y) on the canvas in place
+    def zoomAt(self, factor, x, y):
+        if self.pyramid is None:
+            return
+        imageX, imageY = self.toImage(x, y)
+        minZoom = self.pyramid.fitScale(VIEW_MAX_WIDTH, VIEW_MAX_HEIGHT)
+        self.zoom = max(minZoom, min(self.zoom * factor, ZOOM_MAX))
+        self.viewX = imageX - x / self.zoom
+        self.viewY = imageY - y / self.zoom
+        self.updateView()
+
+    def mouseWheel(self, event):
+        if getattr(event, 'num', 0) == 5 or getattr(event, 'delta', 0) < 0:
+            self.zoomAt(1 / ZOOM_STEP, event.x, event.y)
+        else:
+            self.zoomAt(ZOOM_STEP, event.x, event.y)
+
+    def zoomIn(self, event = None):
+        self.zoomAt(ZOOM_STEP, self.currentMouseX, self.currentMouseY)
+
+    def zoomOut(self, event = None):
+        self.zoomAt(1 / ZOOM_STEP, self.currentMouseX, self.currentMouseY)
+
+    def zoomFit(self, event = None):
+        if self.pyramid is None:
+            return
+        self.zoom = self.pyramid.fitScale(VIEW_MAX_WIDTH, VIEW_MAX_HEIGHT)
+        self.viewX = self.viewY = 0.0
+        self.updateView()
+
+    def panStart(self, event):
+        self.panFrom = (event.x, event.y, self.viewX, self.viewY)
+
+    def panMove(self, event):
+        if self.pyramid is None or self.panFrom is None:
+            return
+        startX, startY, viewX, viewY = self.panFrom
+        self.viewX = viewX - (event.x - startX) / self.zoom
+        self.viewY = viewY - (event.y - startY) / self.zoom
+        self.updateView()
 
     def GetBoundariesFromYoloFile(self, centerX, centerY, width, height, imageWidth, imageHeight):
-        topLeftX = (int)(centerX*imageWidth - (width*imageWidth)/2)
-        topLeftY = (int)(centerY*imageHeight - (height*imageHeight)/2)
-        bottomRightX = (int)(centerX*imageWidth + (width*imageWidth)/2)
-        bottomRightY = (int)(centerY*imageHeight + (height*imageHeight)/2)
-        return topLeftX, topLeftY, bottomRightX, bottomRightY
+        return formats.getBoundariesFromYolo(centerX, centerY, width, height, imageWidth, imageHeight)
     
 
     def convert2Yolo(self, image, boxCoords):
-        
-        invWidth = 1./image[0]
-        invHeight = 1./image[1]
-        x = invWidth * (boxCoords[0] + boxCoords[2])/2.0
-        y = invHeight * (boxCoords[1] + boxCoords[3])/2.0
-        boxWidth = invWidth * (boxCoords[2] - boxCoords[0])
-        boxHeight = invHeight * (boxCoords[3] - boxCoords[1])
-        return (x,y,boxWidth,boxHeight)
+        return formats.convert2Yolo(image, boxCoords)
                 
 
+    # Writes the boxes of the current image. Label files are written in the
+    # background by labelWriter, only the SQLite store is updated right away.
     def saveLabel(self):
         if self.labelfilename == '': 
             return            
-        if(len(self.bboxList) == 0):
+        if len(self.boxes) == 0 and not self.dirty:
             return
         if self.isYoloCheckBox.get() == 0:
             self.currLabelMode = 'KITTI'
         else:
             self.currLabelMode = 'YOLO'
             
-        if self.currLabelMode == 'KITTI':
-            with open(self.labelfilename, 'w') as f:
-                labelCnt=0
-                ##class1 0 0 0 x1,y1,x2,y2 0,0,0 0,0,0 0 0  
-                # fields ignored by DetectNet: alpha, scenario, roty, occlusion, dimensions, location.
-                for bbox in self.bboxList:
-                    f.write('%s' %CLASSES[self.classLabelList[labelCnt]])               
-                    f.write(' 0.0 0 0.0 ')
-                    #f.write(str(bbox[0])+' '+str(bbox[1])+' '+str(bbox[2])+' '+str(bbox[3]))
-                    f.write('%.2f %.2f %.2f %.2f' % (bbox[0], bbox[1], bbox[2], bbox[3]))                 
-                    f.write(' 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 ')
-                    f.write('\n')
-                    labelCnt = labelCnt+1
-            self.updateStatus ('Label Image No. %d saved' %(self.cur))
-        elif self.currLabelMode == 'YOLO':
-            with open(self.labelfilename, 'w') as f:
-                labelCnt=0
-                ##class1 center_box_x_ratio center_box_y_ratio width_ratio height_ratio
-                for bbox in self.bboxList:                
-                    yoloOut = self.convert2Yolo(
-                                [self.tkimg.width(), self.tkimg.height()], 
-                                [bbox[0], bbox[1], bbox[2], bbox[3]]
-                                );
-                    f.write('%s' %self.classLabelList[labelCnt])               
-                    f.write(' %.7f %.7f %.7f %.7f' % (yoloOut[0], yoloOut[1], yoloOut[2], yoloOut[3]))                 
-                    f.write('\n')
-                    #tkMessageBox.showinfo("Save Info", message = self.classLabelList[labelCnt])
-                    labelCnt = labelCnt+1
-            self.updateStatus ('Label Image No. %d saved' %(self.cur))
-            self.AddFileToTrainingList(self.imagefilename);
-        else:
+        if self.currLabelMode not in ('KITTI', 'YOLO'):
             tkMessageBox.showerror("Labelling error", message = 'Unknown Label format')
+            return
+
+        with timing.span('save'):
+            saved = self.writeLabels(self.imagefilename, self.boxes.classIdList(), self.boxes.bboxList(), \
+                                     (self.pyramid.width, self.pyramid.height))
+        if not saved:
+            self.updateStatus('Image No. %d is leased to another annotator, not saved' %(self.cur))
+            self.dirty = False
+            return
+        self.updateStatus ('Label Image No. %d saved' %(self.cur))
+        for error in self.labelWriter.takeErrors():
+            self.updateStatus('Save failed ' + error)
+        self.dirty = False
+        self.journaled = False
+        self.showTimings()
+
+    # Writes the boxes of any image of the folder in currLabelMode. A video
+    # frame is written out as an image the first time it gets boxes. Returns
+    # False for an image of a shared folder leased to someone else.
+    def writeLabels(self, imagepath, classIds, bboxes, size, labelMode = None):
+        labelMode = labelMode or self.currLabelMode
+        if self.lease is not None and not self.lease.owns(self.dataset.getRelPath(imagepath)):
+            return False
+        if self.video is not None and len(bboxes) > 0:
+            self.video.exportFrame(self.video.frameIndex(imagepath))
+        # the journal keeps the edits until the label file is on disk, a failed
+        # write leaves them there and the cached labels are read from disk again
+        journal, prefetcher = self.journal, self.prefetcher
+        upto = journal.seq if journal is not None else 0
+        def written(error):
+            if error is not None:
+                prefetcher.forgetLabels(imagepath)
+            elif journal is not None:
+                journal.markSaved(imagepath, upto)
+        self.prefetcher.setLabels(imagepath, (labelMode, classIds, bboxes))
+        self.dataset.writeLabels(imagepath, labelMode, classIds, bboxes, size, written)
+        self.session.setLabelled(imagepath)
+        if self.lease is not None:
+            self.lease.markDone(self.dataset.getRelPath(imagepath))
+        return True
+
+    # Boxes of the frames between the previous labelled frame and the shown
+    # one, interpolated from the boxes of both
+    def interpolateFrames(self, event = None):
+        if self.video is None or self.imagefilename == '':
+            return
+        end = self.video.frameIndex(self.imagefilename)
+        start = end - 1
+        while start >= 0 and not self.hasLabels(self.video.getFramePath(start)):
+            start -= 1
+        if start < 0:
+            self.updateStatus('No labelled frame before this one')
+            return
+        if end - start < 2:
+            self.updateStatus('No frames between this one and the previous labelled frame')
+            return
+        self.saveLabel()
+        labelMode, startClassIds, startBboxes = self.readLabels(self.video.getFramePath(start), self.pyramid)
+        endClassIds, endBboxes = self.boxes.classIdList(), self.boxes.bboxList()
+        for index in range(start + 1, end):
+            classIds, bboxes = interpolateBoxes(startClassIds, startBboxes, endClassIds, endBboxes, \
+                                                float(index - start) / (end - start))
+            self.writeLabels(self.video.getFramePath(index), classIds, bboxes, self.video.size)
+        self.updateStatus('Boxes interpolated onto frames %d to %d' %(start + 2, end))
+
+    def formatChanged(self, *args):
+        if self.imagefilename != '':
+            self.dirty = True
         
 
     def selectPointXY(self, event):
-        self.handleMouseOrXKey(self.currentMouseX, self.currentMouseY)
+        self.handleMouseOrXKey(*self.toImage(self.currentMouseX, self.currentMouseY))
 
     def mouseClick(self, event):
-        self.handleMouseOrXKey(event.x, event.y)
+        self.handleMouseOrXKey(*self.toImage(event.x, event.y))
 
+    # Coordinates are in full resolution image pixels
     def handleMouseOrXKey(self, xCoord, yCoord):
         if self.imagefilename == '':
             return
+        xCoord = int(min(max(xCoord, 0), self.pyramid.width))
+        yCoord = int(min(max(yCoord, 0), self.pyramid.height))
         if self.STATE['click'] == 0:
             self.STATE['x'], self.STATE['y'] = xCoord, yCoord
         else:
             #Got a new BB, store the class label also
             x1, x2 = min(self.STATE['x'], xCoord), max(self.STATE['x'], xCoord)
             y1, y2 = min(self.STATE['y'], yCoord), max(self.STATE['y'], yCoord)
-            self.bboxList.append((x1, y1, x2, y2))
-            self.bboxIdList.append(self.bboxId)
-            self.classLabelList.append(self.currClassLabel)
-            self.bboxId = None
-            self.listbox.insert(END, '(%d, %d) -> (%d, %d)[Class %d]' %(x1, y1, x2, y2 , self.currClassLabel))
-            #color set
-            currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
-            self.redColor = (self.redColor + 25) % 255         
-            self.listbox.itemconfig(len(self.bboxIdList) - 1, fg = currColor)
+            self.overlay.hideRubberBand()
+            self.editBoxes(('add', len(self.boxes), self.currClassLabel, (x1, y1, x2, y2)))
         self.STATE['click'] = 1 - self.STATE['click']
 
+    # Draws a box and lists it at index
+    def insertBox(self, index, classId, bbox):
+        #color set
+        currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
+        self.redColor = (self.redColor + 25) % 255
+        self.boxes.insert(index, bbox, classId, self.overlay.addBox(bbox, currColor))
+        self.listbox.insert(index, '(%d, %d) -> (%d, %d)[Class %d]' %(bbox[0], bbox[1], bbox[2], bbox[3], classId))
+        self.listbox.itemconfig(index, fg = currColor)
+
+    # Applies an edit to the boxes of the current image, journals it and
+    # returns the edit undoing it. Edits: ('add', index, classId, bbox),
+    # ('delete', index) and ('set', classIds, bboxes).
+    def applyEdit(self, edit):
+        if self.journal is not None and not self.journaled:
+            self.journal.begin(self.imagefilename, 'YOLO' if self.isYoloCheckBox.get() == 1 else 'KITTI', \
+                               (self.pyramid.width, self.pyramid.height), \
+                               self.boxes.classIdList(), self.boxes.bboxList())
+            self.journaled = True
+        if edit[0] == 'add':
+            op, index, classId, bbox = edit
+            self.insertBox(index, classId, bbox)
+            inverse = ('delete', index)
+        elif edit[0] == 'delete':
+            index = edit[1]
+            bbox, classId, itemId = self.boxes.pop(index)
+            self.overlay.removeBox(itemId)
+            self.listbox.delete(index)
+            inverse = ('add', index, classId, bbox)
+        else:
+            inverse = ('set', self.boxes.classIdList(), self.boxes.bboxList())
+            self.resetBoxes()
+            for index, (classId, bbox) in enumerate(zip(edit[1], edit[2])):
+                self.insertBox(index, classId, bbox)
+        if self.journal is not None:
+            if edit[0] == 'add':
+                self.journal.add(self.imagefilename, edit[1], edit[2], edit[3])
+            elif edit[0] == 'delete':
+                self.journal.delete(self.imagefilename, edit[1])
+            else:
+                self.journal.set(self.imagefilename, edit[1], edit[2])
+        self.dirty = True
+        return inverse
+
+    def editBoxes(self, edit):
+        self.undoStack.append(self.applyEdit(edit))
+        self.redoStack = []
+
+    def undo(self, event = None):
+        if self.imagefilename == '' or len(self.undoStack) == 0:
+            self.updateStatus('Nothing to undo')
+            return
+        self.redoStack.append(self.applyEdit(self.undoStack.pop()))
+        self.showSelection()
+
+    def redo(self, event = None):
+        if self.imagefilename == '' or len(self.redoStack) == 0:
+            self.updateStatus('Nothing to redo')
+            return
+        self.undoStack.append(self.applyEdit(self.redoStack.pop()))
+        self.showSelection()
+
+    # Only records the position, the crosshair and rubber band are redrawn
+    # at most once per frame for the latest position
     def mouseMove(self, event):
         if self.imagefilename == '':
             return
-        self.disp.config(text = 'x: %d, y: %d' %(event.x, event.y))
-        if self.tkimg:
-            if event.x > self.tkimg.width():
-                return
-            if event.y > self.tkimg.height():
-                return
-                
-            if self.hl:
-                self.mainPanel.delete(self.hl)
-            self.hl = self.mainPanel.create_line(0, event.y, self.tkimg.width(), event.y, width = 2)
-            if self.vl:
-                self.mainPanel.delete(self.vl)
-            self.vl = self.mainPanel.create_line(event.x, 0, event.x, self.tkimg.height(), width = 2)
+        #Save current xy
+        self.currentMouseX = event.x;
+        self.currentMouseY = event.y;
+        if self.pointerRedraw is None:
+            self.pointerRedraw = self.parent.after(FRAME_MS, self.drawPointer)
+
+    def drawPointer(self):
+        self.pointerRedraw = None
+        if self.pyramid is None:
+            return
+        x, y = self.currentMouseX, self.currentMouseY
+        imageX, imageY = self.toImage(x, y)
+        hover = self.boxes.boxAt(imageX, imageY)
+        if hover >= 0:
+            self.disp.config(text = 'x: %d, y: %d  box %d' %(imageX, imageY, hover + 1))
+        else:
+            self.disp.config(text = 'x: %d, y: %d' %(imageX, imageY))
+        right, bottom = self.toCanvas(self.pyramid.width, self.pyramid.height)
+        right, bottom = min(right, self.viewWidth), min(bottom, self.viewHeight)
+        if x > right:
+            return
+        if y > bottom:
+            return
+        self.overlay.showCrosshair(x, y, right, bottom)
         if 1 == self.STATE['click']:
-            if self.bboxId:
-                self.mainPanel.delete(self.bboxId)
             #color set
             currColor = '#%02x%02x%02x' % (self.redColor, self.greenColor, self.blueColor)
             self.blueColor = (self.blueColor + 35) % 255                
-            self.bboxId = self.mainPanel.create_rectangle(self.STATE['x'], self.STATE['y'], \
-                                                            event.x, event.y, \
-                                                            width = 2, \
-                                                            outline = currColor)
-        #Save current xy
-        self.currentMouseX = event.x;
-        self.currentMouseY = event.y;
+            self.overlay.showRubberBand((self.STATE['x'], self.STATE['y'], imageX, imageY), currColor)
 
     def cancelBBox(self, event):
         if 1 == self.STATE['click']:
-            if self.bboxId:
-                self.mainPanel.delete(self.bboxId)
-                self.bboxId = None
-                self.STATE['click'] = 0
+            self.overlay.hideRubberBand()
+            self.STATE['click'] = 0
 
     def showHelp(self, event):
         tkMessageBox.showinfo("Help", USAGE)
 
 
+    # Ctrl+click selects the smallest box under the cursor, in the Listbox too
+    def selectBoxAt(self, event):
+        if self.pyramid is None or self.STATE['click'] == 1:
+            return 'break'
+        idx = self.boxes.boxAt(*self.toImage(event.x, event.y))
+        self.listbox.selection_clear(0, END)
+        if idx >= 0:
+            self.listbox.selection_set(idx)
+            self.listbox.see(idx)
+        self.showSelection()
+        return 'break'
+
+    def listboxSelect(self, event):
+        self.showSelection()
+
+    def showSelection(self):
+        sel = self.listbox.curselection()
+        if len(sel) == 1 and int(sel[0]) < len(self.boxes):
+            self.overlay.selectBox(self.boxes.itemIds[int(sel[0])])
+        else:
+            self.overlay.selectBox(None)
+
     def delBBox(self):
         sel = self.listbox.curselection()
         if len(sel) != 1 :
             return
-        idx = int(sel[0])
-        self.mainPanel.delete(self.bboxIdList[idx])
-        self.bboxIdList.pop(idx)
-        self.bboxList.pop(idx)
-        self.listbox.delete(idx)
+        self.editBoxes(('delete', int(sel[0])))
 
     def clearBBox(self):
-        for idx in range(len(self.bboxIdList)):
-            self.mainPanel.delete(self.bboxIdList[idx])
-        self.listbox.delete(0, len(self.bboxList))
-        self.bboxIdList = []
-        self.bboxList = []
+        if self.imagefilename == '' or len(self.boxes) == 0:
+            return
+        self.editBoxes(('set', [], []))
+
+    # Removes the boxes from the view, not an edit
+    def resetBoxes(self):
+        self.overlay.clearBoxes(self.boxes.itemIds)
+        self.listbox.delete(0, len(self.boxes))
+        self.boxes.clear()
 
     def prevImage(self, event = None):
-        self.saveLabel()    
+        if self.dirty:
+            self.saveLabel()    
         if self.cur > 1:
             self.cur -= 1
             self.loadImageAndLabels()
@@ -528,27 +1251,116 @@ class Euclid():
             tkMessageBox.showwarning("Labelling complete", message = "No previous file to label!")
 
     def nextImage(self, event = None):
-        self.saveLabel()
+        if self.dirty:
+            self.saveLabel()
+        if self.lease is not None and self.imagefilename != '':
+            # seen, with or without boxes, nobody else needs to look at it
+            name = self.dataset.getRelPath(self.imagefilename)
+            if self.lease.owns(name):
+                self.lease.markDone(name)
         if self.cur < self.total:
             self.cur += 1
             self.loadImageAndLabels()
+        elif self.lease is not None and self.claimChunk():
+            return
         else:
             self.updateStatus("No more next files!")
             tkMessageBox.showwarning("Labelling complete", message = "No next file to label!")
 
+    # Next image without labels, found in the session bitmap. Lists other
+    # than the folder listing (duplicate groups, leased chunks) are short.
+    def nextUnlabelled(self, event = None):
+        self.gotoUnlabelled(1)
+
+    def prevUnlabelled(self, event = None):
+        self.gotoUnlabelled(-1)
+
+    def gotoUnlabelled(self, step):
+        if self.session is None or not self.session.attached():
+            self.updateStatus('Images without labels can be found once all images are listed')
+            return
+        if self.dirty:
+            self.saveLabel()
+        if self.imageList is self.session.imagePaths:
+            if step > 0:
+                index = self.session.bitmap.nextUnlabelled(self.cur - 1)
+            else:
+                index = self.session.bitmap.prevUnlabelled(self.cur - 1)
+        else:
+            index = self.cur - 1 + step
+            while 0 <= index < self.total and self.session.isLabelled(self.imageList[index]):
+                index += step
+            if not 0 <= index < self.total:
+                index = -1
+        if index < 0:
+            self.updateStatus('No %s image without labels' %('next' if step > 0 else 'previous'))
+            return
+        self.cur = index + 1
+        self.loadImageAndLabels()
+
     def gotoImage(self):
         if self.idxEntry.get() == '':
             return
         idx = int(self.idxEntry.get())
         if 1 <= idx and idx <= self.total:
+            if self.dirty:
+                self.saveLabel()
             self.cur = idx
             self.loadImageAndLabels()
 
     def updateStatus(self, newStatus):
         self.statusText.set("Status: " + newStatus)
+
+    # Stage times of the last load / save, and the median load time
+    def showTimings(self):
+        if not self.timingsShown or not timing.enabled():
+            return
+        recorder = timing.recorder
+        parts = []
+        for name in ('load', 'load.wait', 'decode', 'labels.read', 'render', 'load.boxes', 'save'):
+            duration = recorder.last(name)
+            if duration is not None:
+                parts.append('%s %.1f' %(name, duration * 1000))
+        summary = recorder.summary().get('load')
+        if summary is not None:
+            parts.append('load p50 %.1f p90 %.1f' %(summary['p50'] * 1000, summary['p90'] * 1000))
+        self.timingText.set('ms: ' + ', '.join(parts))
+
+    # Recording stays on while a session trace is being kept
+    def toggleTimings(self, event = None):
+        self.timingsShown = not self.timingsShown
+        if self.timingsShown:
+            timing.enable(keepEvents = self.tracePath is not None)
+            self.timingText.set('ms: timing on')
+            self.showTimings()
+        else:
+            self.timingText.set('')
+            if self.tracePath is None:
+                timing.disable()
+
+    def toggleProfile(self, event = None):
+        if self.profiler.running():
+            path = self.profiler.stop(os.path.abspath(time.strftime('euclid-%Y%m%d-%H%M%S.prof')))
+            self.updateStatus('Profile saved to ' + path)
+        else:
+            self.profiler.start()
+            self.updateStatus('Profiling, press F3 again to stop')
     
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Euclid object labeller')
+    parser.add_argument('--timing', action = 'store_true', help = 'show stage timings in the status bar (F2 toggles)')
+    parser.add_argument('--trace', help = 'write the timed stages of the session to this file when closing: ' \
+                                          'a Chrome trace for .json, JSON lines otherwise')
+    parser.add_argument('--no-resume', action = 'store_true', help = 'do not open the folder used last')
+    args = parser.parse_args()
     root = Tk()
     tool = Euclid(root)
+    if args.trace:
+        tool.tracePath = args.trace
+        timing.enable(keepEvents = True)
+    if args.timing:
+        tool.toggleTimings()
+    if not args.no_resume:
+        tool.loadLastDir()
     root.mainloop()
 
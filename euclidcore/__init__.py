@@ -0,0 +1,51 @@
+#-------------------------------------------------------------------------------
+# Euclid - core helpers shared by the labeller GUI and the command line tools
+# Also the library API for batch jobs and training data loaders: label
+# parsing and writing, the format geometry, folder scanning and dataset I/O,
+# none of which needs Tk or a display. Names are resolved on first use, so
+#   from euclidcore import parseLabelRows
+# only loads formats.py, and Pillow / NumPy are loaded by the modules that
+# decode images or build arrays, when they do.
+#-------------------------------------------------------------------------------
+import importlib
+
+
+# Public name -> module defining it
+API = {
+    # label rows and format geometry
+    'CLASSES': 'formats',
+    'getLabelDir': 'formats',
+    'readLabelRows': 'formats',
+    'splitLabelRows': 'formats',
+    'parseLabelRows': 'formats',
+    'formatLabelRows': 'formats',
+    'writeLabelRows': 'formats',
+    'convert2Yolo': 'formats',
+    'getBoundariesFromYolo': 'formats',
+    'readImageSize': 'formats',
+    # folders and datasets
+    'scanImages': 'scan',
+    'listImages': 'scan',
+    'isImageName': 'scan',
+    'Dataset': 'dataset',
+    'AnnotationStore': 'store',
+    'TrainingList': 'trainlist',
+    'BoxList': 'boxes',
+    # training shards
+    'exportShards': 'shards',
+    'ShardReader': 'shards',
+}
+
+__all__ = sorted(API)
+
+
+def __getattr__(name):
+    if name in API:
+        value = getattr(importlib.import_module('euclidcore.' + API[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module 'euclidcore' has no attribute %r" % name)
+
+
+def __dir__():
+    return sorted(set(globals()) | set(API))
@@ -0,0 +1,150 @@
+#-------------------------------------------------------------------------------
+# Euclid - tar / zip shards as image source
+# Images inside uncompressed tar files and zip files (stored or deflated
+# members) are read straight from the memory-mapped archive, nothing is
+# extracted. The offset and size of every image member is found once and
+# kept as an index in the cache folder next to the archive, so reopening a
+# shard of millions of images reads one small file, and any image is one
+# slice of the mapping away.
+#
+# An image is known by the archive path joined with its member name, e.g.
+# /data/shard-0001.tar/images/000123.jpg. Its labels go to the LabelData
+# folder next to the archive, under the archive and member name, so members
+# named alike in other archives or subfolders keep labels of their own:
+# /data/LabelData/shard-0001.tar/images/000123.txt.
+#-------------------------------------------------------------------------------
+import io
+import json
+import mmap
+import os
+import struct
+import tarfile
+import threading
+import zipfile
+import zlib
+
+from euclidcore import formats, scan
+
+
+ARCHIVE_EXTENSIONS = ('.tar', '.zip')
+
+INDEX_VERSION = 1
+
+ZIP_LOCAL_HEADER = struct.Struct('<4s22xHH')
+
+
+def isArchivePath(path):
+    return os.path.splitext(path)[1].lower() in ARCHIVE_EXTENSIONS
+
+
+def listArchives(folder):
+    return sorted(entry.path for entry in os.scandir(folder) if isArchivePath(entry.name) and entry.is_file())
+
+
+def getIndexPath(archivePath):
+    return os.path.join(formats.getCacheDir(os.path.dirname(archivePath)),
+                        os.path.basename(archivePath) + '.index.json')
+
+
+# Returns [(member name, data offset, stored size, size, compressed)] of the image members
+def indexTar(archivePath):
+    members = []
+    with tarfile.open(archivePath, 'r:') as tar:
+        for member in tar:
+            if member.isfile() and scan.isImageName(member.name):
+                members.append((member.name, member.offset_data, member.size, member.size, False))
+    return members
+
+
+def indexZip(archivePath):
+    members = []
+    with zipfile.ZipFile(archivePath) as archive, open(archivePath, 'rb') as f:
+        for info in archive.infolist():
+            if info.is_dir() or not scan.isImageName(info.filename):
+                continue
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED) or info.flag_bits & 0x1:
+                continue  # other compressions and encrypted members cannot be sliced
+            # the data follows the local header, whose extra field may differ from the central one
+            f.seek(info.header_offset)
+            signature, nameLength, extraLength = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+            if signature != b'PK\x03\x04':
+                raise zipfile.BadZipfile('bad local header for %s' % info.filename)
+            offset = info.header_offset + ZIP_LOCAL_HEADER.size + nameLength + extraLength
+            members.append((info.filename, offset, info.compress_size, info.file_size,
+                            info.compress_type == zipfile.ZIP_DEFLATED))
+    return members
+
+
+# Reads the member index of an archive from the cache, or builds and saves it
+def loadIndex(archivePath):
+    st = os.stat(archivePath)
+    indexPath = getIndexPath(archivePath)
+    try:
+        with open(indexPath) as f:
+            index = json.load(f)
+        if index.get('version') == INDEX_VERSION and index['mtime'] == st.st_mtime_ns and index['size'] == st.st_size:
+            return [tuple(member) for member in index['members']]
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    members = indexZip(archivePath) if archivePath.lower().endswith('.zip') else indexTar(archivePath)
+    try:
+        formats.makeDirs(os.path.dirname(indexPath))
+        with open(formats.getTempPath(indexPath), 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'mtime': st.st_mtime_ns, 'size': st.st_size,
+                       'members': members}, f)
+        os.replace(formats.getTempPath(indexPath), indexPath)
+    except (IOError, OSError):
+        pass  # read-only location, the index is built again next time
+    return members
+
+
+class ArchiveSource(object):
+
+    def __init__(self, archivePaths):
+        self.archivePaths = list(archivePaths)
+        self.lock = threading.Lock()
+        self.maps = {}      # archive index -> mmap, opened on first read
+        self.members = {}   # image path -> (archive index, offset, stored size, size, compressed)
+        self.imagePaths = []
+
+    # Loads or builds the index of every archive, returns the image paths in archive order
+    def open(self):
+        for archiveIndex, archivePath in enumerate(self.archivePaths):
+            for name, offset, storedSize, size, compressed in loadIndex(archivePath):
+                imagePath = os.path.join(archivePath, name)
+                self.members[imagePath] = (archiveIndex, offset, storedSize, size, compressed)
+                self.imagePaths.append(imagePath)
+        return self.imagePaths
+
+    def __contains__(self, imagePath):
+        return imagePath in self.members
+
+    def getMap(self, archiveIndex):
+        with self.lock:
+            mapping = self.maps.get(archiveIndex)
+            if mapping is None:
+                with open(self.archivePaths[archiveIndex], 'rb') as f:
+                    mapping = self.maps[archiveIndex] = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            return mapping
+
+    # Encoded bytes of an image member
+    def getBytes(self, imagePath):
+        archiveIndex, offset, storedSize, size, compressed = self.members[imagePath]
+        data = self.getMap(archiveIndex)[offset:offset + storedSize]
+        if compressed:
+            data = zlib.decompressobj(-zlib.MAX_WBITS).decompress(data, size)
+        return data
+
+    # PIL image of a member, not decoded yet, so draft mode still applies
+    def openImage(self, imagePath):
+        from PIL import Image
+        return Image.open(io.BytesIO(self.getBytes(imagePath)))
+
+    def getSize(self, imagePath):
+        return self.openImage(imagePath).size
+
+    def close(self):
+        with self.lock:
+            for mapping in self.maps.values():
+                mapping.close()
+            self.maps = {}
@@ -0,0 +1,392 @@
+#-------------------------------------------------------------------------------
+# Euclid - benchmarks
+# Times the hot paths of the labeller without a display: folder scan (cold,
+# without the manifest, and warm), image plus label load as done on every
+# Prev/Next (a prefetch miss decoding the view level and reading the labels
+# through the labeller's own loaders, boxes drawn through the overlay on a
+# stand-in canvas), label parsing alone, saving through the label writer,
+# and whole folder format conversion.
+#
+# Synthetic datasets are generated once under --dir and reused while their
+# parameters do not change. Box counts are given as a list and spread over
+# the images, and per image results are reported for each box count.
+# Cases timed once per run (scan, written, convert) are run --repeats times.
+# Results are JSON; with --baseline they are compared to an earlier run,
+# and with --strict the exit status is 1 when a case got slower than the
+# tolerance allows. A p50 that grew by less than the noise floor, or that
+# comes from fewer than MIN_SAMPLES timings (MIN_RUNS runs for the cases
+# timed once per run), never counts as slower.
+#
+# Usage:
+#   python -m euclidcore.bench --images 10000 --boxes 0,10,100,5000 --output base.json
+#   python -m euclidcore.bench --images 10000 --boxes 0,10,100,5000 --baseline base.json --strict
+#-------------------------------------------------------------------------------
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+from euclidcore import formats, scan
+from euclidcore.boxes import BoxList
+from euclidcore.convert import convertDataset
+from euclidcore.dataset import Dataset
+from euclidcore.dims import ImageSizeCache
+from euclidcore.overlay import CanvasOverlay
+from euclidcore.prefetch import ImagePrefetcher
+from euclidcore.pyramid import decodeForView
+from euclidcore.writer import LabelWriter
+
+
+SPEC_NAME = 'bench.json'
+SPEC_VERSION = 1
+
+# Images timed per per-image case, and runs of the cases timed once per run
+DEFAULT_SAMPLES = 500
+DEFAULT_REPEATS = 5
+
+# Allowed slowdown against the baseline before a case counts as a regression,
+# as a ratio and in milliseconds, and timings a p50 needs to be compared:
+# per image timings, or runs of the cases timed once per run
+DEFAULT_TOLERANCE = 0.10
+DEFAULT_NOISE_MS = 0.05
+MIN_SAMPLES = 20
+MIN_RUNS = 3
+
+CASES = ('scan', 'load', 'parse', 'save', 'convert')
+LABEL_FORMATS = ('kitti', 'yolo')
+
+
+# Offers the Canvas item methods CanvasOverlay uses, and only counts calls
+class StubCanvas(object):
+
+    def __init__(self):
+        self.nextId = 0
+        self.calls = 0
+
+    def create(self, *args, **kwargs):
+        self.calls += 1
+        self.nextId += 1
+        return self.nextId
+
+    create_line = create_rectangle = create
+
+    def call(self, *args, **kwargs):
+        self.calls += 1
+
+    coords = itemconfig = scale = move = tag_raise = call
+
+
+def percentile(sortedValues, fraction):
+    if len(sortedValues) == 0:
+        return 0.0
+    return sortedValues[min(int(fraction * len(sortedValues)), len(sortedValues) - 1)]
+
+
+# Latencies in seconds, summarised in milliseconds. count is the number of
+# items each latency covers, e.g. the images of a folder scan; it is given
+# for the cases timed once per run, whose summaries are marked perRun.
+def summarize(latencies, count = None):
+    values = sorted(latencies)
+    total = sum(values)
+    perRun = count is not None
+    count = len(values) if count is None else count * len(values)
+    return {'count': count,
+            'samples': len(values),
+            'perRun': perRun,
+            'mean': 1000.0 * total / max(len(values), 1),
+            'p50': 1000.0 * percentile(values, 0.50),
+            'p90': 1000.0 * percentile(values, 0.90),
+            'p99': 1000.0 * percentile(values, 0.99),
+            'max': 1000.0 * (values[-1] if values else 0.0),
+            'throughput': count / total if total > 0 else 0.0}
+
+
+def parseSize(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def randomBoxes(rng, count, width, height):
+    bboxes = []
+    for i in range(count):
+        boxWidth, boxHeight = rng.randint(4, max(4, width // 4)), rng.randint(4, max(4, height // 4))
+        x1, y1 = rng.randint(0, width - boxWidth), rng.randint(0, height - boxHeight)
+        bboxes.append((x1, y1, x1 + boxWidth, y1 + boxHeight))
+    return bboxes
+
+
+# Writes numImages copies of one JPEG with label files, image i getting
+# boxCounts[i % len(boxCounts)] boxes. Reuses the folder if it holds the
+# same dataset already.
+def makeDataset(datasetDir, numImages, boxCounts, labelMode, size, seed = 0):
+    spec = {'version': SPEC_VERSION, 'images': numImages, 'boxes': list(boxCounts),
+            'format': labelMode, 'size': list(size), 'seed': seed}
+    specPath = os.path.join(datasetDir, SPEC_NAME)
+    try:
+        with open(specPath) as f:
+            if json.load(f) == spec:
+                return
+    except (IOError, OSError, ValueError):
+        pass
+    if os.path.isdir(datasetDir):
+        shutil.rmtree(datasetDir)
+    labelDir = formats.getLabelDir(datasetDir)
+    formats.makeDirs(labelDir)
+    width, height = size
+    template = os.path.join(datasetDir, 'template.jpg')
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    img.save(template, 'JPEG', quality = 90)
+    with open(template, 'rb') as f:
+        data = f.read()
+    os.remove(template)
+    rng = random.Random(seed)
+    # a few prepared label files per box count, they are costly to draw
+    variants = {}
+    for boxCount in boxCounts:
+        variants[boxCount] = [''.join(formats.formatLabelRows(labelMode, [rng.randrange(len(formats.CLASSES))
+                                                                          for i in range(boxCount)],
+                                                              randomBoxes(rng, boxCount, width, height),
+                                                              width, height))
+                              for v in range(4)]
+    for index in range(numImages):
+        name = 'img%07d' % index
+        with open(os.path.join(datasetDir, name + '.jpg'), 'wb') as f:
+            f.write(data)
+        boxCount = boxCounts[index % len(boxCounts)]
+        with open(os.path.join(labelDir, name + '.txt'), 'w') as f:
+            f.write(variants[boxCount][(index // len(boxCounts)) % 4])
+    with open(specPath, 'w') as f:
+        json.dump(spec, f)
+
+
+# Images timed per box count, spread over the dataset
+def sampleImages(imagePaths, boxCounts, samples):
+    byCount = dict((boxCount, []) for boxCount in boxCounts)
+    for index, imagePath in enumerate(sorted(imagePaths)):
+        group = byCount[boxCounts[index % len(boxCounts)]]
+        if len(group) < samples:
+            group.append(imagePath)
+    return byCount
+
+
+def benchScan(datasetDir, repeats):
+    colds, warms = [], []
+    for i in range(repeats):
+        os.utime(datasetDir)  # the manifest no longer matches, the folder is scanned
+        start = time.perf_counter()
+        count = sum(len(batch) for batch in scan.scanImages(datasetDir))
+        colds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        sum(len(batch) for batch in scan.scanImages(datasetDir))
+        warms.append(time.perf_counter() - start)
+    return {'cold': summarize(colds, count), 'warm': summarize(warms, count)}
+
+
+# What the labeller does on Prev/Next, minus the Tk image transfer: an image
+# that was not prefetched is decoded and its labels read by the loaders the
+# labeller gives its prefetcher, then the boxes are redrawn as on resetBoxes
+def benchLoad(samples, sizeCache, dataset):
+    prefetcher = ImagePrefetcher(lambda imagePath: decodeForView(imagePath, sizeCache.getSize(imagePath)),
+                                 lambda imagePath, pyramid: dataset.readLabels(imagePath,
+                                                                               (pyramid.width, pyramid.height)),
+                                 maxBytes = 0, workers = 1)
+    canvas = StubCanvas()
+    overlay = CanvasOverlay(canvas)
+    boxes = BoxList()
+    results = {}
+    for boxCount, imagePaths in samples.items():
+        latencies = []
+        for imagePath in imagePaths:
+            start = time.perf_counter()
+            labelMode, classIds, bboxes = prefetcher.get(imagePath).labels
+            overlay.clearBoxes(boxes.itemIds)
+            boxes.clear()
+            for classId, bbox in zip(classIds, bboxes):
+                boxes.append(bbox, classId, overlay.addBox(bbox, '#808080'))
+            latencies.append(time.perf_counter() - start)
+        results[str(boxCount)] = summarize(latencies)
+    prefetcher.close()
+    return results
+
+
+def benchParse(samples, sizeCache, dataset):
+    results = {}
+    for boxCount, imagePaths in samples.items():
+        texts = []
+        for imagePath, size in zip(imagePaths, sizeCache.getSizes(imagePaths)):
+            with open(dataset.getLabelPath(imagePath)) as f:
+                texts.append((f.read(), size))
+        latencies = []
+        for text, size in texts:
+            start = time.perf_counter()
+            formats.parseLabelRows(formats.splitLabelRows(text.splitlines()), size[0], size[1])
+            latencies.append(time.perf_counter() - start)
+        results[str(boxCount)] = summarize(latencies)
+    return results
+
+
+# Time spent in the Tk callback (format and queue), and the background write
+# throughput until everything reached the disk
+def benchSave(samples, sizeCache, dataset, labelMode, repeats):
+    results = {}
+    for boxCount, imagePaths in samples.items():
+        labels = []
+        for imagePath, size in zip(imagePaths, sizeCache.getSizes(imagePaths)):
+            labelPath = dataset.getLabelPath(imagePath)
+            parsed = formats.parseLabelRows(formats.readLabelRows(labelPath), size[0], size[1])
+            labels.append((labelPath, parsed[1], parsed[2], size))
+        writer = LabelWriter()
+        latencies = []
+        totals = []
+        for i in range(repeats):
+            started = time.perf_counter()
+            for labelPath, classIds, bboxes, size in labels:
+                start = time.perf_counter()
+                writer.submit(labelPath, ''.join(formats.formatLabelRows(labelMode.upper(), classIds, bboxes,
+                                                                         size[0], size[1])))
+                latencies.append(time.perf_counter() - start)
+            writer.flush()
+            totals.append(time.perf_counter() - started)
+        writer.close()
+        results[str(boxCount)] = {'submit': summarize(latencies),
+                                  'written': summarize(totals, len(labels))}
+    return results
+
+
+def benchConvert(datasetDir, labelMode, workers, repeats):
+    latencies = []
+    for i in range(repeats):
+        outDir = tempfile.mkdtemp(prefix = 'euclid-bench-')
+        try:
+            start = time.perf_counter()
+            count, errors = convertDataset(datasetDir, 'YOLO' if labelMode == 'kitti' else 'KITTI', outDir, workers)
+            latencies.append(time.perf_counter() - start)
+        finally:
+            shutil.rmtree(outDir, ignore_errors = True)
+    return summarize(latencies, count)
+
+
+def runBenchmarks(benchDir, numImages, boxCounts, labelModes = LABEL_FORMATS, size = (640, 480),
+                  cases = CASES, samples = DEFAULT_SAMPLES, workers = None, repeats = DEFAULT_REPEATS):
+    results = {'images': numImages, 'boxes': list(boxCounts), 'size': list(size), 'cases': {}}
+    for labelMode in labelModes:
+        datasetDir = os.path.join(benchDir, '%s-%d' % (labelMode, numImages))
+        makeDataset(datasetDir, numImages, boxCounts, labelMode.upper(), size)
+        imagePaths = scan.listImages(datasetDir)
+        sample = sampleImages(imagePaths, boxCounts, samples)
+        sizeCache = ImageSizeCache(datasetDir)
+        sizeCache.getSizes([imagePath for group in sample.values() for imagePath in group])
+        dataset = Dataset(datasetDir)
+        for case in cases:
+            if case == 'scan':
+                result = benchScan(datasetDir, repeats)
+            elif case == 'load':
+                result = benchLoad(sample, sizeCache, dataset)
+            elif case == 'parse':
+                result = benchParse(sample, sizeCache, dataset)
+            elif case == 'save':
+                result = benchSave(sample, sizeCache, dataset, labelMode, repeats)
+            else:
+                result = benchConvert(datasetDir, labelMode, workers, repeats)
+            results['cases']['%s/%s' % (case, labelMode)] = result
+        dataset.close()
+        sizeCache.close()
+    return results
+
+
+# Flattens nested results to {'load/yolo/100': summary}
+def flatten(cases, prefix = ''):
+    flat = {}
+    for key, value in cases.items():
+        if 'p50' in value:
+            flat[prefix + key] = value
+        else:
+            flat.update(flatten(value, prefix + key + '/'))
+    return flat
+
+
+# Returns [(case, baseline p50, current p50, ratio, regressed)] for the cases
+# of both runs. A case regressed when its p50 grew by more than tolerance and
+# by more than noiseMs, both p50s taken over at least MIN_SAMPLES timings, or
+# MIN_RUNS runs for a perRun case: medians of a few per image timings and of
+# a few microseconds move by more than that on an unchanged rerun, while a
+# run covers the whole folder. Results without sample counts are never flagged.
+def compareResults(results, baseline, tolerance = DEFAULT_TOLERANCE, noiseMs = DEFAULT_NOISE_MS):
+    current, previous = flatten(results['cases']), flatten(baseline['cases'])
+    rows = []
+    for case in sorted(current):
+        if case not in previous:
+            continue
+        before, after = previous[case]['p50'], current[case]['p50']
+        ratio = after / before if before > 0 else 1.0
+        samples = min(previous[case].get('samples', 0), current[case].get('samples', 0))
+        minimum = MIN_RUNS if current[case].get('perRun') else MIN_SAMPLES
+        regressed = ratio > 1.0 + tolerance and after - before > noiseMs and samples >= minimum
+        rows.append((case, before, after, ratio, regressed))
+    return rows
+
+
+def printResults(results):
+    print('%-28s %8s %10s %10s %10s %10s %12s' % ('case', 'count', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'per second'))
+    for case, summary in sorted(flatten(results['cases']).items()):
+        print('%-28s %8d %10.3f %10.3f %10.3f %10.3f %12.1f' % (case, summary['count'], summary['p50'], summary['p90'],
+                                                                summary['p99'], summary['max'], summary['throughput']))
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the labeller hot paths on synthetic datasets')
+    parser.add_argument('--images', type = int, default = 10000, help = 'images per dataset (default: 10000)')
+    parser.add_argument('--boxes', default = '0,10,100,1000',
+                        help = 'comma separated box counts, spread over the images (default: 0,10,100,1000)')
+    parser.add_argument('--format', choices = LABEL_FORMATS + ('both',), default = 'both', help = 'label format')
+    parser.add_argument('--size', type = parseSize, default = (640, 480), help = 'image size WIDTHxHEIGHT')
+    parser.add_argument('--cases', default = ','.join(CASES), help = 'comma separated cases (default: all)')
+    parser.add_argument('--samples', type = int, default = DEFAULT_SAMPLES,
+                        help = 'images timed per box count (default: %d)' % DEFAULT_SAMPLES)
+    parser.add_argument('--repeats', type = int, default = DEFAULT_REPEATS,
+                        help = 'runs of the cases timed once per run: scan, written, convert '
+                               '(default: %d)' % DEFAULT_REPEATS)
+    parser.add_argument('--dir', default = os.path.join(tempfile.gettempdir(), 'euclid-bench'),
+                        help = 'folder for the generated datasets, reused between runs')
+    parser.add_argument('--workers', type = int, help = 'worker processes of the convert case')
+    parser.add_argument('--output', help = 'write the results to this JSON file')
+    parser.add_argument('--baseline', help = 'compare with the results of an earlier run')
+    parser.add_argument('--tolerance', type = float, default = DEFAULT_TOLERANCE,
+                        help = 'allowed p50 slowdown against the baseline (default: %.2f)' % DEFAULT_TOLERANCE)
+    parser.add_argument('--noise-ms', type = float, default = DEFAULT_NOISE_MS,
+                        help = 'p50 growth in milliseconds always treated as noise (default: %.2f)' % DEFAULT_NOISE_MS)
+    parser.add_argument('--strict', action = 'store_true', help = 'exit status 1 when a case regressed')
+    args = parser.parse_args(argv)
+
+    cases = [case for case in args.cases.split(',') if case]
+    for case in cases:
+        if case not in CASES:
+            parser.error('unknown case %s, expected one of %s' % (case, ', '.join(CASES)))
+    labelModes = LABEL_FORMATS if args.format == 'both' else (args.format,)
+    boxCounts = [int(count) for count in args.boxes.split(',')]
+    results = runBenchmarks(args.dir, args.images, boxCounts, labelModes, args.size, cases, args.samples,
+                            args.workers, args.repeats)
+    printResults(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print('\n%-28s %12s %12s %8s' % ('case', 'baseline p50', 'p50 ms', 'ratio'))
+        for case, before, after, ratio, slower in compareResults(results, baseline, args.tolerance, args.noise_ms):
+            print('%-28s %12.3f %12.3f %8.2f%s' % (case, before, after, ratio, '  SLOWER' if slower else ''))
+            regressed = regressed or slower
+    return 1 if args.strict and regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+#-------------------------------------------------------------------------------
+# Euclid - annotation model
+# The boxes of one image, kept as array columns (corners, class id and the
+# canvas item drawing the box) instead of parallel Python lists, so the
+# columns cannot drift apart. A uniform grid over the image answers "which
+# box is under the cursor" and "which boxes overlap this one" by looking at
+# a few cells instead of every box, which keeps hit testing fast on crowded
+# images with thousands of boxes. Boxes far larger than the cells (or
+# reaching far outside the image) stay out of the grid and are checked on
+# every query instead.
+#-------------------------------------------------------------------------------
+from array import array
+
+
+# Grid cells are at least this many image pixels wide, and grow to the median
+# box size so that a box lands in a handful of cells
+MIN_CELL_SIZE = 32
+
+# Boxes covering more cells than this are kept in a list of their own, so
+# that indexing one of them costs no more than indexing a typical box
+MAX_BOX_CELLS = 64
+
+
+class BoxList(object):
+
+    __slots__ = ('x1', 'y1', 'x2', 'y2', 'classIds', 'itemIds', 'cellSize', 'grid', 'large')
+
+    def __init__(self, classIds = (), bboxes = ()):
+        self.clear()
+        for classId, bbox in zip(classIds, bboxes):
+            self.append(bbox, classId)
+
+    def __len__(self):
+        return len(self.classIds)
+
+    def clear(self):
+        self.x1, self.y1, self.x2, self.y2 = array('d'), array('d'), array('d'), array('d')
+        self.classIds = array('i')
+        self.itemIds = array('i')
+        self.cellSize = MIN_CELL_SIZE
+        self.grid = None  # {(cellX, cellY): [index, ..]}, built on first query
+        self.large = []  # indices of the boxes left out of the grid
+
+    def bbox(self, index):
+        return (self.x1[index], self.y1[index], self.x2[index], self.y2[index])
+
+    def bboxList(self):
+        return list(zip(self.x1, self.y1, self.x2, self.y2))
+
+    def classIdList(self):
+        return list(self.classIds)
+
+    def itemIdList(self):
+        return list(self.itemIds)
+
+    def area(self, index):
+        return (self.x2[index] - self.x1[index]) * (self.y2[index] - self.y1[index])
+
+    # Returns the index of the new box
+    def append(self, bbox, classId, itemId = -1):
+        index = len(self.classIds)
+        self.x1.append(bbox[0])
+        self.y1.append(bbox[1])
+        self.x2.append(bbox[2])
+        self.y2.append(bbox[3])
+        self.classIds.append(classId)
+        self.itemIds.append(itemId)
+        if self.grid is not None:
+            self.insertCells(index)
+        return index
+
+    # Puts a box back at index, later boxes move up by one
+    def insert(self, index, bbox, classId, itemId = -1):
+        if index >= len(self.classIds):
+            return self.append(bbox, classId, itemId)
+        for column, value in zip((self.x1, self.y1, self.x2, self.y2, self.classIds, self.itemIds),
+                                 (bbox[0], bbox[1], bbox[2], bbox[3], classId, itemId)):
+            column.insert(index, value)
+        self.grid = None
+        return index
+
+    # Removes a box, returns its (bbox, classId, itemId). Later boxes move
+    # down by one index, like the Listbox rows showing them.
+    def pop(self, index):
+        removed = (self.bbox(index), self.classIds[index], self.itemIds[index])
+        for column in (self.x1, self.y1, self.x2, self.y2, self.classIds, self.itemIds):
+            column.pop(index)
+        self.grid = None
+        return removed
+
+    def cellRange(self, x1, y1, x2, y2):
+        size = self.cellSize
+        return int(x1 // size), int(y1 // size), int(x2 // size), int(y2 // size)
+
+    def insertCells(self, index):
+        cx1, cy1, cx2, cy2 = self.cellRange(*self.bbox(index))
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > MAX_BOX_CELLS:
+            self.large.append(index)
+            return
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                self.grid.setdefault((cx, cy), []).append(index)
+
+    def buildGrid(self):
+        count = len(self.classIds)
+        if count > 0:
+            # the median, a few huge boxes must not make the cells huge for all
+            sizes = sorted((self.x2[index] - self.x1[index] + self.y2[index] - self.y1[index]) / 2.0
+                           for index in range(count))
+            self.cellSize = max(MIN_CELL_SIZE, sizes[count // 2])
+        self.grid = {}
+        self.large = []
+        for index in range(count):
+            self.insertCells(index)
+
+    def candidates(self, x1, y1, x2, y2):
+        if self.grid is None:
+            self.buildGrid()
+        cx1, cy1, cx2, cy2 = self.cellRange(x1, y1, x2, y2)
+        found = set(self.large)
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self.grid):
+            # an area larger than the occupied cells, walk those instead
+            for (cx, cy), indices in self.grid.items():
+                if cx1 <= cx <= cx2 and cy1 <= cy <= cy2:
+                    found.update(indices)
+            return found
+        for cy in range(cy1, cy2 + 1):
+            for cx in range(cx1, cx2 + 1):
+                found.update(self.grid.get((cx, cy), ()))
+        return found
+
+    # Indices of the boxes containing the point, smallest box first
+    def hitTest(self, x, y):
+        hits = [index for index in self.candidates(x, y, x, y)
+                if self.x1[index] <= x <= self.x2[index] and self.y1[index] <= y <= self.y2[index]]
+        return sorted(hits, key = self.area)
+
+    # Index of the smallest box under the point (the one visibly on top), or -1
+    def boxAt(self, x, y):
+        hits = self.hitTest(x, y)
+        return hits[0] if len(hits) > 0 else -1
+
+    # Indices of the boxes intersecting bbox, in index order
+    def overlapping(self, bbox):
+        x1, y1, x2, y2 = bbox
+        return sorted(index for index in self.candidates(x1, y1, x2, y2)
+                      if self.x1[index] <= x2 and x1 <= self.x2[index] and
+                         self.y1[index] <= y2 and y1 <= self.y2[index])
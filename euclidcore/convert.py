@@ -0,0 +1,168 @@
+#-------------------------------------------------------------------------------
+# Euclid - headless KITTI <-> YOLO converter
+# Converts every label file of a LabelData folder to the other format, using
+# the same geometry as the labeller (see formats.py). Boxes of a batch of
+# files are converted together with NumPy, batches run on a process pool.
+#
+# Usage:
+#   python -m euclidcore.convert --to yolo /path/to/images
+#   python -m euclidcore.convert --to kitti /path/to/images --workers 8 --output /tmp/LabelData
+#
+# pip install pillow numpy
+#-------------------------------------------------------------------------------
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from euclidcore import formats, scan
+from euclidcore.dims import ImageSizeCache
+
+# Label files handed to a worker at once
+CHUNK_SIZE = 512
+
+
+# Vectorised formats.convert2Yolo, sizes is (N, 2) and boxes (N, 4)
+def convert2YoloArray(sizes, boxes):
+    invWidth = 1. / sizes[:, 0]
+    invHeight = 1. / sizes[:, 1]
+    out = np.empty(boxes.shape, dtype = np.float64)
+    out[:, 0] = invWidth * (boxes[:, 0] + boxes[:, 2]) / 2.0
+    out[:, 1] = invHeight * (boxes[:, 1] + boxes[:, 3]) / 2.0
+    out[:, 2] = invWidth * (boxes[:, 2] - boxes[:, 0])
+    out[:, 3] = invHeight * (boxes[:, 3] - boxes[:, 1])
+    return out
+
+
+# Vectorised formats.getBoundariesFromYolo, yolo is (N, 4) and sizes (N, 2)
+def getBoundariesFromYoloArray(yolo, sizes):
+    imageWidth = sizes[:, 0]
+    imageHeight = sizes[:, 1]
+    out = np.empty(yolo.shape, dtype = np.float64)
+    out[:, 0] = yolo[:, 0]*imageWidth - (yolo[:, 2]*imageWidth)/2
+    out[:, 1] = yolo[:, 1]*imageHeight - (yolo[:, 3]*imageHeight)/2
+    out[:, 2] = yolo[:, 0]*imageWidth + (yolo[:, 2]*imageWidth)/2
+    out[:, 3] = yolo[:, 1]*imageHeight + (yolo[:, 3]*imageHeight)/2
+    return np.trunc(out).astype(np.int64)
+
+
+def listLabelFiles(labelDir):
+    return sorted(entry.name for entry in os.scandir(labelDir)
+                  if entry.name.endswith('.txt') and entry.is_file())
+
+
+# Converts one batch of label files. Each task is (labelName, imagePath or None).
+# Returns the number of converted files and a list of error messages.
+def convertChunk(tasks, target, imageDir, outDir, classes):
+    labelDir = formats.getLabelDir(imageDir)
+    sizeCache = ImageSizeCache(imageDir)
+    imageSizes = sizeCache.getSizes([imagePath for labelName, imagePath in tasks if imagePath is not None])
+    sizeCache.close()
+    imageSizes.reverse()
+    errors = []
+    files = []      # (labelName, rows), a row is either a text line or a box index
+    classIds = []
+    coords = []
+    sizes = []
+    for labelName, imagePath in tasks:
+        try:
+            if imagePath is None:
+                raise ValueError('no image found for label file')
+            size = imageSizes.pop()
+            if size is None:
+                raise ValueError('cannot read image %s' % imagePath)
+            rows = formats.readLabelRows(os.path.join(labelDir, labelName))
+            fileRows = []
+            fileIds = []
+            fileCoords = []
+            for tmp in rows:
+                if formats.isKittiRow(tmp) == (target == 'KITTI'):
+                    # already in the target format, kept as is
+                    fileRows.append(' '.join(tmp) + '\n')
+                elif target == 'YOLO':
+                    fileRows.append(len(classIds) + len(fileIds))
+                    fileIds.append(classes.index(tmp[0]))
+                    # the labeller truncates KITTI boxes to whole pixels on load
+                    fileCoords.append([int(float(v)) for v in tmp[4:8]])
+                else:
+                    classId = int(tmp[0])
+                    if not 0 <= classId < len(classes):
+                        raise ValueError('class %d is not one of the %d classes' % (classId, len(classes)))
+                    fileRows.append(len(classIds) + len(fileIds))
+                    fileIds.append(classId)
+                    fileCoords.append([float(v) for v in tmp[1:5]])
+        except (ValueError, IndexError, IOError, OSError) as e:
+            errors.append('%s: %s' % (labelName, e))
+            continue
+        files.append((labelName, fileRows))
+        classIds.extend(fileIds)
+        coords.extend(fileCoords)
+        sizes.extend([size] * len(fileIds))
+
+    coords = np.asarray(coords, dtype = np.float64).reshape(-1, 4)
+    sizes = np.asarray(sizes, dtype = np.float64).reshape(-1, 2)
+    if target == 'YOLO':
+        converted = convert2YoloArray(sizes, coords)
+    else:
+        converted = getBoundariesFromYoloArray(coords, sizes)
+
+    for labelName, fileRows in files:
+        lines = []
+        for row in fileRows:
+            if not isinstance(row, int):
+                lines.append(row)
+            elif target == 'YOLO':
+                lines.append(formats.formatYoloRow(classIds[row], converted[row]))
+            else:
+                lines.append(formats.formatKittiRow(classes[classIds[row]], converted[row]))
+        try:
+            formats.writeLabelRows(os.path.join(outDir, labelName), lines)
+        except (IOError, OSError) as e:
+            errors.append('%s: %s' % (labelName, e))
+    return len(files), errors
+
+
+def convertDataset(imageDir, target, outDir = None, workers = None, classes = formats.CLASSES):
+    labelDir = formats.getLabelDir(imageDir)
+    if outDir is None:
+        outDir = labelDir
+    formats.makeDirs(outDir)
+    images = {}
+    for imagePath in scan.listImages(imageDir):
+        images[os.path.splitext(os.path.basename(imagePath))[0]] = imagePath
+    tasks = [(name, images.get(os.path.splitext(name)[0])) for name in listLabelFiles(labelDir)]
+    chunks = [tasks[i:i + CHUNK_SIZE] for i in range(0, len(tasks), CHUNK_SIZE)]
+    job = partial(convertChunk, target = target, imageDir = imageDir, outDir = outDir, classes = list(classes))
+    converted = 0
+    errors = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for count, chunkErrors in pool.map(job, chunks):
+            converted += count
+            errors.extend(chunkErrors)
+    return converted, errors
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Convert a LabelData folder between KITTI and YOLO formats')
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('--to', required = True, choices = ['kitti', 'yolo'], help = 'target format')
+    parser.add_argument('--output', help = 'write converted files here instead of rewriting LabelData')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes (default: all cores)')
+    parser.add_argument('--classes', help = 'comma separated class names, in class ID order')
+    args = parser.parse_args(argv)
+
+    classes = args.classes.split(',') if args.classes else formats.CLASSES
+    if not os.path.isdir(formats.getLabelDir(args.imageDir)):
+        parser.error('no %s folder in %s' % (formats.LABEL_DIR_NAME, args.imageDir))
+    converted, errors = convertDataset(args.imageDir, args.to.upper(), args.output, args.workers, classes)
+    for error in errors:
+        sys.stderr.write(error + '\n')
+    print('%d label files converted to %s, %d errors' % (converted, args.to.upper(), len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+#-------------------------------------------------------------------------------
+# Euclid - labelled dataset I/O
+# The labels of a folder of images, read and written the way the labeller
+# does: one KITTI or YOLO text file per image in LabelData, or the SQLite
+# annotation store when the folder has one, with train.txt kept in step.
+# Needs neither Tk nor a display; Pillow is only loaded to read the size of
+# an image whose YOLO labels are read without giving its size.
+#
+#   dataset = Dataset('/path/to/images')
+#   for imagePath in dataset.imagePaths():
+#       labelMode, classIds, bboxes = dataset.readLabels(imagePath)
+#   dataset.close()
+#-------------------------------------------------------------------------------
+import os
+import sqlite3
+import threading
+
+from euclidcore import formats, scan, store
+from euclidcore.trainlist import TrainingList
+
+
+class Dataset(object):
+
+    # Label files, or the boxes of the annotation store, are written by
+    # writer (a LabelWriter) in the background when given, right away otherwise
+    def __init__(self, imageDir, writer = None, classes = formats.CLASSES):
+        self.imageDir = imageDir
+        self.labelDir = formats.getLabelDir(imageDir)
+        self.writer = writer
+        self.classes = classes
+        storePath = store.getStorePath(imageDir)
+        self.store = store.AnnotationStore(storePath) if os.path.exists(storePath) else None
+        self.lock = threading.Lock()
+        self.pending = {}   # label name -> boxes queued for the store, not yet in it
+        self.trainList = TrainingList(imageDir, writer = writer)
+
+    def imagePaths(self):
+        for batch in scan.scanImages(self.imageDir):
+            for imagePath in batch:
+                yield imagePath
+
+    # Images are known by their path below the folder, see formats.getRelPath
+    def getRelPath(self, imagePath):
+        return formats.getRelPath(self.imageDir, imagePath)
+
+    def getLabelName(self, imagePath):
+        return formats.getLabelName(self.imageDir, imagePath)
+
+    # The label file of an archive member is in a subfolder named after the archive
+    def getLabelPath(self, imagePath):
+        return os.path.join(self.labelDir, *(self.getLabelName(imagePath) + '.txt').split('/'))
+
+    # Boxes queued for the store under name, or None when the store is up to date
+    def getPending(self, name):
+        with self.lock:
+            return self.pending.get(name)
+
+    def hasLabels(self, imagePath):
+        if self.store is not None:
+            name = self.getLabelName(imagePath)
+            return self.getPending(name) is not None or self.store.getBoxes(name) is not None
+        labelPath = self.getLabelPath(imagePath)
+        return (self.writer is not None and self.writer.getPending(labelPath) is not None) or \
+               os.path.exists(labelPath)
+
+    # Label names of the images with labels
+    def labelledNames(self):
+        if self.store is not None:
+            with self.lock:
+                names = set(self.pending)
+            return names | self.store.listNames()
+        names = set()
+        folders = [(self.labelDir, '')]
+        while len(folders) > 0:
+            folder, prefix = folders.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.endswith('.txt'):
+                    names.add(prefix + entry.name[:-4])
+                elif entry.name != formats.CACHE_DIR_NAME and entry.is_dir():
+                    folders.append((entry.path, prefix + entry.name + '/'))
+        return names
+
+    # Returns (format or None, classIds, bboxes in image pixels). size is
+    # (width, height), read from the image header when needed and not given.
+    def readLabels(self, imagePath, size = None):
+        if self.store is not None:
+            name = self.getLabelName(imagePath)
+            labels = self.getPending(name) or self.store.getBoxes(name)
+            return labels if labels is not None else (None, [], [])
+        labelPath = self.getLabelPath(imagePath)
+        text = self.writer.getPending(labelPath) if self.writer is not None else None
+        if text is not None:
+            rows = formats.splitLabelRows(text.splitlines())
+        else:
+            rows = formats.readLabelRows(labelPath)
+        if size is None:
+            # KITTI rows are in pixels already
+            size = (0, 0) if all(formats.isKittiRow(row) for row in rows) else formats.readImageSize(imagePath)
+        return formats.parseLabelRows(rows, size[0], size[1], self.classes)
+
+    # Replaces the labels of an image, keeping it listed in train.txt while
+    # it has YOLO boxes. done(error) is called once the labels are stored,
+    # error being None, or once writing them failed; on the writer thread
+    # for label files written in the background.
+    def writeLabels(self, imagePath, labelMode, classIds, bboxes, size, done = None):
+        if self.store is not None:
+            name = self.getLabelName(imagePath)
+            if self.writer is not None:
+                labels = (labelMode, list(classIds), list(bboxes))
+                with self.lock:
+                    self.pending[name] = labels
+                self.writer.submitTask(lambda: self.storeBoxes(name, labels, size, done))
+            else:
+                self.store.setBoxes(name, labelMode, classIds, bboxes, size)
+                if done is not None:
+                    done(None)
+        else:
+            lines = formats.formatLabelRows(labelMode, classIds, bboxes, size[0], size[1], self.classes)
+            labelPath = self.getLabelPath(imagePath)
+            formats.makeDirs(os.path.dirname(labelPath))
+            if self.writer is not None:
+                self.writer.submit(labelPath, ''.join(lines), done)
+            else:
+                formats.writeLabelRows(labelPath, lines)
+                if done is not None:
+                    done(None)
+        if labelMode == 'YOLO' and len(bboxes) > 0:
+            self.trainList.add(imagePath)
+        else:
+            self.trainList.remove(imagePath)
+
+    # Task of the writer thread. A failure is reported to done and, as an
+    # IOError, to the writer, like a label file that could not be written.
+    def storeBoxes(self, name, labels, size, done):
+        error = None
+        try:
+            self.store.setBoxes(name, labels[0], labels[1], labels[2], size)
+        except sqlite3.Error as e:
+            error = IOError('%s: %s' % (name, e))
+        with self.lock:
+            # newer boxes may have been queued meanwhile
+            if self.pending.get(name) is labels:
+                del self.pending[name]
+        if done is not None:
+            done(error)
+        if error is not None:
+            raise error
+
+    def flush(self):
+        self.trainList.flush()
+
+    def close(self):
+        self.flush()
+        if self.store is not None:
+            if self.writer is not None:
+                self.writer.flush()     # boxes still queued for the store
+            self.store.close()
+            self.store = None
@@ -0,0 +1,219 @@
+#-------------------------------------------------------------------------------
+# Euclid - near-duplicate images
+# Folders sampled from video hold long runs of nearly identical frames. Each
+# image gets a 64 bit difference hash (dHash), computed on a process pool and
+# cached in LabelData/.euclid/hashes.sqlite like the image sizes. Images whose
+# hashes differ in at most a few bits are grouped around a representative,
+# the first image of the group in folder order, using a BK-tree so an image
+# is only compared with the representatives close enough to matter.
+# The labeller can then show representatives only, and the labels of a
+# representative can be copied to the rest of its group.
+#
+# Usage:
+#   python -m euclidcore.dedup /path/to/images --distance 6
+#   python -m euclidcore.dedup /path/to/images --copy-labels
+#-------------------------------------------------------------------------------
+import argparse
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from euclidcore import formats, scan
+from euclidcore.dataset import Dataset
+from euclidcore.dims import FileCache, ImageSizeCache
+
+
+HASH_CACHE_NAME = 'hashes.sqlite'
+
+# dHash of HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+
+# Default largest Hamming distance between two images of a group
+DEFAULT_DISTANCE = 6
+
+# Images hashed by a worker at once
+CHUNK_SIZE = 64
+
+
+def dhash(imagePath):
+    from PIL import Image
+    img = Image.open(imagePath)
+    img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))  # JPEGs are decoded at a reduced scale
+    pixels = bytearray(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR).tobytes())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+# Runs in worker processes, returns the hash of every path or None
+def hashChunk(imagePaths):
+    hashes = []
+    for imagePath in imagePaths:
+        try:
+            hashes.append(dhash(imagePath))
+        except (IOError, OSError, ValueError):
+            hashes.append(None)
+    return hashes
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree(object):
+
+    # Nodes are [hash, item, {distance: child node}]
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, item):
+        node = [value, item, {}]
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    # Returns [(distance, item)] of all values within maxDistance, nearest first
+    def search(self, value, maxDistance):
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= maxDistance:
+                found.append((distance, node[1]))
+            for childDistance, child in node[2].items():
+                if distance - maxDistance <= childDistance <= distance + maxDistance:
+                    stack.append(child)
+        found.sort(key = lambda match: match[0])
+        return found
+
+
+class HashCache(FileCache):
+
+    def __init__(self, imageDir):
+        FileCache.__init__(self, imageDir, HASH_CACHE_NAME, 'hashes', ('hash TEXT',))
+
+    # Returns the hash of every path, in order, or None for the ones that
+    # cannot be read. Images new or changed since cached are hashed on a
+    # process pool. Its workers are spawned, not forked: the labeller calls
+    # this from a thread of a process running Tk and other threads, and a
+    # forked child inherits their locks in whatever state they were in.
+    def getHashes(self, imagePaths, workers = None):
+        names, values, missing = self.lookup(imagePaths)
+        hashes = [int(value[0], 16) if value is not None else None for value in values]
+        if len(missing) == 0:
+            return hashes
+        chunks = [missing[start:start + CHUNK_SIZE] for start in range(0, len(missing), CHUNK_SIZE)]
+        rows = []
+        with ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context('spawn')) as pool:
+            results = pool.map(hashChunk, [[imagePaths[index] for index, st in chunk] for chunk in chunks])
+            for chunk, chunkHashes in zip(chunks, results):
+                for (index, st), value in zip(chunk, chunkHashes):
+                    if value is not None:
+                        hashes[index] = value
+                        rows.append((names[index], st.st_mtime_ns, st.st_size, '%016x' % value))
+        self.store(rows)
+        return hashes
+
+
+# Groups images in name order, so frames of a video are grouped with their
+# neighbours and the first frame of a run represents it: an image joins the nearest representative
+# within maxDistance, or becomes one. Unreadable images stay on their own.
+# Returns an OrderedDict {representative: [other members]}.
+def clusterImages(imagePaths, hashes, maxDistance = DEFAULT_DISTANCE):
+    clusters = OrderedDict()
+    tree = BKTree()
+    for imagePath, value in sorted(zip(imagePaths, hashes), key = lambda pair: pair[0]):
+        matches = tree.search(value, maxDistance) if value is not None else []
+        if len(matches) > 0:
+            clusters[matches[0][1]].append(imagePath)
+        else:
+            clusters[imagePath] = []
+            if value is not None:
+                tree.add(value, imagePath)
+    return clusters
+
+
+def findDuplicates(imageDir, maxDistance = DEFAULT_DISTANCE, workers = None):
+    imagePaths = scan.listImages(imageDir)
+    cache = HashCache(imageDir)
+    try:
+        hashes = cache.getHashes(imagePaths, workers)
+    finally:
+        cache.close()
+    return clusterImages(imagePaths, hashes, maxDistance)
+
+
+# Boxes in image pixels of an image of size, moved to an image of newSize
+def scaleBoxes(bboxes, size, newSize):
+    scaleX, scaleY = float(newSize[0]) / size[0], float(newSize[1]) / size[1]
+    return [(bbox[0] * scaleX, bbox[1] * scaleY, bbox[2] * scaleX, bbox[3] * scaleY) for bbox in bboxes]
+
+
+# Copies the labels of every representative to the members of its group,
+# into the annotation store when the dataset has one, else into LabelData.
+# Members with labels of their own are left alone unless overwrite is set.
+# Returns the number of images labelled.
+def copyLabels(imageDir, clusters, overwrite = False, classes = formats.CLASSES):
+    dataset = Dataset(imageDir, classes = classes)
+    sizeCache = ImageSizeCache(imageDir)
+    copied = 0
+    try:
+        for representative, members in clusters.items():
+            if len(members) == 0:
+                continue
+            sizes = sizeCache.getSizes([representative] + members)
+            if sizes[0] is None:
+                continue
+            labelMode, classIds, bboxes = dataset.readLabels(representative, sizes[0])
+            if len(classIds) == 0:
+                continue
+            labelMode = labelMode or 'KITTI'
+            for member, size in zip(members, sizes[1:]):
+                if size is None or (not overwrite and dataset.hasLabels(member)):
+                    continue
+                dataset.writeLabels(member, labelMode, classIds, scaleBoxes(bboxes, sizes[0], size), size)
+                copied += 1
+    finally:
+        dataset.close()
+        sizeCache.close()
+    return copied
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Group near-duplicate images of a folder')
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('--distance', type = int, default = DEFAULT_DISTANCE,
+                        help = 'largest number of differing hash bits within a group (default: %d)' % DEFAULT_DISTANCE)
+    parser.add_argument('--copy-labels', action = 'store_true',
+                        help = 'copy the labels of each representative to the unlabelled images of its group')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'with --copy-labels, replace existing labels too')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    clusters = findDuplicates(args.imageDir, args.distance, args.workers)
+    total = sum(1 + len(members) for members in clusters.values())
+    print('%d images in %d groups' % (total, len(clusters)))
+    for representative, members in clusters.items():
+        if len(members) > 0:
+            print('%s: %d near-duplicates' % (os.path.basename(representative), len(members)))
+    if args.copy_labels:
+        print('%d images labelled' % copyLabels(args.imageDir, clusters, args.overwrite))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
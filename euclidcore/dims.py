@@ -0,0 +1,94 @@
+#-------------------------------------------------------------------------------
+# Euclid - image dimension cache
+# Width and height of the images of a dataset, read from the file headers
+# only (pixels are never decoded) and kept in LabelData/.euclid/dims.sqlite.
+# Entries are keyed by file name and checked against the file mtime and size,
+# so a replaced image is read again. Used wherever boxes are normalised to
+# or from YOLO coordinates.
+#-------------------------------------------------------------------------------
+import os
+import threading
+
+from euclidcore import formats
+
+
+CACHE_NAME = 'dims.sqlite'
+
+# Names looked up per query
+LOOKUP_BATCH = 500
+
+
+# Values computed from image files, kept in a cache database table of
+# (name, mtime, size, <columns>) rows. A row is only used while the mtime
+# and size of its file are unchanged.
+class FileCache(object):
+
+    def __init__(self, imageDir, cacheName, table, columns):
+        self.lock = threading.RLock()
+        self.table = table
+        self.columns = columns
+        self.conn = formats.openCacheDb(imageDir, cacheName,
+                                        'CREATE TABLE IF NOT EXISTS %s (name TEXT PRIMARY KEY, mtime INTEGER, '
+                                        'size INTEGER, %s);' % (table, ', '.join(columns)))
+
+    # Returns (names, values, missing): the file name of every path, the
+    # cached values of every path or None, and [(index, stat)] of the files
+    # that exist but have no valid row
+    def lookup(self, imagePaths):
+        names = [os.path.basename(imagePath) for imagePath in imagePaths]
+        cached = {}
+        with self.lock:
+            for start in range(0, len(names), LOOKUP_BATCH):
+                batch = names[start:start + LOOKUP_BATCH]
+                query = 'SELECT * FROM %s WHERE name IN (%s)' % (self.table, ','.join('?' * len(batch)))
+                for row in self.conn.execute(query, batch):
+                    cached[row[0]] = row[1:]
+        values = [None] * len(imagePaths)
+        missing = []
+        for index, (imagePath, name) in enumerate(zip(imagePaths, names)):
+            try:
+                st = os.stat(imagePath)
+            except OSError:
+                continue
+            row = cached.get(name)
+            if row is not None and row[0] == st.st_mtime_ns and row[1] == st.st_size:
+                values[index] = row[2:]
+            else:
+                missing.append((index, st))
+        return names, values, missing
+
+    # rows are (name, mtime, size, <columns>)
+    def store(self, rows):
+        if len(rows) > 0:
+            with self.lock, self.conn:
+                self.conn.executemany('INSERT OR REPLACE INTO %s VALUES (%s)'
+                                      % (self.table, ','.join('?' * (len(self.columns) + 3))), rows)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class ImageSizeCache(FileCache):
+
+    def __init__(self, imageDir):
+        FileCache.__init__(self, imageDir, CACHE_NAME, 'sizes', ('width INTEGER', 'height INTEGER'))
+
+    def getSize(self, imagePath):
+        return self.getSizes([imagePath])[0]
+
+    # Returns the (width, height) of every path, in order, or None for the
+    # ones that cannot be read. Only the images that are new or changed since
+    # they were cached have their header read.
+    def getSizes(self, imagePaths):
+        names, sizes, missing = self.lookup(imagePaths)
+        rows = []
+        for index, st in missing:
+            try:
+                size = formats.readImageSize(imagePaths[index])
+            except (IOError, OSError):
+                continue
+            sizes[index] = size
+            rows.append((names[index], st.st_mtime_ns, st.st_size, size[0], size[1]))
+        self.store(rows)
+        return sizes
@@ -0,0 +1,181 @@
+#-------------------------------------------------------------------------------
+# Euclid - label file helpers
+# Reading, writing and geometry of KITTI / YOLO label files, shared by the
+# GUI and the batch tools. See euclid.py for the description of both formats.
+#-------------------------------------------------------------------------------
+import os
+
+
+# Object Classes (No spaces in name)
+CLASSES = ['Class0', 'Class1', 'Class2', 'Class3', 'Class4', 'Class5', 'Class6', 'Class7']
+
+# Name of the label folder, created next to the images
+LABEL_DIR_NAME = 'LabelData'
+
+
+# Caches kept by the tools (image listing etc.), inside LabelData
+CACHE_DIR_NAME = '.euclid'
+
+
+def getLabelDir(imageDir):
+    return os.path.join(imageDir, LABEL_DIR_NAME)
+
+
+def getCacheDir(imageDir):
+    return os.path.join(getLabelDir(imageDir), CACHE_DIR_NAME)
+
+
+# Path of an image below its folder, '/' separated: the file name for the
+# images of the folder, the archive and member name for archive members
+# (shard-0001.tar/images/000123.jpg), so that members named alike in
+# different archives or subfolders are told apart
+def getRelPath(imageDir, imagePath):
+    prefix = os.path.join(imageDir, '')
+    if imagePath.startswith(prefix):
+        relPath = imagePath[len(prefix):]
+    else:
+        relPath = os.path.relpath(imagePath, imageDir)
+    return relPath.replace(os.sep, '/')
+
+
+# Name the labels of an image are kept under: its path below the folder,
+# without extension. LabelData/<name>.txt is its label file.
+def getLabelName(imageDir, imagePath):
+    return os.path.splitext(getRelPath(imageDir, imagePath))[0]
+
+
+def makeDirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+
+# SQLite database name in the cache folder, with the tables of schema. It
+# keeps the rollback journal rather than WAL, the folder may be shared by
+# several hosts over a network file system (see lease.py). A read-only
+# dataset gets an in-memory database, which lives as long as the connection.
+def openCacheDb(imageDir, name, schema):
+    import sqlite3
+    path = os.path.join(getCacheDir(imageDir), name)
+    try:
+        makeDirs(os.path.dirname(path))
+        conn = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+        conn.execute('PRAGMA journal_mode=DELETE')
+        conn.executescript(schema)
+    except (OSError, sqlite3.Error):
+        conn = sqlite3.connect(':memory:', check_same_thread = False)
+        conn.executescript(schema)
+    return conn
+
+
+# Temporary file for an atomic write of path, unique per host and process so
+# that several annotators sharing a folder never write to the same one
+def getTempPath(path):
+    return '%s.%s-%d.tmp' % (path, getHostName(), os.getpid())
+
+
+HOST_NAME = None
+
+
+def getHostName():
+    global HOST_NAME
+    if HOST_NAME is None:
+        import socket
+        HOST_NAME = socket.gethostname()
+    return HOST_NAME
+
+
+# Reads a label file into rows of whitespace separated fields.
+# A missing label file simply means the image has no boxes yet.
+def readLabelRows(labelPath):
+    if not os.path.exists(labelPath):
+        return []
+    with open(labelPath) as f:
+        return splitLabelRows(f)
+
+
+def splitLabelRows(lines):
+    rows = []
+    for line in lines:
+        tmp = line.split()
+        if len(tmp) > 0:
+            rows.append(tmp)
+    return rows
+
+
+# KITTI rows carry 15 fields, YOLO rows only 5
+def isKittiRow(tmp):
+    return len(tmp) > 5
+
+
+# Turns label rows into class IDs and pixel boxes, the way the labeller
+# loads them. Returns (format of the last row or None, classIds, bboxes).
+def parseLabelRows(rows, imageWidth, imageHeight, classes = CLASSES):
+    labelMode = None
+    classIds = []
+    bboxes = []
+    for tmp in rows:
+        if isKittiRow(tmp):
+            labelMode = 'KITTI'
+            bboxes.append((int(float(tmp[4])), int(float(tmp[5])), int(float(tmp[6])), int(float(tmp[7]))))
+            classIds.append(classes.index(tmp[0]))
+        else:
+            labelMode = 'YOLO'
+            bboxes.append(getBoundariesFromYolo(float(tmp[1]), float(tmp[2]), float(tmp[3]), float(tmp[4]),
+                                                imageWidth, imageHeight))
+            classIds.append(int(tmp[0]))
+    return labelMode, classIds, bboxes
+
+
+# Label file lines for boxes in pixels, in the given format
+def formatLabelRows(labelMode, classIds, bboxes, imageWidth, imageHeight, classes = CLASSES):
+    if labelMode == 'KITTI':
+        return [formatKittiRow(classes[classId], bbox) for classId, bbox in zip(classIds, bboxes)]
+    return [formatYoloRow(classId, convert2Yolo((imageWidth, imageHeight), bbox))
+            for classId, bbox in zip(classIds, bboxes)]
+
+
+# Reads only the image header, pixels are never decoded
+def readImageSize(imagePath):
+    from PIL import Image
+    img = Image.open(imagePath)
+    try:
+        return img.size
+    finally:
+        img.close()
+
+
+def getBoundariesFromYolo(centerX, centerY, width, height, imageWidth, imageHeight):
+    topLeftX = (int)(centerX*imageWidth - (width*imageWidth)/2)
+    topLeftY = (int)(centerY*imageHeight - (height*imageHeight)/2)
+    bottomRightX = (int)(centerX*imageWidth + (width*imageWidth)/2)
+    bottomRightY = (int)(centerY*imageHeight + (height*imageHeight)/2)
+    return topLeftX, topLeftY, bottomRightX, bottomRightY
+
+
+def convert2Yolo(image, boxCoords):
+    invWidth = 1./image[0]
+    invHeight = 1./image[1]
+    x = invWidth * (boxCoords[0] + boxCoords[2])/2.0
+    y = invHeight * (boxCoords[1] + boxCoords[3])/2.0
+    boxWidth = invWidth * (boxCoords[2] - boxCoords[0])
+    boxHeight = invHeight * (boxCoords[3] - boxCoords[1])
+    return (x,y,boxWidth,boxHeight)
+
+
+##class1 0 0 0 x1,y1,x2,y2 0,0,0 0,0,0 0 0
+# fields ignored by DetectNet: alpha, scenario, roty, occlusion, dimensions, location.
+def formatKittiRow(className, bbox):
+    return '%s 0.0 0 0.0 %.2f %.2f %.2f %.2f 0.0 0.0 0.0 0.0 0.0 0.0 0.0 0.0 \n' % \
+                (className, bbox[0], bbox[1], bbox[2], bbox[3])
+
+
+##class1 center_box_x_ratio center_box_y_ratio width_ratio height_ratio
+def formatYoloRow(classId, yoloBox):
+    return '%s %.7f %.7f %.7f %.7f\n' % (classId, yoloBox[0], yoloBox[1], yoloBox[2], yoloBox[3])
+
+
+# Written to a temporary file first, so readers never see a partial file
+def writeLabelRows(labelPath, lines):
+    with open(getTempPath(labelPath), 'w') as f:
+        f.write(''.join(lines))
+    os.replace(getTempPath(labelPath), labelPath)
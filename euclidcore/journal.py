@@ -0,0 +1,165 @@
+#-------------------------------------------------------------------------------
+# Euclid - edit journal
+# Every box added, deleted or cleared in the labeller is appended to a journal
+# in LabelData/.euclid as one JSON line, flushed to the OS at once, so a crash
+# or a killed window loses nothing drawn since the last save. The first edit
+# of an image after loading or saving it records the boxes it started from,
+# so an image can be rebuilt from the journal alone. Saving an image writes a
+# saved mark once its label file is on disk; on the next load, the images
+# with edits after their last mark are written again from the journal.
+#
+# Records carry an increasing sequence number. A saved mark covers the
+# records of its image up to the number current when the save was queued,
+# which keeps edits made while the label writer catches up. Once the journal
+# grows past COMPACT_BYTES it is rewritten with one record per image that
+# still has unsaved edits.
+#-------------------------------------------------------------------------------
+import getpass
+import json
+import os
+import socket
+import threading
+from collections import OrderedDict
+
+from euclidcore import formats
+
+
+COMPACT_BYTES = 1 << 20
+
+
+def getJournalPath(imageDir):
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'unknown'
+    return os.path.join(formats.getCacheDir(imageDir), 'journal-%s@%s.jsonl' % (user, socket.gethostname()))
+
+
+# Applies an edit record to the class IDs and boxes of an image, in place
+def applyRecord(classIds, bboxes, record):
+    op = record['op']
+    if op in ('begin', 'set'):
+        classIds[:] = record['classIds']
+        bboxes[:] = [tuple(bbox) for bbox in record['bboxes']]
+    elif op == 'add':
+        classIds.insert(record['index'], record['classId'])
+        bboxes.insert(record['index'], tuple(record['bbox']))
+    elif op == 'delete':
+        del classIds[record['index']]
+        del bboxes[record['index']]
+
+
+def readRecords(path):
+    records = []
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass  # a line cut short by the crash
+    except (IOError, OSError):
+        pass
+    return records
+
+
+# Replays records, returns {imagePath: [seq, labelMode, size, classIds, bboxes]}
+# for the images with edits not covered by a saved mark
+def replayRecords(records):
+    edits = OrderedDict()   # imagePath -> records since the last saved mark
+    for record in records:
+        imagePath = record.get('image')
+        if record.get('op') == 'saved':
+            kept = [edit for edit in edits.get(imagePath, ()) if edit['seq'] > record['upto']]
+            if len(kept) > 0:
+                edits[imagePath] = kept
+            else:
+                edits.pop(imagePath, None)
+        elif imagePath is not None:
+            edits.setdefault(imagePath, []).append(record)
+    unsaved = OrderedDict()
+    for imagePath, imageEdits in edits.items():
+        state = None
+        for record in imageEdits:
+            if record['op'] == 'begin':
+                state = [record['seq'], record['labelMode'], tuple(record['size']), [], []]
+            elif state is None:
+                continue    # the edits before it were saved, the base is gone with them
+            applyRecord(state[3], state[4], record)
+            state[0] = record['seq']
+        if state is not None:
+            unsaved[imagePath] = state
+    return unsaved
+
+
+class EditJournal(object):
+
+    def __init__(self, imageDir):
+        self.path = getJournalPath(imageDir)
+        self.lock = threading.Lock()
+        formats.makeDirs(os.path.dirname(self.path))
+        self.seq = max([record.get('seq', 0) for record in readRecords(self.path)] + [0])
+        self.f = open(self.path, 'a')
+
+    def append(self, record):
+        with self.lock:
+            self.seq += 1
+            record['seq'] = self.seq
+            self.f.write(json.dumps(record, separators = (',', ':')) + '\n')
+            self.f.flush()
+            return self.seq
+
+    # Boxes an image starts from, before its first edit since loaded or saved
+    def begin(self, imagePath, labelMode, size, classIds, bboxes):
+        return self.append({'op': 'begin', 'image': imagePath, 'labelMode': labelMode, 'size': list(size),
+                            'classIds': list(classIds), 'bboxes': [list(bbox) for bbox in bboxes]})
+
+    def add(self, imagePath, index, classId, bbox):
+        return self.append({'op': 'add', 'image': imagePath, 'index': index, 'classId': classId,
+                            'bbox': list(bbox)})
+
+    def delete(self, imagePath, index):
+        return self.append({'op': 'delete', 'image': imagePath, 'index': index})
+
+    # Replaces all boxes: Clear All, and undoing it
+    def set(self, imagePath, classIds, bboxes):
+        return self.append({'op': 'set', 'image': imagePath,
+                            'classIds': list(classIds), 'bboxes': [list(bbox) for bbox in bboxes]})
+
+    # The labels of imagePath on disk hold every edit up to record upto.
+    # Runs on the label writer thread, after the write.
+    def markSaved(self, imagePath, upto):
+        self.append({'op': 'saved', 'image': imagePath, 'upto': upto})
+        if os.path.getsize(self.path) > COMPACT_BYTES:
+            self.compact()
+
+    # {imagePath: (labelMode, size, classIds, bboxes)} of the images whose
+    # latest edits never reached their label file
+    def recover(self):
+        with self.lock:
+            self.f.flush()
+            unsaved = replayRecords(readRecords(self.path))
+        return OrderedDict((imagePath, tuple(state[1:])) for imagePath, state in unsaved.items())
+
+    # Rewrites the journal with the current boxes of the images with unsaved edits
+    def compact(self):
+        with self.lock:
+            self.f.flush()
+            unsaved = replayRecords(readRecords(self.path))
+            with open(formats.getTempPath(self.path), 'w') as f:
+                for imagePath, (seq, labelMode, size, classIds, bboxes) in unsaved.items():
+                    f.write(json.dumps({'op': 'begin', 'image': imagePath, 'labelMode': labelMode,
+                                        'size': list(size), 'classIds': classIds,
+                                        'bboxes': [list(bbox) for bbox in bboxes], 'seq': seq},
+                                       separators = (',', ':')) + '\n')
+            self.f.close()
+            os.replace(formats.getTempPath(self.path), self.path)
+            self.f = open(self.path, 'a')
+
+    # Compacts a last time; a journal with nothing unsaved is removed
+    def close(self):
+        self.compact()
+        with self.lock:
+            self.f.close()
+            if os.path.getsize(self.path) == 0:
+                os.remove(self.path)
@@ -0,0 +1,119 @@
+#-------------------------------------------------------------------------------
+# Euclid - work leases for several annotators
+# Annotators labelling one shared folder each take chunks of the image list
+# from a lease table in LabelData/.euclid/leases.sqlite. A chunk is leased to
+# one annotator for LEASE_SECONDS and the lease is renewed on a heartbeat
+# while Euclid runs. Images are marked done once their labels are written, so
+# the chunk of an annotator who quit or crashed is handed out again when its
+# lease runs out, without the images labelled so far.
+#
+# The table lives on the shared folder, which may be a network file system,
+# so it keeps SQLite's default rollback journal rather than WAL.
+#-------------------------------------------------------------------------------
+import getpass
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from euclidcore import formats
+
+
+LEASE_NAME = 'leases.sqlite'
+
+# Images leased at once, seconds a lease lasts, and seconds between renewals
+CHUNK_SIZE = 50
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 60
+
+LOOKUP_BATCH = 500
+
+
+def getAnnotatorId():
+    try:
+        user = getpass.getuser()
+    except Exception:
+        user = 'unknown'
+    return '%s@%s:%d' % (user, socket.gethostname(), os.getpid())
+
+
+class LeaseTable(object):
+
+    def __init__(self, imageDir, annotator = None):
+        self.lock = threading.Lock()
+        self.annotator = annotator or getAnnotatorId()
+        path = os.path.join(formats.getCacheDir(imageDir), LEASE_NAME)
+        formats.makeDirs(os.path.dirname(path))
+        # autocommit, transactions are opened explicitly
+        self.conn = sqlite3.connect(path, timeout = 30, isolation_level = None, check_same_thread = False)
+        self.conn.execute('CREATE TABLE IF NOT EXISTS leases (name TEXT PRIMARY KEY, owner TEXT, '
+                          'expires REAL, done INTEGER NOT NULL DEFAULT 0)')
+
+    # Adds the images not in the table yet
+    def register(self, names):
+        names = list(names)
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                for start in range(0, len(names), LOOKUP_BATCH):
+                    self.conn.executemany('INSERT OR IGNORE INTO leases (name) VALUES (?)',
+                                          [(name,) for name in names[start:start + LOOKUP_BATCH]])
+                self.conn.execute('COMMIT')
+            except sqlite3.Error:
+                self.conn.execute('ROLLBACK')
+                raise
+
+    # Leases up to count images not done yet, in name order: the ones this
+    # annotator holds first, then free or expired ones. Returns their names.
+    def claim(self, count = CHUNK_SIZE):
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                names = [row[0] for row in self.conn.execute(
+                    'SELECT name FROM leases WHERE done = 0 AND (owner IS NULL OR owner = ? OR expires < ?) '
+                    'ORDER BY owner = ? DESC, name LIMIT ?', (self.annotator, now, self.annotator, count))]
+                self.conn.executemany('UPDATE leases SET owner = ?, expires = ? WHERE name = ?',
+                                      [(self.annotator, now + LEASE_SECONDS, name) for name in names])
+                self.conn.execute('COMMIT')
+            except sqlite3.Error:
+                self.conn.execute('ROLLBACK')
+                raise
+        return names
+
+    # Extends every lease held, returns how many
+    def renew(self):
+        with self.lock:
+            return self.conn.execute('UPDATE leases SET expires = ? WHERE owner = ? AND done = 0',
+                                     (time.time() + LEASE_SECONDS, self.annotator)).rowcount
+
+    # True while this annotator may write the labels of name
+    def owns(self, name):
+        with self.lock:
+            row = self.conn.execute('SELECT owner, expires, done FROM leases WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return True     # not a shared image
+        owner, expires, done = row
+        if owner == self.annotator:
+            return True
+        return owner is None or (done == 0 and expires < time.time())
+
+    def markDone(self, name):
+        with self.lock:
+            self.conn.execute('UPDATE leases SET done = 1, owner = ? WHERE name = ?', (self.annotator, name))
+
+    # Gives back the images leased and not done
+    def release(self):
+        with self.lock:
+            self.conn.execute('UPDATE leases SET owner = NULL, expires = NULL WHERE owner = ? AND done = 0',
+                              (self.annotator,))
+
+    # Returns (images done, images in the table)
+    def progress(self):
+        with self.lock:
+            return self.conn.execute('SELECT COALESCE(SUM(done), 0), COUNT(*) FROM leases').fetchone()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,62 @@
+#-------------------------------------------------------------------------------
+# Euclid - inter-process file locks
+# Serialises the read-modify-write of files shared by several Euclid
+# instances (train.txt, the recent folders list) on one machine or across a
+# network share. POSIX record locks are used on Unix, as they also work over
+# NFS, and msvcrt byte range locks on Windows.
+#-------------------------------------------------------------------------------
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+# Seconds to wait for another process to release a lock
+LOCK_TIMEOUT = 30
+LOCK_POLL = 0.05
+
+
+class FileLock(object):
+
+    # Locks path, a lock file of its own next to the file it protects
+    def __init__(self, path, timeout = LOCK_TIMEOUT):
+        self.path = path
+        self.timeout = timeout
+        self.f = None
+
+    def tryLock(self):
+        try:
+            if fcntl is not None:
+                fcntl.lockf(self.f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except (IOError, OSError):
+            return False
+
+    def __enter__(self):
+        self.f = open(self.path, 'a+')
+        deadline = time.time() + self.timeout
+        while not self.tryLock():
+            if time.time() > deadline:
+                self.f.close()
+                self.f = None
+                raise IOError('timed out waiting for the lock %s' % self.path)
+            time.sleep(LOCK_POLL)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if fcntl is not None:
+                fcntl.lockf(self.f.fileno(), fcntl.LOCK_UN)
+            else:
+                self.f.seek(0)
+                msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.f.close()
+            self.f = None
+        return False
@@ -0,0 +1,99 @@
+#-------------------------------------------------------------------------------
+# Euclid - retained mode canvas overlay
+# Owns the canvas items drawn over the image: the crosshair, the rubber band
+# of the box being drawn and the boxes themselves. Items are created once
+# and then moved, recoloured or hidden in place instead of being deleted and
+# created again; box items are recycled from image to image. Zoom and pan
+# move all boxes with one canvas scale/move call.
+# Works with any object offering the Tk Canvas item methods used below.
+#-------------------------------------------------------------------------------
+
+
+BOX_TAG = 'box'
+LINE_WIDTH = 2
+SELECTED_WIDTH = 4
+
+
+class CanvasOverlay(object):
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.viewX = self.viewY = 0.0
+        self.zoom = 1.0
+        self.free = []  # hidden box items ready for reuse
+        self.hl = canvas.create_line(0, 0, 0, 0, width = LINE_WIDTH, state = 'hidden')
+        self.vl = canvas.create_line(0, 0, 0, 0, width = LINE_WIDTH, state = 'hidden')
+        self.rubberBand = canvas.create_rectangle(0, 0, 0, 0, width = LINE_WIDTH, state = 'hidden', tags = BOX_TAG)
+        self.rubberBandShown = False
+        self.raiseNeeded = False  # new box items were created above the crosshair
+        self.selected = None
+
+    def toCanvasBox(self, bbox):
+        return ((bbox[0] - self.viewX) * self.zoom, (bbox[1] - self.viewY) * self.zoom,
+                (bbox[2] - self.viewX) * self.zoom, (bbox[3] - self.viewY) * self.zoom)
+
+    # Moves every box (and the rubber band) to a new zoom / pan
+    def setView(self, viewX, viewY, zoom):
+        factor = zoom / self.zoom
+        if factor != 1.0:
+            self.canvas.scale(BOX_TAG, 0, 0, factor, factor)
+        dx, dy = (self.viewX - viewX) * zoom, (self.viewY - viewY) * zoom
+        if dx != 0 or dy != 0:
+            self.canvas.move(BOX_TAG, dx, dy)
+        self.viewX, self.viewY, self.zoom = viewX, viewY, zoom
+
+    # Boxes are given in image pixels, returns the canvas item id
+    def addBox(self, bbox, color):
+        coords = self.toCanvasBox(bbox)
+        if len(self.free) > 0:
+            itemId = self.free.pop()
+            self.canvas.coords(itemId, *coords)
+            self.canvas.itemconfig(itemId, outline = color, state = 'normal')
+        else:
+            itemId = self.canvas.create_rectangle(*coords, width = LINE_WIDTH, outline = color, tags = BOX_TAG)
+            self.raiseNeeded = True
+        return itemId
+
+    def removeBox(self, itemId):
+        if itemId == self.selected:
+            self.selectBox(None)
+        self.canvas.itemconfig(itemId, state = 'hidden')
+        self.free.append(itemId)
+
+    def clearBoxes(self, itemIds):
+        for itemId in itemIds:
+            self.removeBox(itemId)
+
+    # Draws one box (or none) with a thicker outline
+    def selectBox(self, itemId):
+        if self.selected is not None:
+            self.canvas.itemconfig(self.selected, width = LINE_WIDTH)
+        if itemId is not None:
+            self.canvas.itemconfig(itemId, width = SELECTED_WIDTH)
+        self.selected = itemId
+
+    # (x, y) in canvas coordinates, the lines end at (right, bottom)
+    def showCrosshair(self, x, y, right, bottom):
+        self.canvas.coords(self.hl, 0, y, right, y)
+        self.canvas.coords(self.vl, x, 0, x, bottom)
+        self.canvas.itemconfig(self.hl, state = 'normal')
+        self.canvas.itemconfig(self.vl, state = 'normal')
+        if self.raiseNeeded:
+            self.canvas.tag_raise(self.rubberBand)
+            self.canvas.tag_raise(self.hl)
+            self.canvas.tag_raise(self.vl)
+            self.raiseNeeded = False
+
+    def showRubberBand(self, bbox, color):
+        self.canvas.coords(self.rubberBand, *self.toCanvasBox(bbox))
+        if self.rubberBandShown:
+            self.canvas.itemconfig(self.rubberBand, outline = color)
+        else:
+            self.canvas.itemconfig(self.rubberBand, outline = color, state = 'normal')
+            self.canvas.tag_raise(self.rubberBand)
+            self.rubberBandShown = True
+
+    def hideRubberBand(self):
+        if self.rubberBandShown:
+            self.canvas.itemconfig(self.rubberBand, state = 'hidden')
+            self.rubberBandShown = False
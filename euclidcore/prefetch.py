@@ -0,0 +1,122 @@
+#-------------------------------------------------------------------------------
+# Euclid - background image prefetch
+# Decodes the images around the current one (and parses their label files)
+# on a worker pool while the current image is on screen. Decoded images are
+# kept in an LRU cache bounded by their in-memory size, so that navigating
+# only has to hand the decoded image over to Tk.
+#-------------------------------------------------------------------------------
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PrefetchEntry(object):
+    __slots__ = ('image', 'labels', 'nbytes')
+
+    def __init__(self, image, labels):
+        self.image = image
+        self.labels = labels
+        self.nbytes = image.nbytes()
+
+
+class ImagePrefetcher(object):
+
+    # imageLoader(key) must return a decoded image with an nbytes() method
+    # (an ImagePyramid with its display level decoded) and labelLoader(key, image)
+    # the labels of that image. Both run on worker threads.
+    def __init__(self, imageLoader, labelLoader, maxBytes = 512 << 20, workers = 2):
+        self.imageLoader = imageLoader
+        self.labelLoader = labelLoader
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()
+        self.cacheBytes = 0
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+
+    def load(self, key):
+        try:
+            image = self.imageLoader(key)
+            entry = PrefetchEntry(image, self.labelLoader(key, image))
+        except Exception:
+            with self.lock:
+                self.pending.pop(key, None)
+            raise
+        with self.lock:
+            self.pending.pop(key, None)
+            self.store(key, entry)
+        return entry
+
+    def store(self, key, entry):
+        old = self.cache.pop(key, None)
+        if old is not None:
+            self.cacheBytes -= old.nbytes
+        self.cache[key] = entry
+        self.cacheBytes += entry.nbytes
+        # evict least recently used, but never the entry just stored
+        while self.cacheBytes > self.maxBytes and len(self.cache) > 1:
+            oldKey, old = self.cache.popitem(last = False)
+            self.cacheBytes -= old.nbytes
+
+    # Returns the entry for key, waiting for its prefetch if it is in flight
+    # or decoding it right away if it was never requested.
+    def get(self, key):
+        with self.lock:
+            entry = self.cache.pop(key, None)
+            if entry is not None:
+                self.cache[key] = entry
+            future = self.pending.get(key)
+        if entry is None:
+            if future is not None:
+                entry = future.result()
+            else:
+                entry = self.load(key)
+        if entry.labels is None:
+            entry.labels = self.labelLoader(key, entry.image)
+        return entry
+
+    # Queues the given keys (most urgent first) for decoding, and cancels
+    # queued work that is no longer wanted, e.g. after a jump with gotoImage.
+    def schedule(self, keys):
+        with self.lock:
+            wanted = set(keys)
+            for key in list(self.pending):
+                if key not in wanted and self.pending[key].cancel():
+                    del self.pending[key]
+            for key in keys:
+                if key in self.cache or key in self.pending:
+                    continue
+                self.pending[key] = self.executor.submit(self.load, key)
+
+    # Levels of the image of key were decoded or released since it was
+    # stored, counts it again and evicts others if the cache grew too big
+    def updateBytes(self, key):
+        with self.lock:
+            entry = self.cache.pop(key, None)
+            if entry is not None:
+                self.cacheBytes -= entry.nbytes
+                entry.nbytes = entry.image.nbytes()
+                self.store(key, entry)
+
+    # The label file of key was rewritten, parse it again on next get()
+    def forgetLabels(self, key):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry.labels = None
+
+    # The labels of key were saved, keeps the cached copy in step
+    def setLabels(self, key, labels):
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None:
+                entry.labels = labels
+
+    def close(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending = {}
+            self.cache.clear()
+            self.cacheBytes = 0
+        self.executor.shutdown(wait = False)
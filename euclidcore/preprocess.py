@@ -0,0 +1,222 @@
+#-------------------------------------------------------------------------------
+# Euclid - batch image preprocessing
+# Resizes, letterboxes or re-encodes a folder of images on a process pool,
+# and rewrites the matching LabelData files (KITTI or YOLO, whichever each
+# file uses) for the new image geometry, so existing labels stay valid.
+# Images are streamed from the folder scan, and outputs newer than both
+# their image and label file are skipped, so an interrupted run resumes.
+# The options the outputs were made with are kept in the output cache
+# folder; outputs older than the first run with the current options are
+# made again, so changing the size or format redoes the whole folder.
+#
+# Usage (the ImageMagick loop of the README, plus the labels):
+#   python -m euclidcore.preprocess /path/to/images /path/to/out --resize 256x256 --prefix sz-256-
+#   python -m euclidcore.preprocess /path/to/images /path/to/out --resize 416x416 --mode letterbox
+#   python -m euclidcore.preprocess /path/to/images /path/to/out --format jpeg --quality 85
+#-------------------------------------------------------------------------------
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+
+from PIL import Image
+
+from euclidcore import formats, scan
+
+
+# Images handed to a worker at once, and chunks in flight per worker
+CHUNK_SIZE = 32
+QUEUE_DEPTH = 4
+
+MODES = ('fit', 'stretch', 'letterbox')
+LETTERBOX_FILL = (114, 114, 114)
+OUTPUT_FORMATS = {'jpeg': ('JPEG', '.jpg'), 'png': ('PNG', '.png')}
+
+OPTIONS_NAME = 'preprocess.json'
+
+
+# Size of the resized image content, the output canvas size and the
+# (scaleX, scaleY, offsetX, offsetY) mapping source pixels to output pixels
+def getGeometry(size, target, mode):
+    width, height = size
+    if target is None:
+        return size, size, (1.0, 1.0, 0, 0)
+    targetWidth, targetHeight = target
+    if mode == 'stretch':
+        return target, target, (float(targetWidth) / width, float(targetHeight) / height, 0, 0)
+    scale = min(float(targetWidth) / width, float(targetHeight) / height)
+    newSize = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    transform = (float(newSize[0]) / width, float(newSize[1]) / height, 0, 0)
+    if mode == 'fit':
+        return newSize, newSize, transform
+    offsetX, offsetY = (targetWidth - newSize[0]) // 2, (targetHeight - newSize[1]) // 2
+    return newSize, target, (transform[0], transform[1], offsetX, offsetY)
+
+
+def getOptionsPath(outDir):
+    return os.path.join(formats.getCacheDir(outDir), OPTIONS_NAME)
+
+
+# Records the options of this run with the outputs, unless the last run used
+# the same ones. Returns the time the first run with these options started,
+# the mtime of the options file, so it is on the clock of the output folder.
+def recordOptions(outDir, signature):
+    path = getOptionsPath(outDir)
+    try:
+        with open(path) as f:
+            if json.load(f) == signature:
+                return os.stat(path).st_mtime_ns
+    except (IOError, OSError, ValueError):
+        pass
+    formats.makeDirs(os.path.dirname(path))
+    with open(formats.getTempPath(path), 'w') as f:
+        json.dump(signature, f)
+    os.replace(formats.getTempPath(path), path)
+    return os.stat(path).st_mtime_ns
+
+
+# Output written since the run options took effect, after its source changed last
+def isUpToDate(outPath, srcPath, since = 0):
+    try:
+        mtime = os.stat(outPath).st_mtime_ns
+        return mtime >= since and mtime >= os.stat(srcPath).st_mtime_ns
+    except OSError:
+        return False
+
+
+def transformLabels(labelPath, outLabelPath, size, outSize, transform, classes):
+    labelMode, classIds, bboxes = formats.parseLabelRows(formats.readLabelRows(labelPath), size[0], size[1], classes)
+    scaleX, scaleY, offsetX, offsetY = transform
+    bboxes = [(bbox[0] * scaleX + offsetX, bbox[1] * scaleY + offsetY,
+               bbox[2] * scaleX + offsetX, bbox[3] * scaleY + offsetY) for bbox in bboxes]
+    formats.writeLabelRows(outLabelPath, formats.formatLabelRows(labelMode or 'KITTI', classIds, bboxes,
+                                                                 outSize[0], outSize[1], classes))
+
+
+def processImage(imagePath, options):
+    name, ext = os.path.splitext(os.path.basename(imagePath))
+    outName = options['prefix'] + name
+    outFormat, outExt = OUTPUT_FORMATS.get(options['format'], (None, ext))
+    outPath = os.path.join(options['outDir'], outName + outExt)
+    labelPath = os.path.join(formats.getLabelDir(os.path.dirname(imagePath)), name + '.txt')
+    outLabelPath = os.path.join(formats.getLabelDir(options['outDir']), outName + '.txt')
+    hasLabels = os.path.exists(labelPath)
+    since = options['since']
+    if isUpToDate(outPath, imagePath, since) and (not hasLabels or isUpToDate(outLabelPath, labelPath, since)):
+        return False
+
+    img = Image.open(imagePath)
+    size, srcFormat = img.size, img.format
+    newSize, outSize, transform = getGeometry(size, options['resize'], options['mode'])
+    if newSize != size:
+        img.draft('RGB', newSize)  # JPEGs are decoded straight at a reduced scale
+        img = img.resize(newSize, Image.LANCZOS)
+    if (outFormat or srcFormat or '').upper() == 'JPEG' and img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if outSize != newSize:
+        canvas = Image.new(img.mode, outSize, LETTERBOX_FILL if img.mode == 'RGB' else 114)
+        canvas.paste(img, (transform[2], transform[3]))
+        img = canvas
+    img.save(formats.getTempPath(outPath), outFormat or srcFormat, quality = options['quality'])
+    os.replace(formats.getTempPath(outPath), outPath)
+    if hasLabels:
+        transformLabels(labelPath, outLabelPath, size, outSize, transform, options['classes'])
+    return True
+
+
+# Returns (processed, skipped, errors) for a chunk of image paths
+def processChunk(imagePaths, options):
+    processed = skipped = 0
+    errors = []
+    for imagePath in imagePaths:
+        try:
+            if processImage(imagePath, options):
+                processed += 1
+            else:
+                skipped += 1
+        except (ValueError, IndexError, IOError, OSError) as e:
+            errors.append('%s: %s' % (imagePath, e))
+    return processed, skipped, errors
+
+
+def iterChunks(imageDir):
+    chunk = []
+    for batch in scan.scanImages(imageDir):
+        for imagePath in batch:
+            chunk.append(imagePath)
+            if len(chunk) >= CHUNK_SIZE:
+                yield chunk
+                chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def preprocessDataset(imageDir, outDir, resize = None, mode = 'fit', outFormat = None, quality = 90,
+                      prefix = '', workers = None, classes = formats.CLASSES):
+    if os.path.abspath(imageDir) == os.path.abspath(outDir):
+        raise ValueError('output folder must differ from the image folder')
+    formats.makeDirs(formats.getLabelDir(outDir))
+    options = {'outDir': outDir, 'resize': resize, 'mode': mode, 'format': outFormat,
+               'quality': quality, 'prefix': prefix, 'classes': list(classes)}
+    # the prefix only names the outputs, the rest decides what they hold
+    signature = {'resize': list(resize) if resize is not None else None, 'mode': mode, 'format': outFormat,
+                 'quality': quality, 'classes': list(classes)}
+    options['since'] = recordOptions(outDir, signature)
+    job = partial(processChunk, options = options)
+    totals = [0, 0]
+    errors = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        # bounded number of chunks in flight, the folder is never listed up front
+        maxPending = (workers or os.cpu_count() or 1) * QUEUE_DEPTH
+        pending = set()
+        for chunk in iterChunks(imageDir):
+            pending.add(pool.submit(job, chunk))
+            if len(pending) >= maxPending:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    collect(future.result(), totals, errors)
+        for future in pending:
+            collect(future.result(), totals, errors)
+    return totals[0], totals[1], errors
+
+
+def collect(result, totals, errors):
+    totals[0] += result[0]
+    totals[1] += result[1]
+    errors.extend(result[2])
+
+
+def parseSize(text):
+    try:
+        width, height = text.lower().split('x')
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected WIDTHxHEIGHT, e.g. 256x256')
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Resize / letterbox / re-encode a folder of images and its labels')
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('outDir', help = 'output folder, gets its own LabelData folder')
+    parser.add_argument('--resize', type = parseSize, help = 'target size WIDTHxHEIGHT')
+    parser.add_argument('--mode', choices = MODES, default = 'fit',
+                        help = 'fit: keep aspect ratio within the size, stretch: exact size, '
+                               'letterbox: keep aspect ratio and pad to the exact size')
+    parser.add_argument('--format', choices = sorted(OUTPUT_FORMATS), help = 're-encode to this format')
+    parser.add_argument('--quality', type = int, default = 90, help = 'JPEG quality')
+    parser.add_argument('--prefix', default = '', help = 'prefix added to output file names')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    processed, skipped, errors = preprocessDataset(args.imageDir, args.outDir, args.resize, args.mode, args.format,
+                                                   args.quality, args.prefix, args.workers)
+    for error in errors:
+        sys.stderr.write(error + '\n')
+    print('%d images written, %d up to date, %d errors' % (processed, skipped, len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+#-------------------------------------------------------------------------------
+# Euclid - multi-resolution image pyramid
+# Level 0 is the full resolution image, level k is downscaled by 2**k. Levels
+# are decoded only when a zoom level needs them (JPEGs are decoded straight
+# at the reduced size through PIL's draft mode), and are cut into tiles so
+# that only the visible part of the image is ever turned into Tk images.
+#-------------------------------------------------------------------------------
+import math
+import threading
+
+from PIL import Image
+
+from euclidcore import formats
+
+
+TILE_SIZE = 256
+
+# Largest image view of the labeller, bigger images are shown scaled down
+VIEW_MAX_WIDTH = 1024
+VIEW_MAX_HEIGHT = 768
+
+
+class ImagePyramid(object):
+
+    # size is (width, height) when already known, e.g. from the dimension cache.
+    # loader returns the PIL image for images that are not a file of their
+    # own, such as video frames or archive members.
+    def __init__(self, path, size = None, loader = None):
+        self.path = path
+        self.loader = loader
+        if size is None:
+            size = formats.readImageSize(path)
+        self.width, self.height = size
+        self.numLevels = 1
+        while max(self.width, self.height) >> self.numLevels >= TILE_SIZE:
+            self.numLevels += 1
+        self.levels = {}
+        self.lock = threading.Lock()
+
+    def levelSize(self, level):
+        step = 1 << level
+        return ((self.width + step - 1) // step, (self.height + step - 1) // step)
+
+    # Coarsest level that still has at least as many pixels as needed at scale
+    def levelFor(self, scale):
+        if scale >= 1:
+            return 0
+        return min(int(math.floor(-math.log(scale, 2))), self.numLevels - 1)
+
+    # Scale that fits the whole image into a view, never enlarging it
+    def fitScale(self, viewWidth, viewHeight):
+        return min(1.0, float(viewWidth) / self.width, float(viewHeight) / self.height)
+
+    # Level the whole image is shown at in the view
+    def fitLevel(self):
+        return self.levelFor(self.fitScale(VIEW_MAX_WIDTH, VIEW_MAX_HEIGHT))
+
+    def getLevel(self, level):
+        with self.lock:
+            img = self.levels.get(level)
+            if img is not None:
+                return img
+            size = self.levelSize(level)
+            finer = [l for l in self.levels if l < level]
+            if len(finer) > 0:
+                img = self.levels[max(finer)].resize(size, Image.BILINEAR)
+            else:
+                img = self.loader() if self.loader is not None else Image.open(self.path)
+                if level > 0:
+                    img.draft('RGB', size)
+                img.load()
+                if img.size != size:
+                    img = img.resize(size, Image.BILINEAR)
+            self.levels[level] = img
+            return img
+
+    # Frees the decoded levels that are not listed in keep
+    def releaseLevels(self, keep):
+        with self.lock:
+            for level in list(self.levels):
+                if level not in keep:
+                    del self.levels[level]
+
+    # Part of a level covered by tile (tx, ty), as a PIL image
+    def getTile(self, level, tx, ty):
+        img = self.getLevel(level)
+        left, top = tx * TILE_SIZE, ty * TILE_SIZE
+        return img.crop((left, top, min(left + TILE_SIZE, img.width), min(top + TILE_SIZE, img.height)))
+
+    # Tiles of a level intersecting the image area (x1, y1) - (x2, y2),
+    # given in full resolution pixels
+    def tilesInView(self, level, x1, y1, x2, y2):
+        levelWidth, levelHeight = self.levelSize(level)
+        span = TILE_SIZE << level
+        tx1, ty1 = max(0, int(x1) // span), max(0, int(y1) // span)
+        tx2 = min((levelWidth - 1) // TILE_SIZE, int(math.ceil(x2)) // span)
+        ty2 = min((levelHeight - 1) // TILE_SIZE, int(math.ceil(y2)) // span)
+        return [(tx, ty) for ty in range(ty1, ty2 + 1) for tx in range(tx1, tx2 + 1)]
+
+    def nbytes(self):
+        with self.lock:
+            return sum(img.width * img.height * len(img.getbands()) for img in self.levels.values())
+
+
+# Pyramid of an image with the level shown in the view decoded, what the
+# prefetch workers of the labeller make of every image
+def decodeForView(path, size = None, loader = None):
+    pyramid = ImagePyramid(path, size, loader)
+    pyramid.getLevel(pyramid.fitLevel())
+    return pyramid
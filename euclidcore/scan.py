@@ -0,0 +1,95 @@
+#-------------------------------------------------------------------------------
+# Euclid - image directory scanner
+# Lists the images of a folder in a single os.scandir pass, handing them out
+# in batches as they are found. The listing is saved as a manifest in the
+# LabelData cache folder, keyed on the directory mtime: reopening an unchanged
+# folder reads the manifest only, and a changed folder keeps the order of the
+# known images and only checks the new entries.
+#-------------------------------------------------------------------------------
+import json
+import os
+
+from euclidcore import formats
+
+
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+
+MANIFEST_NAME = 'imagelist.json'
+MANIFEST_VERSION = 1
+
+
+def isImageName(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def getManifestPath(imageDir):
+    return os.path.join(formats.getCacheDir(imageDir), MANIFEST_NAME)
+
+
+def readManifest(imageDir):
+    try:
+        with open(getManifestPath(imageDir)) as f:
+            manifest = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def writeManifest(imageDir, mtime, names):
+    path = getManifestPath(imageDir)
+    try:
+        formats.makeDirs(os.path.dirname(path))
+        with open(formats.getTempPath(path), 'w') as f:
+            json.dump({'version': MANIFEST_VERSION, 'mtime': mtime, 'names': names}, f)
+        os.replace(formats.getTempPath(path), path)
+    except (IOError, OSError):
+        # a read-only dataset simply gets no manifest
+        pass
+
+
+# Yields lists of image paths. A folder never seen before is streamed in
+# batches of batchSize as the scan goes, so the first image can be shown
+# before the listing is complete.
+def scanImages(imageDir, batchSize = 256):
+    mtime = os.stat(imageDir).st_mtime_ns
+    manifest = readManifest(imageDir)
+    if manifest is not None and manifest['mtime'] == mtime:
+        yield [os.path.join(imageDir, name) for name in manifest['names']]
+        return
+
+    known = set(manifest['names']) if manifest is not None else set()
+    names = []
+    newNames = []
+    batch = []
+    for entry in os.scandir(imageDir):
+        if not isImageName(entry.name):
+            continue
+        if entry.name in known:
+            names.append(entry.name)
+            continue
+        if not entry.is_file():
+            continue
+        newNames.append(entry.name)
+        if not known:
+            batch.append(entry.path)
+            if len(batch) >= batchSize:
+                yield batch
+                batch = []
+
+    if known:
+        # keep the previous order so that image numbers stay stable
+        present = set(names)
+        names = [name for name in manifest['names'] if name in present]
+        batch = [os.path.join(imageDir, name) for name in names + newNames]
+    if len(batch) > 0:
+        yield batch
+    writeManifest(imageDir, mtime, names + newNames)
+
+
+def listImages(imageDir):
+    images = []
+    for batch in scanImages(imageDir):
+        images.extend(batch)
+    return images
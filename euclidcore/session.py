@@ -0,0 +1,245 @@
+#-------------------------------------------------------------------------------
+# Euclid - labelling session state
+# Keeps, per dataset, the image each user was last on and one bit per image
+# of the listing telling whether it has labels, in LabelData/.euclid/session.json.
+# Reopening a folder goes straight back to the last image, and the next or
+# previous unlabelled image is found in the bitmap, without looking at
+# LabelData. The bitmap is tied to the listing by a checksum of the image
+# names; when the listing changed it is rebuilt from the names of the
+# labelled images, one listing of LabelData (see Dataset.labelledNames).
+#
+# Annotators sharing a folder share the file. Saving merges into the file as
+# it is on disk, under a file lock: each user only replaces their own
+# position, and only the bits they changed.
+#-------------------------------------------------------------------------------
+import base64
+import getpass
+import json
+import os
+import re
+import threading
+import zlib
+
+from euclidcore import formats
+from euclidcore.locking import FileLock
+
+
+SESSION_NAME = 'session.json'
+SESSION_VERSION = 1
+
+# A byte with at least one image without labels
+UNLABELLED_BYTE = re.compile(b'[^\xff]')
+
+
+def getSessionPath(imageDir):
+    return os.path.join(formats.getCacheDir(imageDir), SESSION_NAME)
+
+
+def getUser():
+    try:
+        return getpass.getuser()
+    except Exception:
+        return 'unknown'
+
+
+def readState(path):
+    try:
+        with open(path) as f:
+            state = json.load(f)
+        if state.get('version') == SESSION_VERSION:
+            return state
+    except (IOError, OSError, ValueError):
+        pass
+    return {}
+
+
+# Bitmap of count images saved in a session file, or None when it does not fit
+def decodeBitmap(count, text):
+    try:
+        bitmap = LabelBitmap.decode(count, text)
+    except (ValueError, TypeError, zlib.error):
+        return None
+    return bitmap if len(bitmap.bits) == (count + 7) // 8 else None
+
+
+def getChecksum(names):
+    checksum = 0
+    for name in names:
+        checksum = zlib.crc32(name.encode('utf-8') + b'\n', checksum)
+    return checksum
+
+
+class LabelBitmap(object):
+
+    __slots__ = ('bits', 'count')
+
+    def __init__(self, count, bits = None):
+        self.count = count
+        self.bits = bits if bits is not None else bytearray((count + 7) // 8)
+        if len(self.bits) * 8 > count:
+            # padding bits count as labelled, so they are never found as unlabelled
+            self.bits[-1] |= (0xff << (count % 8 or 8)) & 0xff
+
+    def __getitem__(self, index):
+        return bool(self.bits[index >> 3] & (1 << (index & 7)))
+
+    def __setitem__(self, index, labelled):
+        if labelled:
+            self.bits[index >> 3] |= 1 << (index & 7)
+        else:
+            self.bits[index >> 3] &= ~(1 << (index & 7)) & 0xff
+
+    # First index after start without labels, or -1
+    def nextUnlabelled(self, start):
+        index = start + 1
+        while index < self.count and index & 7:
+            if not self[index]:
+                return index
+            index += 1
+        if index >= self.count:
+            return -1
+        match = UNLABELLED_BYTE.search(self.bits, index >> 3)
+        if match is None:
+            return -1
+        index = match.start() * 8
+        while self[index]:
+            index += 1
+        return index
+
+    # Last index before start without labels, or -1
+    def prevUnlabelled(self, start):
+        index = min(start, self.count) - 1
+        while index >= 0 and (index + 1) & 7:
+            if not self[index]:
+                return index
+            index -= 1
+        if index < 0:
+            return -1
+        # whole bytes from here down, the last one not full ends the stripped head
+        head = bytes(self.bits[:(index >> 3) + 1]).rstrip(b'\xff')
+        if len(head) == 0:
+            return -1
+        index = len(head) * 8 - 1
+        while self[index]:
+            index -= 1
+        return index
+
+    def countLabelled(self):
+        total = sum(bin(value).count('1') for value in self.bits)
+        return total - (len(self.bits) * 8 - self.count)
+
+    def encode(self):
+        return base64.b64encode(zlib.compress(bytes(self.bits))).decode('ascii')
+
+    @classmethod
+    def decode(cls, count, text):
+        return cls(count, bytearray(zlib.decompress(base64.b64decode(text))))
+
+
+class SessionState(object):
+
+    def __init__(self, imageDir):
+        self.imageDir = imageDir
+        self.path = getSessionPath(imageDir)
+        self.user = getUser()
+        self.state = readState(self.path)
+        self.imagePaths = None
+        self.indexOf = {}
+        self.bitmap = None
+        self.pending = {}   # image path -> labelled, set before attach
+        self.changed = {}   # bitmap index -> labelled, set since the last queueSave
+        self.lock = threading.Lock()
+        self.unsaved = None # state queued by queueSave for save
+
+    # Image path the user was last on, or None
+    def getLastPath(self):
+        return self.state.get('positions', {}).get(self.user)
+
+    def setLastPath(self, imagePath):
+        self.state.setdefault('positions', {})[self.user] = imagePath
+
+    # Ties the bitmap to the complete listing. labelledNames is called for
+    # the label names (see formats.getLabelName) of the images with labels
+    # when the saved bitmap does not match the listing.
+    def attach(self, imagePaths, labelledNames):
+        self.imagePaths = imagePaths
+        self.indexOf = dict((imagePath, index) for index, imagePath in enumerate(imagePaths))
+        checksum = getChecksum(imagePaths)
+        self.bitmap = None
+        self.changed = {}
+        if self.state.get('count') == len(imagePaths) and self.state.get('checksum') == checksum:
+            self.bitmap = decodeBitmap(len(imagePaths), self.state.get('labelled'))
+        if self.bitmap is None:
+            names = labelledNames()
+            self.bitmap = LabelBitmap(len(imagePaths))
+            for index, imagePath in enumerate(imagePaths):
+                if formats.getLabelName(self.imageDir, imagePath) in names:
+                    self.bitmap[index] = True
+        for imagePath, labelled in self.pending.items():
+            self.setLabelled(imagePath, labelled)
+        self.pending = {}
+        self.state['count'] = len(imagePaths)
+        self.state['checksum'] = checksum
+
+    def attached(self):
+        return self.bitmap is not None
+
+    def isLabelled(self, imagePath):
+        index = self.indexOf.get(imagePath)
+        return index is not None and self.bitmap[index]
+
+    def setLabelled(self, imagePath, labelled = True):
+        if self.bitmap is None:
+            self.pending[imagePath] = labelled
+            return
+        index = self.indexOf.get(imagePath)
+        if index is not None:
+            self.bitmap[index] = labelled
+            self.changed[index] = labelled
+
+    # Takes the position and the bitmap changes for the next save(). Returns
+    # True when no save was queued yet, i.e. save() has to be called (by the
+    # label writer in the labeller); queued states are merged until it runs.
+    def queueSave(self):
+        unsaved = {'position': self.getLastPath()}
+        if self.bitmap is not None:
+            unsaved.update(count = self.bitmap.count, checksum = self.state['checksum'],
+                           labelled = self.bitmap.encode(), changed = self.changed)
+            self.changed = {}
+        with self.lock:
+            queued = self.unsaved
+            if queued is not None and 'changed' in unsaved and queued.get('checksum') == unsaved['checksum']:
+                queued['changed'].update(unsaved['changed'])
+                unsaved['changed'] = queued['changed']
+            self.unsaved = unsaved
+            return queued is None
+
+    # Merges the queued state into the session file, which other annotators
+    # may have changed since it was read: their positions stay, and when the
+    # bitmap on disk is tied to the same listing only the bits changed here
+    # are set in it.
+    def save(self):
+        with self.lock:
+            unsaved, self.unsaved = self.unsaved, None
+        if unsaved is None:
+            return
+        formats.makeDirs(os.path.dirname(self.path))
+        with FileLock(self.path + '.lock'):
+            state = readState(self.path)
+            state['version'] = SESSION_VERSION
+            if unsaved['position'] is not None:
+                state.setdefault('positions', {})[self.user] = unsaved['position']
+            if 'labelled' in unsaved:
+                bitmap = None
+                if state.get('count') == unsaved['count'] and state.get('checksum') == unsaved['checksum']:
+                    bitmap = decodeBitmap(unsaved['count'], state.get('labelled'))
+                if bitmap is not None:
+                    for index, labelled in unsaved['changed'].items():
+                        bitmap[index] = labelled
+                    state['labelled'] = bitmap.encode()
+                else:
+                    state.update(count = unsaved['count'], checksum = unsaved['checksum'],
+                                 labelled = unsaved['labelled'])
+            with open(formats.getTempPath(self.path), 'w') as f:
+                json.dump(state, f)
+            os.replace(formats.getTempPath(self.path), self.path)
@@ -0,0 +1,304 @@
+#-------------------------------------------------------------------------------
+# Euclid - packed training shards
+# Exports a labelled folder as a few large shards a trainer can memory-map,
+# instead of one image file and one label file per sample. A shard is
+#   shard-NNNNN.bin          the encoded image files, back to back
+#   shard-NNNNN.images.npy   one IMAGE_FIELDS record per image: where its
+#                            bytes are in the .bin, its size, its boxes
+#   shard-NNNNN.boxes.npy    one BOX_FIELDS record per box, in pixels
+# and index.json lists the shards with the images of each, in order.
+#
+# Boxes are parsed exactly as the labeller loads them, from the label files
+# (KITTI or YOLO) or from the annotation store. Shards are written on a
+# process pool. Exporting again only rebuilds the shards holding an image
+# or label file that changed or went away, and packs new images into new
+# shards; the others are kept as they are.
+#
+# Usage:
+#   python -m euclidcore.shards /path/to/images /path/to/shards --shard-mb 256
+#
+# Reading:
+#   reader = ShardReader('/path/to/shards')
+#   name, data, boxes = reader[0]   # data: memoryview of the encoded image
+#-------------------------------------------------------------------------------
+import argparse
+import bisect
+import io
+import json
+import mmap
+import os
+import sys
+import zlib
+
+from euclidcore import formats, scan, store
+
+
+INDEX_NAME = 'index.json'
+INDEX_VERSION = 1
+
+DEFAULT_SHARD_MB = 256
+
+IMAGE_FIELDS = [('offset', '<u8'), ('size', '<u8'), ('width', '<u4'), ('height', '<u4'),
+                ('box_start', '<u8'), ('box_count', '<u4')]
+BOX_FIELDS = [('image', '<u4'), ('class_id', '<i4'),
+              ('x1', '<f4'), ('y1', '<f4'), ('x2', '<f4'), ('y2', '<f4')]
+
+
+def importNumPy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('shards need NumPy, install it with: pip install numpy')
+    return numpy
+
+
+def getShardPaths(outDir, shardName):
+    base = os.path.join(outDir, shardName)
+    return base + '.bin', base + '.images.npy', base + '.boxes.npy'
+
+
+def readIndex(outDir):
+    try:
+        with open(os.path.join(outDir, INDEX_NAME)) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+    if index.get('version') != INDEX_VERSION:
+        return None
+    return index
+
+
+def writeIndex(outDir, index):
+    path = os.path.join(outDir, INDEX_NAME)
+    with open(formats.getTempPath(path), 'w') as f:
+        json.dump(index, f)
+    os.replace(formats.getTempPath(path), path)
+
+
+# Writes one shard. entries are (imagePath, labelPath, labels, key), labels
+# being (classIds, bboxes) from the store, or None to parse labelPath.
+# Returns (shard name, [(image name, key)], image bytes, box count, errors).
+def writeShard(outDir, shardName, entries, classes):
+    from PIL import Image
+    np = importNumPy()
+    binPath, imagesPath, boxesPath = getShardPaths(outDir, shardName)
+    images = []
+    boxes = []
+    names = []
+    errors = []
+    offset = 0
+    with open(formats.getTempPath(binPath), 'wb') as binFile:
+        for imagePath, labelPath, labels, key in entries:
+            try:
+                with open(imagePath, 'rb') as f:
+                    data = f.read()
+                width, height = Image.open(io.BytesIO(data)).size
+                if labels is None:
+                    labels = formats.parseLabelRows(formats.readLabelRows(labelPath), width, height, classes)[1:]
+            except (IOError, OSError, ValueError, IndexError) as e:
+                errors.append('%s: %s' % (imagePath, e))
+                continue
+            classIds, bboxes = labels
+            images.append((offset, len(data), width, height, len(boxes), len(bboxes)))
+            for classId, bbox in zip(classIds, bboxes):
+                boxes.append((len(names), classId) + tuple(bbox))
+            names.append((os.path.basename(imagePath), key))
+            binFile.write(data)
+            offset += len(data)
+    for path, fields, rows in ((imagesPath, IMAGE_FIELDS, images), (boxesPath, BOX_FIELDS, boxes)):
+        with open(formats.getTempPath(path), 'wb') as f:
+            np.save(f, np.array(rows, dtype = np.dtype(fields)))
+    for path in (binPath, imagesPath, boxesPath):
+        os.replace(formats.getTempPath(path), path)
+    return shardName, names, offset, len(boxes), errors
+
+
+def getStoreKey(labels):
+    return '%08x' % zlib.crc32(repr(labels).encode('utf-8'))
+
+
+# Yields (imagePath, labelPath, labels, key) of the images to export. The key
+# changes whenever the image or its labels do.
+def iterEntries(imageDir, includeUnlabelled, storeBoxes):
+    labelDir = formats.getLabelDir(imageDir)
+    labelled = None
+    if storeBoxes is None:
+        try:
+            labelled = set(entry.name for entry in os.scandir(labelDir) if entry.name.endswith('.txt'))
+        except OSError:
+            labelled = set()
+    for batch in scan.scanImages(imageDir):
+        for imagePath in batch:
+            name = os.path.splitext(os.path.basename(imagePath))[0]
+            labelPath = os.path.join(labelDir, name + '.txt')
+            if storeBoxes is not None:
+                labels = storeBoxes.get(name)
+                labelKey = getStoreKey(labels) if labels is not None else None
+            else:
+                labels = None
+                labelKey = None
+                if name + '.txt' in labelled:
+                    st = os.stat(labelPath)
+                    labelKey = '%d-%d' % (st.st_mtime_ns, st.st_size)
+            if labelKey is None:
+                if not includeUnlabelled:
+                    continue
+                labels = ([], [])
+            try:
+                st = os.stat(imagePath)
+            except OSError:
+                continue
+            yield imagePath, labelPath, labels, [st.st_mtime_ns, st.st_size, labelKey]
+
+
+# Image packing in name order, up to shardBytes of image data per shard
+def packShards(entries, shardBytes):
+    shards = []
+    current = []
+    currentBytes = 0
+    for entry in sorted(entries, key = lambda entry: entry[0]):
+        size = entry[3][1]
+        if len(current) > 0 and currentBytes + size > shardBytes:
+            shards.append(current)
+            current = []
+            currentBytes = 0
+        current.append(entry)
+        currentBytes += size
+    if len(current) > 0:
+        shards.append(current)
+    return shards
+
+
+# Exports or updates the shards of imageDir in outDir.
+# Returns (shards written, shards kept, images exported, errors).
+def exportShards(imageDir, outDir, shardMB = DEFAULT_SHARD_MB, workers = None, includeUnlabelled = False,
+                 classes = formats.CLASSES):
+    importNumPy()
+    formats.makeDirs(outDir)
+    storeBoxes = None
+    if os.path.exists(store.getStorePath(imageDir)):
+        annotations = store.AnnotationStore(store.getStorePath(imageDir))
+        try:
+            storeBoxes = dict((name, (classIds, [tuple(bbox) for bbox in bboxes]))
+                              for name, width, height, labelMode, classIds, bboxes in annotations.iterImages())
+        finally:
+            annotations.close()
+    entries = dict((os.path.basename(entry[0]), entry)
+                   for entry in iterEntries(imageDir, includeUnlabelled, storeBoxes))
+
+    # shards whose images are all unchanged stay, the rest are packed again
+    index = readIndex(outDir)
+    if index is None or index.get('classes') != list(classes):
+        index = {'version': INDEX_VERSION, 'classes': list(classes), 'nextShard': 0, 'shards': []}
+    kept = []
+    for shard in index['shards']:
+        if all(name in entries and entries[name][3] == key for name, key in shard['images']):
+            kept.append(shard)
+            for name, key in shard['images']:
+                del entries[name]
+    toPack = packShards(entries.values(), shardMB << 20)
+
+    written = []
+    errors = []
+    if len(toPack) > 0:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers = workers) as pool:
+            futures = []
+            for shardEntries in toPack:
+                shardName = 'shard-%05d' % index['nextShard']
+                index['nextShard'] += 1
+                futures.append(pool.submit(writeShard, outDir, shardName, shardEntries, list(classes)))
+            for future in futures:
+                shardName, names, size, boxCount, shardErrors = future.result()
+                errors.extend(shardErrors)
+                if len(names) > 0:
+                    written.append({'name': shardName, 'images': names, 'bytes': size, 'boxes': boxCount})
+
+    # the new index goes in before the replaced shards are removed, so readers never see a gap
+    shards = sorted(kept + written, key = lambda shard: shard['name'])
+    oldNames = set(shard['name'] for shard in index['shards'])
+    index['shards'] = shards
+    writeIndex(outDir, index)
+    liveNames = set(shard['name'] for shard in shards)
+    for shardName in oldNames - liveNames:
+        for path in getShardPaths(outDir, shardName):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return len(written), len(kept), sum(len(shard['images']) for shard in shards), errors
+
+
+class ShardReader(object):
+
+    # Zero copy access to exported shards: image bytes are slices of the
+    # mapped .bin files, boxes are views of the mapped .npy arrays
+    def __init__(self, outDir):
+        self.np = importNumPy()
+        self.outDir = outDir
+        index = readIndex(outDir)
+        if index is None:
+            raise IOError('no shard index in %s' % outDir)
+        self.classes = index['classes']
+        self.shards = index['shards']
+        self.names = [name for shard in self.shards for name, key in shard['images']]
+        self.starts = []
+        total = 0
+        for shard in self.shards:
+            self.starts.append(total)
+            total += len(shard['images'])
+        self.opened = {}    # shard number -> (bin mmap, images array, boxes array)
+
+    def __len__(self):
+        return len(self.names)
+
+    def openShard(self, shardNumber):
+        opened = self.opened.get(shardNumber)
+        if opened is None:
+            binPath, imagesPath, boxesPath = getShardPaths(self.outDir, self.shards[shardNumber]['name'])
+            with open(binPath, 'rb') as f:
+                binMap = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+            boxes = self.np.load(boxesPath, mmap_mode = 'r' if self.shards[shardNumber]['boxes'] > 0 else None)
+            opened = self.opened[shardNumber] = (binMap, self.np.load(imagesPath, mmap_mode = 'r'), boxes)
+        return opened
+
+    # (image name, memoryview of the encoded image, structured array of its boxes)
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.names)
+        if not 0 <= index < len(self.names):
+            raise IndexError(index)
+        shardNumber = bisect.bisect_right(self.starts, index) - 1
+        binMap, images, boxes = self.openShard(shardNumber)
+        record = images[index - self.starts[shardNumber]]
+        offset, size = int(record['offset']), int(record['size'])
+        boxStart, boxCount = int(record['box_start']), int(record['box_count'])
+        return self.names[index], memoryview(binMap)[offset:offset + size], boxes[boxStart:boxStart + boxCount]
+
+    def openImage(self, index):
+        from PIL import Image
+        return Image.open(io.BytesIO(self[index][1]))
+
+    # Mappings still referenced by returned memoryviews close once those are gone
+    def close(self):
+        self.opened = {}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Export a labelled folder as memory-mappable training shards')
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('outDir', help = 'shard folder, updated in place when exported before')
+    parser.add_argument('--shard-mb', type = int, default = DEFAULT_SHARD_MB, help = 'image data per shard, in MB')
+    parser.add_argument('--all', action = 'store_true', help = 'also export images without labels')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    written, kept, images, errors = exportShards(args.imageDir, args.outDir, args.shard_mb, args.workers, args.all)
+    for error in errors:
+        sys.stderr.write(error + '\n')
+    print('%d shards written, %d unchanged, %d images, %d errors' % (written, kept, images, len(errors)))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
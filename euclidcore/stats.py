@@ -0,0 +1,165 @@
+#-------------------------------------------------------------------------------
+# Euclid - dataset statistics and validation
+# Reads every label file of a LabelData folder on a process pool, with the
+# same parsing rules as the labeller, and reports per class box counts, box
+# size and aspect ratio histograms, and problems: boxes outside the image,
+# with zero area or with a class ID not in the class list, unreadable label files, images without a label file and
+# label files without an image. The report is JSON, and the exit status is
+# non zero when --strict is given and problems were found.
+#
+# Usage:
+#   python -m euclidcore.stats /path/to/images --output report.json --strict
+#-------------------------------------------------------------------------------
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+from euclidcore import formats, scan
+from euclidcore.dims import ImageSizeCache
+
+
+# Label files handed to a worker at once
+CHUNK_SIZE = 512
+
+# File names listed per kind of problem in the report
+MAX_EXAMPLES = 50
+
+SIZE_BINS = [0, 1, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 1e9]
+ASPECT_BINS = [0, 0.125, 0.25, 0.5, 0.75, 1, 1.333, 2, 4, 8, 1e9]
+
+
+# Parses one batch of label files. Each task is (labelName, imagePath).
+# Returns the names of the parsed files, per box arrays and parse errors.
+def readChunk(tasks, imageDir, classes):
+    labelDir = formats.getLabelDir(imageDir)
+    sizeCache = ImageSizeCache(imageDir)
+    imageSizes = sizeCache.getSizes([imagePath for labelName, imagePath in tasks])
+    sizeCache.close()
+    names = []
+    fileIdx = []
+    classIds = []
+    bboxes = []
+    sizes = []
+    errors = []
+    for (labelName, imagePath), size in zip(tasks, imageSizes):
+        try:
+            if size is None:
+                raise ValueError('cannot read image %s' % imagePath)
+            width, height = size
+            labelMode, fileIds, fileBoxes = formats.parseLabelRows(
+                formats.readLabelRows(os.path.join(labelDir, labelName)), width, height, classes)
+        except (ValueError, IndexError, IOError, OSError) as e:
+            errors.append('%s: %s' % (labelName, e))
+            continue
+        fileIdx.extend([len(names)] * len(fileIds))
+        names.append(labelName)
+        classIds.extend(fileIds)
+        bboxes.extend(fileBoxes)
+        sizes.extend([(width, height)] * len(fileIds))
+    return (names, np.asarray(fileIdx, dtype = np.int64), np.asarray(classIds, dtype = np.int64),
+            np.asarray(bboxes, dtype = np.float64).reshape(-1, 4),
+            np.asarray(sizes, dtype = np.float64).reshape(-1, 2), errors)
+
+
+def histogram(values, bins):
+    counts, edges = np.histogram(values, bins = bins)
+    return {'bins': [float(edge) for edge in edges], 'counts': counts.tolist()}
+
+
+def problem(names):
+    names = sorted(names)
+    return {'count': len(names), 'examples': names[:MAX_EXAMPLES]}
+
+
+def analyzeDataset(imageDir, workers = None, classes = formats.CLASSES):
+    labelDir = formats.getLabelDir(imageDir)
+    images = {}
+    for imagePath in scan.listImages(imageDir):
+        images[os.path.splitext(os.path.basename(imagePath))[0]] = imagePath
+    labelNames = set(entry.name[:-4] for entry in os.scandir(labelDir)
+                     if entry.name.endswith('.txt') and entry.is_file())
+
+    tasks = [(name + '.txt', images[name]) for name in sorted(labelNames) if name in images]
+    chunks = [tasks[i:i + CHUNK_SIZE] for i in range(0, len(tasks), CHUNK_SIZE)]
+    names = []
+    parts = []
+    errors = []
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for chunkNames, fileIdx, classIds, bboxes, sizes, chunkErrors in \
+                pool.map(partial(readChunk, imageDir = imageDir, classes = list(classes)), chunks):
+            parts.append((fileIdx + len(names), classIds, bboxes, sizes))
+            names.extend(chunkNames)
+            errors.extend(chunkErrors)
+
+    fileIdx = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype = np.int64)
+    classIds = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0, dtype = np.int64)
+    bboxes = np.concatenate([p[2] for p in parts]) if parts else np.zeros((0, 4))
+    sizes = np.concatenate([p[3] for p in parts]) if parts else np.zeros((0, 2))
+
+    # boxes of unknown classes are reported, and left out of everything else
+    badClass = (classIds < 0) | (classIds >= len(classes))
+    badClassFiles = np.unique(fileIdx[badClass])
+    fileIdx, classIds, bboxes, sizes = fileIdx[~badClass], classIds[~badClass], bboxes[~badClass], sizes[~badClass]
+
+    widths = bboxes[:, 2] - bboxes[:, 0]
+    heights = bboxes[:, 3] - bboxes[:, 1]
+    zeroArea = (widths <= 0) | (heights <= 0)
+    outside = (bboxes[:, 0] < 0) | (bboxes[:, 1] < 0) | \
+              (bboxes[:, 2] > sizes[:, 0]) | (bboxes[:, 3] > sizes[:, 1])
+    aspect = widths[~zeroArea] / heights[~zeroArea]
+
+    counts = np.bincount(classIds, minlength = len(classes))
+    perClass = dict(zip(classes, counts.tolist()))
+
+    return {
+        'imageDir': os.path.abspath(imageDir),
+        'images': len(images),
+        'labelFiles': len(labelNames),
+        'boxes': int(len(classIds)),
+        'classes': perClass,
+        'boxWidth': histogram(widths, SIZE_BINS),
+        'boxHeight': histogram(heights, SIZE_BINS),
+        'aspectRatio': histogram(aspect, ASPECT_BINS),
+        'problems': {
+            'outOfBounds': problem(set(names[i] for i in np.unique(fileIdx[outside]))),
+            'zeroArea': problem(set(names[i] for i in np.unique(fileIdx[zeroArea]))),
+            'badClass': problem(set(names[i] for i in badClassFiles)),
+            'parseErrors': problem(errors),
+            'missingLabels': problem(name for name in images if name not in labelNames),
+            'orphanLabels': problem(name + '.txt' for name in labelNames if name not in images),
+        },
+    }
+
+
+def hasProblems(report, ignore = ('missingLabels',)):
+    return any(value['count'] > 0 for key, value in report['problems'].items() if key not in ignore)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Statistics and validation of a labelled folder')
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('--output', help = 'write the JSON report here instead of stdout')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes (default: all cores)')
+    parser.add_argument('--strict', action = 'store_true',
+                        help = 'exit with status 1 when problems are found (unlabelled images are not problems)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(formats.getLabelDir(args.imageDir)):
+        parser.error('no %s folder in %s' % (formats.LABEL_DIR_NAME, args.imageDir))
+    report = analyzeDataset(args.imageDir, args.workers)
+    text = json.dumps(report, indent = 2, sort_keys = True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if args.strict and hasProblems(report) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
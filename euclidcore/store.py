@@ -0,0 +1,223 @@
+#-------------------------------------------------------------------------------
+# Euclid - SQLite annotation store
+# Optional alternative to the per-image text files of LabelData: all boxes of
+# a dataset in one SQLite file (LabelData/annotations.sqlite), indexed
+# by image, class and box area. Boxes are stored in image pixels, so the
+# store can be exported to either format. The labeller uses the store instead
+# of the text files whenever the file exists.
+#
+# Usage:
+#   python -m euclidcore.store import /path/to/images
+#   python -m euclidcore.store export /path/to/images --format yolo
+#   python -m euclidcore.store summary /path/to/images
+#-------------------------------------------------------------------------------
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+
+from euclidcore import formats, scan
+from euclidcore.dims import ImageSizeCache
+
+
+STORE_NAME = 'annotations.sqlite'
+
+# Label files imported per transaction
+IMPORT_BATCH = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    format TEXT
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY,
+    image_id INTEGER NOT NULL REFERENCES images(id),
+    class_id INTEGER NOT NULL,
+    x1 REAL NOT NULL,
+    y1 REAL NOT NULL,
+    x2 REAL NOT NULL,
+    y2 REAL NOT NULL,
+    area REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxes_image ON boxes(image_id);
+CREATE INDEX IF NOT EXISTS boxes_class ON boxes(class_id);
+CREATE INDEX IF NOT EXISTS boxes_area ON boxes(area);
+"""
+
+
+def getStorePath(imageDir):
+    return os.path.join(formats.getLabelDir(imageDir), STORE_NAME)
+
+
+class AnnotationStore(object):
+
+    # Images are identified by name, the file name without extension,
+    # exactly like their label files in LabelData
+    def __init__(self, dbPath):
+        self.dbPath = dbPath
+        # shared by the GUI thread and the prefetch threads, one at a time
+        self.lock = threading.RLock()
+        # rollback journal, not WAL, and a long busy timeout: annotators on
+        # several hosts may share the folder over a network file system
+        self.conn = sqlite3.connect(dbPath, timeout = 30, check_same_thread = False)
+        self.conn.execute('PRAGMA journal_mode=DELETE')
+        self.conn.executescript(SCHEMA)
+
+    # Returns (format, classIds, bboxes), or None for an image never saved
+    def getBoxes(self, name):
+        with self.lock:
+            row = self.conn.execute('SELECT id, format FROM images WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            boxes = self.conn.execute('SELECT class_id, x1, y1, x2, y2 FROM boxes WHERE image_id = ? ORDER BY id',
+                                      (row[0],)).fetchall()
+        return row[1], [box[0] for box in boxes], [tuple(box[1:]) for box in boxes]
+
+    def writeBoxes(self, conn, name, labelMode, classIds, bboxes, size):
+        width, height = size if size is not None else (None, None)
+        conn.execute('INSERT OR IGNORE INTO images (name) VALUES (?)', (name,))
+        conn.execute('UPDATE images SET width = COALESCE(?, width), height = COALESCE(?, height), format = ? '
+                     'WHERE name = ?', (width, height, labelMode, name))
+        imageId = conn.execute('SELECT id FROM images WHERE name = ?', (name,)).fetchone()[0]
+        conn.execute('DELETE FROM boxes WHERE image_id = ?', (imageId,))
+        conn.executemany('INSERT INTO boxes (image_id, class_id, x1, y1, x2, y2, area) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                         [(imageId, classId, bbox[0], bbox[1], bbox[2], bbox[3],
+                           (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]))
+                          for classId, bbox in zip(classIds, bboxes)])
+
+    # Names of all images saved so far
+    def listNames(self):
+        with self.lock:
+            return set(row[0] for row in self.conn.execute('SELECT name FROM images'))
+
+    # Replaces all boxes of an image in one transaction
+    def setBoxes(self, name, labelMode, classIds, bboxes, size = None):
+        with self.lock, self.conn:
+            self.writeBoxes(self.conn, name, labelMode, classIds, bboxes, size)
+
+    # Imports every label file of LabelData, IMPORT_BATCH files per transaction.
+    # Returns the number of imported files and a list of error messages.
+    def importLabels(self, imageDir, classes = formats.CLASSES):
+        labelDir = formats.getLabelDir(imageDir)
+        images = {}
+        for imagePath in scan.listImages(imageDir):
+            images[os.path.splitext(os.path.basename(imagePath))[0]] = imagePath
+        names = sorted(entry.name[:-4] for entry in os.scandir(labelDir)
+                       if entry.name.endswith('.txt') and entry.is_file())
+        sizeCache = ImageSizeCache(imageDir)
+        imported = 0
+        errors = []
+        for start in range(0, len(names), IMPORT_BATCH):
+            batch = names[start:start + IMPORT_BATCH]
+            sizes = sizeCache.getSizes([images[name] for name in batch if name in images])
+            sizes.reverse()
+            with self.lock, self.conn:
+                for name in batch:
+                    try:
+                        size = sizes.pop() if name in images else None
+                        width, height = size if size is not None else (None, None)
+                        rows = formats.readLabelRows(os.path.join(labelDir, name + '.txt'))
+                        if size is None and not all(formats.isKittiRow(tmp) for tmp in rows):
+                            raise ValueError('no image found for YOLO label file')
+                        labelMode, classIds, bboxes = formats.parseLabelRows(rows, width, height, classes)
+                    except (ValueError, IndexError, IOError, OSError) as e:
+                        errors.append('%s.txt: %s' % (name, e))
+                        continue
+                    self.writeBoxes(self.conn, name, labelMode, classIds, bboxes, size)
+                    imported += 1
+        sizeCache.close()
+        return imported, errors
+
+    # Streams all images and their boxes, ordered by image:
+    # yields (name, width, height, format, classIds, bboxes)
+    def iterImages(self):
+        cursor = self.conn.execute(
+            'SELECT images.id, images.name, images.width, images.height, images.format, '
+            'boxes.class_id, boxes.x1, boxes.y1, boxes.x2, boxes.y2 '
+            'FROM images LEFT JOIN boxes ON boxes.image_id = images.id ORDER BY images.id, boxes.id')
+        current = None
+        for row in cursor:
+            if current is None or current[0] != row[0]:
+                if current is not None:
+                    yield current[1:]
+                current = (row[0], row[1], row[2], row[3], row[4], [], [])
+            if row[5] is not None:
+                current[5].append(row[5])
+                current[6].append(row[6:10])
+        if current is not None:
+            yield current[1:]
+
+    # Writes label files back, in labelMode or in the format each image was saved in
+    def exportLabels(self, imageDir, labelMode = None, outDir = None, classes = formats.CLASSES):
+        if outDir is None:
+            outDir = formats.getLabelDir(imageDir)
+        formats.makeDirs(outDir)
+        images = None
+        sizeCache = None
+        exported = 0
+        errors = []
+        for name, width, height, imageMode, classIds, bboxes in self.iterImages():
+            fileMode = labelMode or imageMode or 'KITTI'
+            if fileMode == 'YOLO' and width is None:
+                if images is None:
+                    images = dict((os.path.splitext(os.path.basename(p))[0], p) for p in scan.listImages(imageDir))
+                    sizeCache = ImageSizeCache(imageDir)
+                size = sizeCache.getSize(images[name]) if name in images else None
+                if size is None:
+                    errors.append('%s: image size unknown, no readable image found' % name)
+                    continue
+                width, height = size
+            # archive members are named after the archive and member, see formats.getLabelName
+            labelPath = os.path.join(outDir, *(name + '.txt').split('/'))
+            formats.makeDirs(os.path.dirname(labelPath))
+            formats.writeLabelRows(labelPath, formats.formatLabelRows(fileMode, classIds, bboxes, width, height, classes))
+            exported += 1
+        if sizeCache is not None:
+            sizeCache.close()
+        return exported, errors
+
+    def classCounts(self):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT class_id, COUNT(*) FROM boxes GROUP BY class_id ORDER BY class_id').fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'SQLite annotation store of a dataset')
+    parser.add_argument('command', choices = ['import', 'export', 'summary'])
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('--db', help = 'store file (default: LabelData/%s)' % STORE_NAME)
+    parser.add_argument('--format', choices = ['kitti', 'yolo'],
+                        help = 'export format (default: the format each image was saved in)')
+    parser.add_argument('--output', help = 'export label files here instead of LabelData')
+    args = parser.parse_args(argv)
+
+    formats.makeDirs(formats.getLabelDir(args.imageDir))
+    store = AnnotationStore(args.db or getStorePath(args.imageDir))
+    errors = []
+    if args.command == 'import':
+        count, errors = store.importLabels(args.imageDir)
+        print('%d label files imported' % count)
+    elif args.command == 'export':
+        count, errors = store.exportLabels(args.imageDir, args.format and args.format.upper(), args.output)
+        print('%d label files exported' % count)
+    else:
+        for classId, count in store.classCounts():
+            print('class %d: %d boxes' % (classId, count))
+    store.close()
+    for error in errors:
+        sys.stderr.write(error + '\n')
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,184 @@
+#-------------------------------------------------------------------------------
+# Euclid - hot path instrumentation
+# Times named stages (image decode, label parsing, Tk image creation, box
+# drawing, saving, ...) into per stage histograms, and optionally keeps every
+# timed span for a session trace written as JSON lines or as a Chrome trace
+# (chrome://tracing, Perfetto). Also wraps cProfile for ad hoc captures.
+#
+# Off by default. While off, span() hands out one shared do-nothing object,
+# so an instrumented stage costs a function call and a global lookup.
+#
+#   with timing.span('decode'):
+#       ...
+#-------------------------------------------------------------------------------
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+# Histogram bucket upper bounds in seconds, four per power of two from 1us to ~70s
+BUCKETS = [1e-6 * 2 ** (i / 4.0) for i in range(0, 4 * 26 + 1)]
+
+# Spans kept for the session trace
+MAX_EVENTS = 1000000
+
+
+class Histogram(object):
+
+    __slots__ = ('counts', 'count', 'total', 'minimum', 'maximum', 'last')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.minimum = self.maximum = self.last = 0.0
+
+    def add(self, duration):
+        self.counts[bisect.bisect_left(BUCKETS, duration)] += 1
+        if self.count == 0 or duration < self.minimum:
+            self.minimum = duration
+        self.maximum = max(self.maximum, duration)
+        self.count += 1
+        self.total += duration
+        self.last = duration
+
+    # Upper bound of the bucket holding the given fraction of the samples
+    def percentile(self, fraction):
+        wanted = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count > 0 and seen >= wanted:
+                return min(BUCKETS[index] if index < len(BUCKETS) else self.maximum, self.maximum)
+        return self.maximum
+
+    def summary(self):
+        return {'count': self.count, 'total': self.total, 'mean': self.total / max(self.count, 1),
+                'min': self.minimum, 'max': self.maximum, 'p50': self.percentile(0.5),
+                'p90': self.percentile(0.9), 'p99': self.percentile(0.99)}
+
+
+class Recorder(object):
+
+    def __init__(self, keepEvents = False):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.origin = time.perf_counter()
+        self.events = deque(maxlen = MAX_EVENTS) if keepEvents else None
+
+    def record(self, name, start, duration):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(duration)
+            if self.events is not None:
+                self.events.append((name, start - self.origin, duration, threading.current_thread().ident))
+
+    # Duration of the latest span of a stage, or None
+    def last(self, name):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            return histogram.last if histogram is not None else None
+
+    def summary(self):
+        with self.lock:
+            return dict((name, histogram.summary()) for name, histogram in self.histograms.items())
+
+    # Writes the kept spans: a Chrome trace for a .json path, JSON lines otherwise
+    def writeTrace(self, path):
+        with self.lock:
+            events = list(self.events or ())
+            summary = dict((name, histogram.summary()) for name, histogram in self.histograms.items())
+        pid = os.getpid()
+        with open(path + '.tmp', 'w') as f:
+            if path.endswith('.json'):
+                json.dump({'traceEvents': [{'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6,
+                                            'pid': pid, 'tid': tid} for name, start, duration, tid in events],
+                           'otherData': {'summary': summary}}, f)
+            else:
+                for name, start, duration, tid in events:
+                    f.write(json.dumps({'name': name, 'ts': start, 'dur': duration, 'tid': tid}) + '\n')
+                f.write(json.dumps({'summary': summary}) + '\n')
+        os.replace(path + '.tmp', path)
+
+
+class Span(object):
+
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.recorder.record(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+class NullSpan(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+# The active Recorder, None while timing is off
+recorder = None
+
+
+def span(name):
+    if recorder is None:
+        return NULL_SPAN
+    return Span(recorder, name)
+
+
+def enable(keepEvents = False):
+    global recorder
+    if recorder is None or (keepEvents and recorder.events is None):
+        recorder = Recorder(keepEvents)
+    return recorder
+
+
+def disable():
+    global recorder
+    recorder = None
+
+
+def enabled():
+    return recorder is not None
+
+
+class Profiler(object):
+
+    # cProfile capture, started and stopped on demand. Stats are dumped
+    # for pstats / snakeviz.
+    def __init__(self):
+        self.profile = None
+
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self, path):
+        self.profile.disable()
+        self.profile.dump_stats(path)
+        self.profile = None
+        return path
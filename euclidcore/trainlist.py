@@ -0,0 +1,168 @@
+#-------------------------------------------------------------------------------
+# Euclid - YOLO training list
+# Keeps the train.txt of a dataset (full paths of the images labelled in YOLO
+# format, one per line) free of duplicates. The list lives in LabelData/.euclid,
+# away from the label files, so that rewriting it leaves the image folder (and
+# its cached listing, see scan.py) untouched; a train.txt left next to the
+# images by older versions is read until the first rewrite. It is indexed in
+# memory and rewritten atomically in batches. Several annotators may share
+# the list: each flush merges its own additions and removals into the file as
+# it is on disk, under a file lock.
+#
+# Usage (regenerate train.txt from LabelData):
+#   python -m euclidcore.trainlist /path/to/images --workers 8
+#-------------------------------------------------------------------------------
+import argparse
+import os
+import sys
+from collections import OrderedDict
+
+from euclidcore import formats, scan
+from euclidcore.locking import FileLock
+
+
+TRAIN_LIST_NAME = 'train.txt'
+
+# Changes collected before train.txt is rewritten
+FLUSH_BATCH = 64
+
+# Images handed to a worker at once by rebuild
+CHUNK_SIZE = 1024
+
+
+def getTrainListPath(imageDir):
+    return os.path.join(formats.getCacheDir(imageDir), TRAIN_LIST_NAME)
+
+
+def readTrainList(path, legacyPath):
+    entries = OrderedDict()
+    for candidate in (path, legacyPath):
+        if os.path.exists(candidate):
+            with open(candidate) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        entries[line] = True
+            break
+    return entries
+
+
+def writeTrainList(path, imagePaths):
+    with open(formats.getTempPath(path), 'w') as f:
+        f.write(''.join(imagePath + '\n' for imagePath in imagePaths))
+    os.replace(formats.getTempPath(path), path)
+
+
+class TrainingList(object):
+
+    # With a LabelWriter, flushes are queued to it instead of writing directly
+    def __init__(self, imageDir, batchSize = FLUSH_BATCH, writer = None):
+        self.path = getTrainListPath(imageDir)
+        self.legacyPath = os.path.join(imageDir, TRAIN_LIST_NAME)
+        self.batchSize = batchSize
+        self.writer = writer
+        self.entries = None     # loaded on first use
+        self.added = OrderedDict()
+        self.removed = set()
+        self.changes = 0
+
+    def load(self):
+        self.entries = readTrainList(self.path, self.legacyPath)
+        return self.entries
+
+    def __contains__(self, imagePath):
+        entries = self.entries if self.entries is not None else self.load()
+        return imagePath in entries
+
+    def add(self, imagePath):
+        if imagePath in self:
+            return
+        self.entries[imagePath] = True
+        self.added[imagePath] = True
+        self.removed.discard(imagePath)
+        self.changed()
+
+    def remove(self, imagePath):
+        if imagePath not in self:
+            return
+        del self.entries[imagePath]
+        self.added.pop(imagePath, None)
+        self.removed.add(imagePath)
+        self.changed()
+
+    def changed(self):
+        self.changes += 1
+        if self.changes >= self.batchSize:
+            self.flush()
+
+    def flush(self):
+        if self.changes == 0:
+            return
+        added, removed = self.added, self.removed
+        self.added, self.removed = OrderedDict(), set()
+        if self.writer is not None:
+            self.writer.submitTask(lambda: self.merge(added, removed))
+        else:
+            self.merge(added, removed)
+        self.changes = 0
+
+    # Applies changes to the list on disk, which other annotators may have changed
+    def merge(self, added, removed):
+        formats.makeDirs(os.path.dirname(self.path))
+        with FileLock(self.path + '.lock'):
+            entries = readTrainList(self.path, self.legacyPath)
+            for imagePath in removed:
+                entries.pop(imagePath, None)
+            for imagePath in added:
+                entries[imagePath] = True
+            writeTrainList(self.path, entries)
+
+
+def hasYoloLabels(labelPath):
+    for tmp in formats.readLabelRows(labelPath):
+        if not formats.isKittiRow(tmp):
+            return True
+    return False
+
+
+def checkChunk(args):
+    labelDir, imagePaths = args
+    found = []
+    for imagePath in imagePaths:
+        name = os.path.splitext(os.path.basename(imagePath))[0]
+        if hasYoloLabels(os.path.join(labelDir, name + '.txt')):
+            found.append(imagePath)
+    return found
+
+
+# Regenerates train.txt from the YOLO label files of the dataset, in the
+# order of the image listing. Returns the number of listed images.
+def rebuildTrainingList(imageDir, workers = None):
+    labelDir = formats.getLabelDir(imageDir)
+    imagePaths = scan.listImages(imageDir)
+    chunks = [(labelDir, imagePaths[i:i + CHUNK_SIZE]) for i in range(0, len(imagePaths), CHUNK_SIZE)]
+    listed = []
+    formats.makeDirs(os.path.dirname(getTrainListPath(imageDir)))
+    from concurrent.futures import ProcessPoolExecutor  # only the rebuild needs it
+    with ProcessPoolExecutor(max_workers = workers) as pool:
+        for found in pool.map(checkChunk, chunks):
+            listed.extend(found)
+    writeTrainList(getTrainListPath(imageDir), listed)
+    return len(listed)
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Regenerate the YOLO train.txt of a dataset from its LabelData folder')
+    parser.add_argument('imageDir', help = 'folder containing the images and their LabelData folder')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes (default: all cores)')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(formats.getLabelDir(args.imageDir)):
+        parser.error('no %s folder in %s' % (formats.LABEL_DIR_NAME, args.imageDir))
+    count = rebuildTrainingList(args.imageDir, args.workers)
+    print('%d images listed in %s' % (count, getTrainListPath(args.imageDir)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,217 @@
+#-------------------------------------------------------------------------------
+# Euclid - video source
+# Lets a video file be labelled like a folder of images without extracting
+# its frames first. Frame n of clip.mp4 is known by the path it gets once
+# labelled, clip_frames/clip_000123.jpg, so its labels go to the usual
+# clip_frames/LabelData/clip_000123.txt and the frames folder is an ordinary
+# dataset for every other tool. Only frames that get labels are written.
+#
+# The frame timestamps and keyframes are read once by demuxing the file (no
+# decoding) and kept in the frames folder cache. A frame is decoded by seeking
+# to the keyframe before it; the frames decoded after it are kept in a small
+# read-ahead buffer, and stepping forward continues decoding where it left off.
+#
+# Needs PyAV (pip install av).
+#-------------------------------------------------------------------------------
+import bisect
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from euclidcore import formats
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.webm')
+
+INDEX_NAME = 'videoindex.json'
+INDEX_VERSION = 1
+FRAME_DIGITS = 6
+
+# Frames decoded past the requested one, and frames kept decoded
+READ_AHEAD = 8
+BUFFER_FRAMES = 24
+
+# Frames a request may lie ahead of the decoder before seeking is cheaper
+SEEK_DISTANCE = 48
+
+JPEG_QUALITY = 95
+
+
+def isVideoPath(path):
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+
+def getFramesDir(videoPath):
+    return os.path.splitext(videoPath)[0] + '_frames'
+
+
+def importAV():
+    try:
+        import av
+    except ImportError:
+        raise ImportError('video files need PyAV, install it with: pip install av')
+    return av
+
+
+# Linear interpolation of the boxes of two labelled frames, t from 0 (first)
+# to 1 (second). Boxes are paired by class, nearest centres first; boxes
+# without a partner are left out. Returns (classIds, bboxes).
+def interpolateBoxes(classIdsA, bboxesA, classIdsB, bboxesB, t):
+    centre = lambda bbox: ((bbox[0] + bbox[2]) / 2.0, (bbox[1] + bbox[3]) / 2.0)
+    pairs = []
+    for i, (classA, bboxA) in enumerate(zip(classIdsA, bboxesA)):
+        ax, ay = centre(bboxA)
+        for j, (classB, bboxB) in enumerate(zip(classIdsB, bboxesB)):
+            if classA == classB:
+                bx, by = centre(bboxB)
+                pairs.append(((ax - bx) ** 2 + (ay - by) ** 2, i, j))
+    pairs.sort()
+    usedA, usedB = set(), set()
+    classIds, bboxes = [], []
+    for distance, i, j in pairs:
+        if i in usedA or j in usedB:
+            continue
+        usedA.add(i)
+        usedB.add(j)
+        classIds.append(classIdsA[i])
+        bboxes.append(tuple(a + (b - a) * t for a, b in zip(bboxesA[i], bboxesB[j])))
+    return classIds, bboxes
+
+
+class VideoSource(object):
+
+    def __init__(self, videoPath):
+        self.av = importAV()
+        self.path = videoPath
+        self.framesDir = getFramesDir(videoPath)
+        self.stem = os.path.splitext(os.path.basename(videoPath))[0]
+        self.lock = threading.Lock()  # one decoder, shared by the prefetch threads
+        self.container = None
+        self.stream = None
+        self.frames = None      # decode generator, None after a seek is needed
+        self.position = -1      # index of the last frame the generator produced
+        self.buffer = OrderedDict()
+        self.pts = []           # presentation timestamps, in frame order
+        self.keyframes = []     # indices of the keyframes
+        self.width = self.height = 0
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    def __len__(self):
+        return len(self.pts)
+
+    def getFramePath(self, index):
+        return os.path.join(self.framesDir, '%s_%0*d.jpg' % (self.stem, FRAME_DIGITS, index))
+
+    def framePaths(self):
+        return [self.getFramePath(index) for index in range(len(self.pts))]
+
+    # Frame index of a path from framePaths, or -1
+    def frameIndex(self, framePath):
+        name = os.path.splitext(os.path.basename(framePath))[0]
+        prefix = self.stem + '_'
+        if not name.startswith(prefix) or not name[len(prefix):].isdigit():
+            return -1
+        index = int(name[len(prefix):])
+        return index if index < len(self.pts) else -1
+
+    def getIndexPath(self):
+        return os.path.join(formats.getCacheDir(self.framesDir), INDEX_NAME)
+
+    # Reads the seek index from the cache, or builds it by demuxing the file
+    def open(self):
+        st = os.stat(self.path)
+        self.container = self.av.open(self.path)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        try:
+            with open(self.getIndexPath()) as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION and index['mtime'] == st.st_mtime_ns \
+               and index['size'] == st.st_size:
+                self.pts, self.keyframes = index['pts'], index['keyframes']
+                self.width, self.height = index['width'], index['height']
+                return
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+        self.buildIndex()
+        index = {'version': INDEX_VERSION, 'mtime': st.st_mtime_ns, 'size': st.st_size, 'pts': self.pts,
+                 'keyframes': self.keyframes, 'width': self.width, 'height': self.height}
+        try:
+            formats.makeDirs(os.path.dirname(self.getIndexPath()))
+            with open(formats.getTempPath(self.getIndexPath()), 'w') as f:
+                json.dump(index, f)
+            os.replace(formats.getTempPath(self.getIndexPath()), self.getIndexPath())
+        except (IOError, OSError):
+            pass
+
+    def buildIndex(self):
+        keyPts = []
+        pts = []
+        for packet in self.container.demux(self.stream):
+            if packet.pts is None:
+                continue
+            pts.append(packet.pts)
+            if packet.is_keyframe:
+                keyPts.append(packet.pts)
+        self.pts = sorted(pts)
+        self.keyframes = sorted(bisect.bisect_left(self.pts, keyPt) for keyPt in keyPts)
+        self.width, self.height = self.stream.codec_context.width, self.stream.codec_context.height
+        self.container.seek(0)
+
+    def ptsIndex(self, pts):
+        return min(max(bisect.bisect_left(self.pts, pts), 0), len(self.pts) - 1)
+
+    def seek(self, index):
+        keyframe = self.keyframes[max(bisect.bisect_right(self.keyframes, index) - 1, 0)]
+        self.container.seek(self.pts[keyframe], stream = self.stream, backward = True, any_frame = False)
+        self.frames = self.container.decode(self.stream)
+        self.position = -1
+
+    # Full resolution PIL image of a frame
+    def getFrame(self, index):
+        with self.lock:
+            img = self.buffer.get(index)
+            if img is not None:
+                self.buffer.move_to_end(index)
+                return img
+            if self.frames is None or not (self.position < index <= self.position + SEEK_DISTANCE):
+                self.seek(index)
+            for frame in self.frames:
+                if frame.pts is None:
+                    continue
+                self.position = self.ptsIndex(frame.pts)
+                if self.position >= index:
+                    self.buffer[self.position] = frame.to_image()
+                    while len(self.buffer) > BUFFER_FRAMES:
+                        self.buffer.popitem(last = False)
+                if self.position >= index + READ_AHEAD:
+                    break
+            else:
+                self.frames = None  # end of the file
+            img = self.buffer.get(index)
+            if img is None:
+                raise IOError('frame %d of %s could not be decoded' % (index, self.path))
+            return img
+
+    # Writes a frame to its path, unless it is there already
+    def exportFrame(self, index):
+        framePath = self.getFramePath(index)
+        if os.path.exists(framePath):
+            return framePath
+        formats.makeDirs(self.framesDir)
+        img = self.getFrame(index)
+        img.save(formats.getTempPath(framePath), 'JPEG', quality = JPEG_QUALITY)
+        os.replace(formats.getTempPath(framePath), framePath)
+        return framePath
+
+    def close(self):
+        with self.lock:
+            self.buffer.clear()
+            self.frames = None
+            if self.container is not None:
+                self.container.close()
+                self.container = None
@@ -0,0 +1,158 @@
+#-------------------------------------------------------------------------------
+# Euclid - write-behind label saver
+# Label files are written by a background thread so that navigation never
+# waits on disk (or NFS) round trips. Every file is written to a temporary
+# file and renamed over the old one, so a crash never leaves a half written
+# label file. Writes queued together are coalesced per file and share their
+# fsyncs: all temporary files are written, then synced, then renamed.
+#-------------------------------------------------------------------------------
+import os
+import sys
+import threading
+from collections import OrderedDict
+if sys.version_info[0] < 3:
+    import Queue as queue
+else:
+    import queue
+
+from euclidcore import formats, timing
+
+
+class LabelWriter(object):
+
+    def __init__(self, fsync = True):
+        self.fsync = fsync
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}   # path -> text not yet on disk
+        self.errors = []
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    # done, when given, is called on the writer thread once path is written:
+    # with None when the text (or a newer one queued after it) is on disk,
+    # with the error when the write failed
+    def submit(self, path, text, done = None):
+        with self.lock:
+            self.pending[path] = text
+        self.queue.put((path, text, done))
+
+    # Runs task on the writer thread, after everything queued before it.
+    # For shared files that need a locked read-modify-write.
+    def submitTask(self, task):
+        self.queue.put(task)
+
+    # Text queued for path, or None when the file on disk is up to date.
+    # Lets readers see their own writes before they reach the disk.
+    def getPending(self, path):
+        with self.lock:
+            return self.pending.get(path)
+
+    # Error messages of failed writes since the last call
+    def takeErrors(self):
+        with self.lock:
+            errors, self.errors = self.errors, []
+        return errors
+
+    # Blocks until everything queued so far is on disk
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            files = OrderedDict()
+            callbacks = OrderedDict()   # path -> done callables of its coalesced writes
+            tasks = []
+            stop = False
+            for item in items:
+                if item is None:
+                    stop = True
+                elif callable(item):
+                    tasks.append(item)
+                else:
+                    path, text, done = item
+                    files[path] = text
+                    if done is not None:
+                        callbacks.setdefault(path, []).append(done)
+            try:
+                with timing.span('write'):
+                    failures = self.writeBatch(files)
+                for path, dones in callbacks.items():
+                    for done in dones:
+                        try:
+                            done(failures.get(path))
+                        except (IOError, OSError) as e:
+                            with self.lock:
+                                self.errors.append(str(e))
+                for task in tasks:
+                    try:
+                        task()
+                    except (IOError, OSError) as e:
+                        with self.lock:
+                            self.errors.append(str(e))
+            finally:
+                for item in items:
+                    self.queue.task_done()
+            if stop:
+                return
+
+    # Returns {path: error} of the files that could not be written
+    def writeBatch(self, files):
+        failures = {}
+        written = []
+        # writes all the files first, so that the fsyncs below are issued back to back
+        for path, text in files.items():
+            try:
+                f = open(formats.getTempPath(path), 'w')
+                f.write(text)
+                f.flush()
+                written.append((path, text, f))
+            except (IOError, OSError) as e:
+                self.failed(path, text, e)
+                failures[path] = e
+        dirs = set()
+        for path, text, f in written:
+            try:
+                if self.fsync:
+                    os.fsync(f.fileno())
+                f.close()
+                os.replace(formats.getTempPath(path), path)
+                dirs.add(os.path.dirname(path))
+            except OSError as e:
+                self.failed(path, text, e)
+                failures[path] = e
+                continue
+            with self.lock:
+                # a newer version may have been queued meanwhile
+                if self.pending.get(path) is text:
+                    del self.pending[path]
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            # makes the renames durable, once per folder
+            for d in dirs:
+                try:
+                    fd = os.open(d or '.', os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+        return failures
+
+    def failed(self, path, text, error):
+        with self.lock:
+            self.errors.append('%s: %s' % (path, error))
+            if self.pending.get(path) is text:
+                del self.pending[path]
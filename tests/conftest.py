@@ -0,0 +1,44 @@
+#-------------------------------------------------------------------------------
+# Euclid - test fixtures
+# The tests run from a checkout, without installing euclidcore. Datasets are
+# small folders of generated JPEGs with label files, made in tmp_path.
+#-------------------------------------------------------------------------------
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from euclidcore import formats
+
+
+# Writes count JPEGs of size into imageDir (img000.jpg, ..) and, for every
+# image given in labels, its label file. labels maps an image index to
+# (labelMode, classIds, bboxes). Returns the image paths in name order.
+def writeDataset(imageDir, count, labels = None, size = (64, 48)):
+    formats.makeDirs(formats.getLabelDir(imageDir))
+    img = Image.linear_gradient('L').resize(size).convert('RGB')
+    imagePaths = []
+    for index in range(count):
+        imagePath = os.path.join(imageDir, 'img%03d.jpg' % index)
+        img.save(imagePath, 'JPEG', quality = 90)
+        imagePaths.append(imagePath)
+    for index, (labelMode, classIds, bboxes) in (labels or {}).items():
+        labelPath = os.path.join(formats.getLabelDir(imageDir), 'img%03d.txt' % index)
+        formats.writeLabelRows(labelPath, formats.formatLabelRows(labelMode, classIds, bboxes, size[0], size[1]))
+    return imagePaths
+
+
+@pytest.fixture
+def imageDir(tmp_path):
+    path = str(tmp_path / 'images')
+    os.mkdir(path)
+    return path
+
+
+@pytest.fixture
+def makeDataset(imageDir):
+    return lambda count, labels = None, size = (64, 48): writeDataset(imageDir, count, labels, size)
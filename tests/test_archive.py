@@ -0,0 +1,42 @@
+import io
+import os
+import tarfile
+
+from PIL import Image
+
+from euclidcore import formats
+from euclidcore.archive import ArchiveSource
+from euclidcore.dataset import Dataset
+
+
+def writeTar(archivePath, names):
+    data = io.BytesIO()
+    Image.new('RGB', (40, 30)).save(data, 'JPEG')
+    with tarfile.open(archivePath, 'w') as tar:
+        for name in names:
+            member = tarfile.TarInfo(name)
+            member.size = len(data.getvalue())
+            tar.addfile(member, io.BytesIO(data.getvalue()))
+
+
+# Members named alike in different archives, or in different folders of one
+# archive, each get a label file of their own
+def testArchiveMembersKeepLabelsOfTheirOwn(imageDir):
+    archivePaths = [os.path.join(imageDir, 'shard-%d.tar' % index) for index in range(2)]
+    for archivePath in archivePaths:
+        writeTar(archivePath, ['images/000.jpg', 'other/000.jpg'])
+    source = ArchiveSource(archivePaths)
+    imagePaths = source.open()
+    assert len(imagePaths) == 4
+
+    dataset = Dataset(imageDir)
+    for classId, imagePath in enumerate(imagePaths):
+        dataset.writeLabels(imagePath, 'KITTI', [classId], [(1, 1, 9, 9)], source.getSize(imagePath))
+    assert dataset.getRelPath(imagePaths[1]) == 'shard-0.tar/other/000.jpg'
+    assert dataset.getLabelPath(imagePaths[3]) == os.path.join(formats.getLabelDir(imageDir), 'shard-1.tar',
+                                                               'other', '000.txt')
+    assert dataset.labelledNames() == set(['shard-0.tar/images/000', 'shard-0.tar/other/000',
+                                           'shard-1.tar/images/000', 'shard-1.tar/other/000'])
+    assert [dataset.readLabels(imagePath)[1] for imagePath in imagePaths] == [[0], [1], [2], [3]]
+    dataset.close()
+    source.close()
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from euclidcore import bench
+from euclidcore.bench import compareResults, flatten, main, runBenchmarks, summarize
+
+
+def makeResults(cases):
+    return {'cases': cases}
+
+
+def testSummaryCountsSamples():
+    summary = summarize([0.001, 0.003, 0.002])
+    assert (summary['count'], summary['samples'], summary['p50'], summary['perRun']) == (3, 3, 2.0, False)
+    summary = summarize([0.5, 0.4], 1000)
+    assert (summary['count'], summary['samples'], summary['throughput']) == (2000, 2, pytest.approx(2000 / 0.9))
+    assert summary['perRun']
+
+
+# Slowdowns count when larger than the tolerance and the noise floor, over
+# MIN_SAMPLES timings, or MIN_RUNS runs for the cases timed once per run
+def testOnlyRepeatableSlowdownsRegress():
+    many, few = bench.MIN_SAMPLES, bench.MIN_SAMPLES - 1
+    baseline = makeResults({'load': {'10': {'p50': 1.0, 'samples': many}, '100': {'p50': 2.0, 'samples': few}},
+                            'parse': {'10': {'p50': 0.010, 'samples': many}},
+                            'scan': {'cold': {'p50': 50.0, 'samples': bench.MIN_RUNS, 'perRun': True},
+                                     'warm': {'p50': 5.0, 'samples': bench.MIN_RUNS - 1, 'perRun': True}},
+                            'old': {'p50': 1.0}})
+    results = makeResults({'load': {'10': {'p50': 1.5, 'samples': many}, '100': {'p50': 3.0, 'samples': few}},
+                           'parse': {'10': {'p50': 0.020, 'samples': many}},
+                           'scan': {'cold': {'p50': 80.0, 'samples': bench.MIN_RUNS, 'perRun': True},
+                                    'warm': {'p50': 8.0, 'samples': bench.MIN_RUNS - 1, 'perRun': True}},
+                           'old': {'p50': 2.0}})
+    rows = dict((row[0], row[1:]) for row in compareResults(results, baseline))
+    assert rows['load/10'] == (1.0, 1.5, 1.5, True)
+    assert rows['load/100'][3] is False     # too few timings
+    assert rows['parse/10'][3] is False     # doubled, but within the noise floor
+    assert rows['scan/cold'][3] is True
+    assert rows['scan/warm'][3] is False    # too few runs
+    assert rows['old'][3] is False          # baseline without sample counts
+    assert compareResults(results, baseline, tolerance = 0.6)[0] == ('load/10', 1.0, 1.5, 1.5, False)
+
+
+def testRunOnSmallDataset(tmp_path):
+    results = runBenchmarks(str(tmp_path), 8, [0, 3], ('yolo',), (64, 48), ('scan', 'load', 'save'),
+                            samples = 4, repeats = 2)
+    cases = results['cases']
+    assert cases['load/yolo']['3']['samples'] == 4
+    assert cases['scan/yolo']['cold']['count'] == 16
+    assert cases['save/yolo']['3']['written']['samples'] == 2
+    assert not any(row[4] for row in compareResults(results, results))
+
+
+# With the default --repeats and --tolerance, a scan slower than the
+# baseline fails --strict
+def testSlowerScanFailsStrictByDefault(tmp_path):
+    benchDir, output = str(tmp_path / 'bench'), str(tmp_path / 'base.json')
+    args = ['--images', '200', '--boxes', '0', '--format', 'kitti', '--size', '32x24', '--cases', 'scan',
+            '--dir', benchDir]
+    assert main(args + ['--output', output]) == 0
+    with open(output) as f:
+        baseline = json.load(f)
+    for summary in flatten(baseline['cases']).values():
+        assert summary['samples'] == bench.DEFAULT_REPEATS
+        summary['p50'] /= 10.0
+    with open(output, 'w') as f:
+        json.dump(baseline, f)
+    assert main(args + ['--baseline', output, '--strict']) == 1
@@ -0,0 +1,73 @@
+import random
+
+from euclidcore import boxes
+from euclidcore.boxes import BoxList
+
+
+def randomBoxList(rng, count, width = 640, height = 480):
+    boxList = BoxList()
+    for index in range(count):
+        x, y = rng.randint(0, width - 1), rng.randint(0, height - 1)
+        boxList.append((x, y, x + rng.randint(1, 60), y + rng.randint(1, 60)), index % 8, 100 + index)
+    return boxList
+
+
+def linearHits(boxList, x, y):
+    hits = [index for index in range(len(boxList))
+            if boxList.x1[index] <= x <= boxList.x2[index] and boxList.y1[index] <= y <= boxList.y2[index]]
+    return sorted(hits, key = boxList.area)
+
+
+def linearOverlaps(boxList, bbox):
+    x1, y1, x2, y2 = bbox
+    return [index for index in range(len(boxList))
+            if boxList.x1[index] <= x2 and x1 <= boxList.x2[index] and
+               boxList.y1[index] <= y2 and y1 <= boxList.y2[index]]
+
+
+def checkQueries(boxList, rng):
+    for i in range(300):
+        x, y = rng.uniform(-20, 700), rng.uniform(-20, 540)
+        assert boxList.hitTest(x, y) == linearHits(boxList, x, y)
+        bbox = (x, y, x + rng.uniform(0, 200), y + rng.uniform(0, 200))
+        assert boxList.overlapping(bbox) == linearOverlaps(boxList, bbox)
+
+
+def testGridQueriesMatchLinearScan():
+    rng = random.Random(3)
+    boxList = randomBoxList(rng, 500)
+    checkQueries(boxList, rng)
+    # boxes added after the grid was built are indexed as they come
+    for index in range(50):
+        boxList.append((rng.randint(0, 600), rng.randint(0, 400), 640, 480), 0)
+    checkQueries(boxList, rng)
+
+
+def testInsertAndPopKeepColumnsTogether():
+    boxList = BoxList([1, 2], [(0, 0, 10, 10), (20, 20, 30, 30)])
+    assert boxList.boxAt(25, 25) == 1
+    assert boxList.pop(0) == ((0, 0, 10, 10), 1, -1)
+    assert boxList.boxAt(25, 25) == 0
+    boxList.insert(0, (0, 0, 10, 10), 1, 7)
+    assert boxList.bboxList() == [(0, 0, 10, 10), (20, 20, 30, 30)]
+    assert boxList.classIdList() == [1, 2]
+    assert boxList.itemIdList() == [7, -1]
+    assert boxList.boxAt(5, 5) == 0
+    assert boxList.boxAt(15, 15) == -1
+
+
+# A box covering more than MAX_BOX_CELLS grid cells is kept out of the grid,
+# in the large list, and still found by every query
+def testOversizedBoxStaysOutOfGrid():
+    rng = random.Random(5)
+    boxList = randomBoxList(rng, 1000)
+    huge = boxList.append((-20000, -20000, 20000, 20000), 1)
+    assert boxList.boxAt(100, 100) != -1
+    assert boxList.large == [huge]
+    assert sum(len(indices) for indices in boxList.grid.values()) < 1000 * boxes.MAX_BOX_CELLS
+    assert boxList.hitTest(-15000, 300) == [huge]
+    assert boxList.overlapping((-20000, -20000, 20000, 20000)) == list(range(len(boxList)))
+    checkQueries(boxList, rng)
+
+    boxList.pop(0)
+    assert boxList.boxAt(-15000, 300) == huge - 1
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from euclidcore import formats
+from euclidcore.convert import convertDataset
+
+
+def readLabels(labelDir, name, size = (64, 48)):
+    return formats.parseLabelRows(formats.readLabelRows(os.path.join(labelDir, name)), size[0], size[1])
+
+
+def testKittiYoloRoundtrip(imageDir, makeDataset, tmp_path):
+    bboxes = [(1, 2, 30, 40), (10, 11, 63, 47), (0, 0, 1, 1)]
+    makeDataset(2, {0: ('KITTI', [0, 3, 7], bboxes), 1: ('KITTI', [], [])})
+    yoloDir, kittiDir = str(tmp_path / 'yolo'), str(tmp_path / 'kitti')
+
+    assert convertDataset(imageDir, 'YOLO', yoloDir, workers = 1) == (2, [])
+    labelMode, classIds, converted = readLabels(yoloDir, 'img000.txt')
+    assert (labelMode, classIds) == ('YOLO', [0, 3, 7])
+    # the same rows as the labeller writes when saving in YOLO
+    with open(os.path.join(yoloDir, 'img000.txt')) as f:
+        assert f.read() == ''.join(formats.formatLabelRows('YOLO', [0, 3, 7], bboxes, 64, 48))
+
+    # the YOLO files converted back need the images, so they go next to them
+    for name in os.listdir(yoloDir):
+        os.replace(os.path.join(yoloDir, name), os.path.join(formats.getLabelDir(imageDir), name))
+    assert convertDataset(imageDir, 'KITTI', kittiDir, workers = 1) == (2, [])
+    labelMode, classIds, roundtrip = readLabels(kittiDir, 'img000.txt')
+    assert (labelMode, classIds) == ('KITTI', [0, 3, 7])
+    for bbox, back in zip(bboxes, roundtrip):
+        assert all(abs(a - b) <= 1 for a, b in zip(bbox, back))
+    assert readLabels(kittiDir, 'img001.txt') == (None, [], [])
+
+
+def testRowsInTargetFormatAreKept(imageDir, makeDataset, tmp_path):
+    makeDataset(1)
+    yoloRow = formats.formatYoloRow(5, (0.5, 0.5, 0.25, 0.25))
+    formats.writeLabelRows(os.path.join(formats.getLabelDir(imageDir), 'img000.txt'),
+                           [formats.formatKittiRow('Class2', (4, 4, 20, 20)), yoloRow])
+    outDir = str(tmp_path / 'out')
+    assert convertDataset(imageDir, 'YOLO', outDir, workers = 1) == (1, [])
+    with open(os.path.join(outDir, 'img000.txt')) as f:
+        lines = f.readlines()
+    assert lines[0] == formats.formatYoloRow(2, formats.convert2Yolo((64, 48), (4, 4, 20, 20)))
+    assert lines[1].split() == yoloRow.split()
+
+
+def testLabelFileWithoutImageIsAnError(imageDir, makeDataset, tmp_path):
+    makeDataset(1, {0: ('KITTI', [1], [(1, 1, 5, 5)])})
+    formats.writeLabelRows(os.path.join(formats.getLabelDir(imageDir), 'gone.txt'),
+                           [formats.formatKittiRow('Class1', (1, 1, 5, 5))])
+    count, errors = convertDataset(imageDir, 'YOLO', str(tmp_path / 'out'), workers = 1)
+    assert count == 1
+    assert errors == ['gone.txt: no image found for label file']
+
+
+def testClassIdsOutsideTheClassListAreErrors(imageDir, makeDataset, tmp_path):
+    makeDataset(3, {0: ('KITTI', [1], [(1, 1, 5, 5)])})
+    labelDir = formats.getLabelDir(imageDir)
+    formats.writeLabelRows(os.path.join(labelDir, 'img001.txt'), [formats.formatYoloRow(9, (0.5, 0.5, 0.2, 0.2))])
+    formats.writeLabelRows(os.path.join(labelDir, 'img002.txt'), [formats.formatYoloRow(-1, (0.5, 0.5, 0.2, 0.2))])
+    outDir = str(tmp_path / 'out')
+    count, errors = convertDataset(imageDir, 'KITTI', outDir, workers = 1)
+    assert count == 1
+    assert sorted(errors) == ['img001.txt: class 9 is not one of the 8 classes',
+                              'img002.txt: class -1 is not one of the 8 classes']
+    assert sorted(os.listdir(outDir)) == ['img000.txt']
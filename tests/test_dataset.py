@@ -0,0 +1,87 @@
+import os
+import threading
+
+from euclidcore import formats
+from euclidcore.dataset import Dataset
+from euclidcore.store import AnnotationStore, getStorePath
+from euclidcore.writer import LabelWriter
+
+
+def makeStore(imageDir):
+    formats.makeDirs(formats.getCacheDir(imageDir))
+    AnnotationStore(getStorePath(imageDir)).close()
+
+
+def testQueuedLabelsAreReadBeforeWritten(imageDir):
+    writer = LabelWriter(fsync = False)
+    dataset = Dataset(imageDir, writer = writer)
+    imagePath = os.path.join(imageDir, 'a.jpg')
+    results = []
+    dataset.writeLabels(imagePath, 'KITTI', [2], [(1, 2, 3, 4)], (64, 48), results.append)
+    assert dataset.readLabels(imagePath) == ('KITTI', [2], [(1, 2, 3, 4)])
+    assert dataset.hasLabels(imagePath)
+    writer.flush()
+    assert results == [None]
+    assert writer.getPending(dataset.getLabelPath(imagePath)) is None
+    assert dataset.readLabels(imagePath) == ('KITTI', [2], [(1, 2, 3, 4)])
+    dataset.close()
+    writer.close()
+
+
+# A failed write reports its error to done, so the labeller does not mark
+# the journaled edits of the image saved
+def testFailedWriteReportsError(imageDir):
+    writer = LabelWriter(fsync = False)
+    dataset = Dataset(imageDir, writer = writer)
+    imagePath = os.path.join(imageDir, 'a.jpg')
+    os.makedirs(dataset.getLabelPath(imagePath))    # a folder in the way of the rename
+    results = []
+    dataset.writeLabels(imagePath, 'KITTI', [2], [(1, 2, 3, 4)], (64, 48), results.append)
+    writer.flush()
+    assert len(results) == 1 and isinstance(results[0], OSError)
+    assert len(writer.takeErrors()) == 1
+    assert writer.getPending(dataset.getLabelPath(imagePath)) is None
+    dataset.close()
+    writer.close()
+
+
+# Boxes saved to the store are committed on the writer thread, and read
+# back from the queue until then
+def testStoreWritesAreQueued(imageDir):
+    makeStore(imageDir)
+    writer = LabelWriter(fsync = False)
+    dataset = Dataset(imageDir, writer = writer)
+    imagePath = os.path.join(imageDir, 'a.jpg')
+    release = threading.Event()
+    writer.submitTask(release.wait)
+    results = []
+    dataset.writeLabels(imagePath, 'YOLO', [2], [(1, 2, 3, 4)], (64, 48), results.append)
+    assert dataset.store.getBoxes('a') is None
+    assert dataset.readLabels(imagePath) == ('YOLO', [2], [(1, 2, 3, 4)])
+    assert dataset.hasLabels(imagePath)
+    assert dataset.labelledNames() == set(['a'])
+    assert results == []
+    release.set()
+    writer.flush()
+    assert results == [None]
+    assert dataset.getPending('a') is None
+    assert dataset.store.getBoxes('a') == ('YOLO', [2], [(1, 2, 3, 4)])
+    dataset.close()
+    writer.close()
+
+
+def testFailedStoreWriteReportsError(imageDir):
+    makeStore(imageDir)
+    writer = LabelWriter(fsync = False)
+    dataset = Dataset(imageDir, writer = writer)
+    imagePath = os.path.join(imageDir, 'a.jpg')
+    dataset.store.conn.close()
+    results = []
+    dataset.writeLabels(imagePath, 'KITTI', [2], [(1, 2, 3, 4)], (64, 48), results.append)
+    writer.flush()
+    assert len(results) == 1 and isinstance(results[0], IOError)
+    assert len(writer.takeErrors()) == 1
+    assert dataset.getPending('a') is None
+    dataset.store = None
+    dataset.close()
+    writer.close()
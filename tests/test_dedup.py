@@ -0,0 +1,63 @@
+import os
+import random
+import sqlite3
+
+from PIL import Image
+
+from euclidcore import formats
+from euclidcore.dedup import HASH_CACHE_NAME, BKTree, HashCache, clusterImages, copyLabels, findDuplicates, hamming
+
+
+def testTreeSearchFindsAllValuesInRange():
+    rng = random.Random(3)
+    values = [rng.getrandbits(64) for _ in range(300)]
+    # near copies, so that searches find more than the value itself
+    values += [value ^ (1 << rng.randrange(64)) for value in values[:100]]
+    tree = BKTree()
+    for index, value in enumerate(values):
+        tree.add(value, index)
+    for probe in values[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        for maxDistance in (0, 3, 20):
+            found = tree.search(probe, maxDistance)
+            assert sorted(item for distance, item in found) == \
+                [index for index, value in enumerate(values) if hamming(probe, value) <= maxDistance]
+            assert [distance for distance, item in found] == sorted(distance for distance, item in found)
+    assert BKTree().search(0, 64) == []
+
+
+# Images join the nearest representative before them in name order,
+# unreadable ones (hash None) stay on their own
+def testClustersFollowNameOrder():
+    paths = ['d.jpg', 'a.jpg', 'c.jpg', 'b.jpg', 'e.jpg']
+    hashes = [0b1, 0, 0xff00, 0b11, None]
+    clusters = clusterImages(paths, hashes, maxDistance = 2)
+    assert list(clusters.items()) == [('a.jpg', ['b.jpg', 'd.jpg']), ('c.jpg', []), ('e.jpg', [])]
+    assert list(clusterImages(paths, hashes, maxDistance = 0)) == ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg', 'e.jpg']
+
+
+def testHashesAreCached(imageDir, makeDataset):
+    imagePaths = makeDataset(2)
+    other = os.path.join(imageDir, 'other.jpg')
+    Image.linear_gradient('L').transpose(Image.TRANSPOSE).transpose(Image.FLIP_LEFT_RIGHT).save(other, 'JPEG')
+    paths = imagePaths + [other, os.path.join(imageDir, 'gone.jpg')]
+    cache = HashCache(imageDir)
+    hashes = cache.getHashes(paths, workers = 1)
+    assert hashes[0] == hashes[1] and hashes[3] is None
+    assert hamming(hashes[0], hashes[2]) > 32
+    # every row is cached, so nothing is hashed again
+    assert len(cache.lookup(paths)[2]) == 0
+    assert cache.getHashes(paths, workers = 1) == hashes
+    cache.close()
+    conn = sqlite3.connect(os.path.join(formats.getCacheDir(imageDir), HASH_CACHE_NAME))
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    conn.close()
+
+
+def testLabelsAreCopiedToDuplicates(imageDir, makeDataset):
+    imagePaths = makeDataset(3, {0: ('KITTI', [2], [(1, 1, 9, 9)]), 2: ('KITTI', [5], [(3, 3, 7, 7)])})
+    clusters = findDuplicates(imageDir, workers = 1)
+    assert list(clusters.items()) == [(imagePaths[0], imagePaths[1:])]
+    assert copyLabels(imageDir, clusters) == 1
+    labelPath = os.path.join(formats.getLabelDir(imageDir), 'img001.txt')
+    assert formats.parseLabelRows(formats.readLabelRows(labelPath), 64, 48) == ('KITTI', [2], [(1, 1, 9, 9)])
+    assert copyLabels(imageDir, clusters, overwrite = True) == 2
@@ -0,0 +1,38 @@
+import os
+import sqlite3
+import time
+
+from PIL import Image
+
+from euclidcore import formats
+from euclidcore.dims import CACHE_NAME, ImageSizeCache
+
+
+def testSizesAreReadAgainWhenImageChanges(imageDir, makeDataset):
+    imagePaths = makeDataset(2)
+    cache = ImageSizeCache(imageDir)
+    assert cache.getSizes(imagePaths + [os.path.join(imageDir, 'gone.jpg')]) == [(64, 48), (64, 48), None]
+    time.sleep(0.01)
+    Image.new('RGB', (20, 10)).save(imagePaths[1], 'JPEG')
+    assert cache.getSize(imagePaths[1]) == (20, 10)
+    cache.close()
+
+
+# WAL needs memory shared between the processes using the file, which hosts
+# sharing the folder over a network file system do not have. A cache left
+# in WAL mode is switched back when opened.
+def testCacheUsesRollbackJournal(imageDir, makeDataset):
+    imagePaths = makeDataset(1)
+    cachePath = os.path.join(formats.getCacheDir(imageDir), CACHE_NAME)
+    formats.makeDirs(os.path.dirname(cachePath))
+    conn = sqlite3.connect(cachePath)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.close()
+
+    cache = ImageSizeCache(imageDir)
+    cache.getSizes(imagePaths)
+    cache.close()
+    assert not any(name.endswith(('-wal', '-shm')) for name in os.listdir(formats.getCacheDir(imageDir)))
+    conn = sqlite3.connect(cachePath)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    conn.close()
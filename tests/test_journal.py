@@ -0,0 +1,79 @@
+import json
+import os
+
+from euclidcore import journal
+from euclidcore.journal import EditJournal, replayRecords
+
+
+def testReplayRebuildsUnsavedEdits():
+    records = [{'op': 'begin', 'image': 'a.jpg', 'labelMode': 'KITTI', 'size': [64, 48],
+                'classIds': [1], 'bboxes': [[0, 0, 10, 10]], 'seq': 1},
+               {'op': 'add', 'image': 'a.jpg', 'index': 1, 'classId': 2, 'bbox': [5, 5, 20, 20], 'seq': 2},
+               {'op': 'delete', 'image': 'a.jpg', 'index': 0, 'seq': 3}]
+    unsaved = replayRecords(records)
+    assert list(unsaved) == ['a.jpg']
+    assert unsaved['a.jpg'] == [3, 'KITTI', (64, 48), [2], [(5, 5, 20, 20)]]
+
+
+def testSavedMarkCoversEditsUpToIt():
+    records = [{'op': 'begin', 'image': 'a.jpg', 'labelMode': 'YOLO', 'size': [64, 48],
+                'classIds': [], 'bboxes': [], 'seq': 1},
+               {'op': 'add', 'image': 'a.jpg', 'index': 0, 'classId': 0, 'bbox': [1, 1, 9, 9], 'seq': 2},
+               {'op': 'saved', 'image': 'a.jpg', 'upto': 2}]
+    assert len(replayRecords(records)) == 0
+
+
+# Edits made while the label writer caught up start from a new begin record
+# and are newer than the saved mark, so they are kept
+def testEditsAfterQueuedSaveSurviveItsMark():
+    records = [{'op': 'begin', 'image': 'a.jpg', 'labelMode': 'YOLO', 'size': [64, 48],
+                'classIds': [], 'bboxes': [], 'seq': 1},
+               {'op': 'add', 'image': 'a.jpg', 'index': 0, 'classId': 0, 'bbox': [1, 1, 9, 9], 'seq': 2},
+               {'op': 'begin', 'image': 'a.jpg', 'labelMode': 'YOLO', 'size': [64, 48],
+                'classIds': [0], 'bboxes': [[1, 1, 9, 9]], 'seq': 3},
+               {'op': 'add', 'image': 'a.jpg', 'index': 1, 'classId': 3, 'bbox': [2, 2, 8, 8], 'seq': 4},
+               {'op': 'saved', 'image': 'a.jpg', 'upto': 2}]
+    assert replayRecords(records)['a.jpg'][3:] == [[0, 3], [(1, 1, 9, 9), (2, 2, 8, 8)]]
+
+
+def testRecoverIgnoresLineCutShort(imageDir):
+    edits = EditJournal(imageDir)
+    edits.begin('a.jpg', 'KITTI', (64, 48), [], [])
+    edits.add('a.jpg', 0, 1, (0, 0, 5, 5))
+    edits.f.write('{"op": "add", "ima')
+    edits.f.flush()
+    assert edits.recover() == {'a.jpg': ('KITTI', (64, 48), [1], [(0, 0, 5, 5)])}
+    edits.f.close()
+
+
+def testCompactKeepsUnsavedImagesOnly(imageDir):
+    edits = EditJournal(imageDir)
+    edits.begin('a.jpg', 'KITTI', (64, 48), [], [])
+    edits.add('a.jpg', 0, 1, (0, 0, 5, 5))
+    edits.begin('b.jpg', 'YOLO', (64, 48), [], [])
+    upto = edits.add('b.jpg', 0, 2, (1, 1, 6, 6))
+    edits.markSaved('b.jpg', upto)
+    edits.compact()
+    with open(edits.path) as f:
+        records = [json.loads(line) for line in f]
+    assert [(record['op'], record['image']) for record in records] == [('begin', 'a.jpg')]
+    assert records[0]['bboxes'] == [[0, 0, 5, 5]]
+    edits.f.close()
+
+    # sequence numbers go on from the compacted journal
+    reopened = EditJournal(imageDir)
+    assert reopened.seq == records[0]['seq']
+    assert reopened.recover() == {'a.jpg': ('KITTI', (64, 48), [1], [(0, 0, 5, 5)])}
+    reopened.f.close()
+
+
+def testMarkSavedCompactsLargeJournal(imageDir, monkeypatch):
+    monkeypatch.setattr(journal, 'COMPACT_BYTES', 1024)
+    edits = EditJournal(imageDir)
+    edits.begin('a.jpg', 'KITTI', (64, 48), [], [])
+    for index in range(50):
+        edits.add('a.jpg', index, 0, (index, index, index + 5, index + 5))
+    edits.markSaved('a.jpg', edits.seq)
+    assert os.path.getsize(edits.path) == 0
+    edits.close()
+    assert not os.path.exists(edits.path)
@@ -0,0 +1,60 @@
+from euclidcore import lease
+from euclidcore.lease import LeaseTable
+
+
+def makeTables(imageDir, count = 10):
+    first, second = LeaseTable(imageDir, 'first'), LeaseTable(imageDir, 'second')
+    first.register('img%03d' % index for index in range(count))
+    return first, second
+
+
+def testAnnotatorsClaimDisjointChunks(imageDir):
+    first, second = makeTables(imageDir)
+    chunkA, chunkB = first.claim(4), second.claim(4)
+    assert chunkA == ['img000', 'img001', 'img002', 'img003']
+    assert chunkB == ['img004', 'img005', 'img006', 'img007']
+    # an annotator claiming again gets its own chunk back first
+    assert first.claim(5) == chunkA + ['img008']
+    assert all(first.owns(name) and not second.owns(name) for name in chunkA)
+    assert second.claim(4) == chunkB
+    first.close()
+    second.close()
+
+
+def testExpiredLeaseIsReclaimed(imageDir, monkeypatch):
+    first, second = makeTables(imageDir, 4)
+    monkeypatch.setattr(lease, 'LEASE_SECONDS', -1)
+    chunk = first.claim(2)
+    assert first.owns(chunk[0])
+    assert second.owns(chunk[0])     # expired, free to take
+    monkeypatch.setattr(lease, 'LEASE_SECONDS', 300)
+    assert second.claim(2) == chunk
+    assert not first.owns(chunk[0])
+    assert second.renew() == 2
+    first.close()
+    second.close()
+
+
+def testReleaseHandsBackImagesNotDone(imageDir):
+    first, second = makeTables(imageDir, 4)
+    chunk = first.claim(3)
+    first.markDone(chunk[0])
+    first.release()
+    assert second.claim(4) == ['img001', 'img002', 'img003']
+    assert not first.owns('img001')
+    assert first.owns(chunk[0])      # done by first, not leased again
+    first.close()
+    second.close()
+
+
+def testDoneImagesAreNotClaimedAgain(imageDir):
+    first, second = makeTables(imageDir, 4)
+    for name in first.claim(2):
+        first.markDone(name)
+    assert tuple(first.progress()) == (2, 4)
+    assert first.claim(4) == ['img002', 'img003']
+    first.release()
+    assert second.claim(4) == ['img002', 'img003']
+    assert not second.owns('img000')
+    first.close()
+    second.close()
@@ -0,0 +1,31 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from euclidcore.locking import FileLock
+
+
+# POSIX record locks are held per process, so the lock is taken in another one
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason = 'needs POSIX record locks')
+def testFileLockWaitsForOtherProcess(tmp_path):
+    path = str(tmp_path / 'shared.lock')
+    code = ('import sys\nfrom euclidcore.locking import FileLock\n'
+            'with FileLock(sys.argv[1]):\n    print("locked", flush = True)\n    sys.stdin.readline()\n')
+    env = dict(os.environ, PYTHONPATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    child = subprocess.Popen([sys.executable, '-c', code, path], stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+                             env = env, universal_newlines = True)
+    try:
+        assert child.stdout.readline().strip() == 'locked'
+        with pytest.raises(IOError):
+            with FileLock(path, timeout = 0.2):
+                pass
+        child.stdin.write('\n')
+        child.stdin.flush()
+        assert child.wait(10) == 0
+        with FileLock(path, timeout = 5) as held:
+            assert held.f is not None
+    finally:
+        if child.poll() is None:
+            child.kill()
@@ -0,0 +1,84 @@
+from euclidcore.prefetch import ImagePrefetcher
+from euclidcore.pyramid import TILE_SIZE, VIEW_MAX_WIDTH, decodeForView
+
+
+# Stands in for an ImagePyramid, its levels are only byte counts
+class FakeImage(object):
+
+    def __init__(self, nbytes):
+        self.levels = [nbytes]
+
+    def nbytes(self):
+        return sum(self.levels)
+
+
+def makePrefetcher(loaded, maxBytes):
+    def loadImage(key):
+        loaded.append(key)
+        return FakeImage(100)
+    return ImagePrefetcher(loadImage, lambda key, image: ('KITTI', [0], [(0, 0, 1, 1)]), maxBytes, workers = 1)
+
+
+def testCacheEvictsLeastRecentlyUsed():
+    loaded = []
+    prefetcher = makePrefetcher(loaded, 250)
+    prefetcher.get('a')
+    prefetcher.get('b')
+    prefetcher.get('a')
+    prefetcher.get('c')
+    assert list(prefetcher.cache) == ['a', 'c']
+    assert prefetcher.cacheBytes == 200
+    prefetcher.get('a')
+    assert loaded == ['a', 'b', 'c']
+    prefetcher.close()
+
+
+# Zoom levels decoded after an image was stored count against the memory
+# budget, and evict other images once the cache holds more than maxBytes
+def testDecodedLevelsCountAgainstBudget():
+    prefetcher = makePrefetcher([], 250)
+    first = prefetcher.get('a').image
+    prefetcher.get('b')
+    first.levels.append(120)
+    prefetcher.updateBytes('a')
+    assert list(prefetcher.cache) == ['a']
+    assert prefetcher.cacheBytes == 220
+
+    first.levels.pop()
+    prefetcher.updateBytes('a')
+    assert prefetcher.cacheBytes == 100
+    prefetcher.updateBytes('gone')      # evicted meanwhile, nothing to count
+    assert prefetcher.cacheBytes == 100
+    prefetcher.close()
+
+
+def testLabelsAreReadAgainWhenForgotten():
+    prefetcher = makePrefetcher([], 1000)
+    entry = prefetcher.get('a')
+    prefetcher.setLabels('a', ('YOLO', [], []))
+    assert prefetcher.get('a').labels == ('YOLO', [], [])
+    prefetcher.forgetLabels('a')
+    assert entry.labels is None
+    assert prefetcher.get('a').labels == ('KITTI', [0], [(0, 0, 1, 1)])
+    prefetcher.close()
+
+
+def testScheduledImagesAreDecodedInBackground():
+    loaded = []
+    prefetcher = makePrefetcher(loaded, 1000)
+    prefetcher.schedule(['a', 'b'])
+    assert prefetcher.get('b').image.nbytes() == 100
+    prefetcher.get('a')
+    assert sorted(loaded) == ['a', 'b']
+    prefetcher.close()
+
+
+def testDecodeForViewDecodesFitLevelOnly(makeDataset):
+    imagePath = makeDataset(1, size = (VIEW_MAX_WIDTH * 4, TILE_SIZE * 4))[0]
+    pyramid = decodeForView(imagePath)
+    assert pyramid.fitLevel() == 2
+    assert list(pyramid.levels) == [2]
+    assert pyramid.nbytes() == VIEW_MAX_WIDTH * TILE_SIZE * 3
+    pyramid.getLevel(0)
+    pyramid.releaseLevels((pyramid.fitLevel(),))
+    assert list(pyramid.levels) == [2]
@@ -0,0 +1,51 @@
+import os
+
+from PIL import Image
+
+from euclidcore import formats
+from euclidcore.preprocess import getGeometry, preprocessDataset
+
+
+def testGeometry():
+    assert getGeometry((640, 480), None, 'fit') == ((640, 480), (640, 480), (1.0, 1.0, 0, 0))
+    assert getGeometry((640, 480), (320, 320), 'stretch') == ((320, 320), (320, 320), (0.5, 320 / 480.0, 0, 0))
+    assert getGeometry((640, 480), (320, 320), 'fit') == ((320, 240), (320, 240), (0.5, 0.5, 0, 0))
+    assert getGeometry((640, 480), (320, 320), 'letterbox') == ((320, 240), (320, 320), (0.5, 0.5, 0, 40))
+
+
+def readLabels(imageDir, name, size):
+    return formats.parseLabelRows(formats.readLabelRows(os.path.join(formats.getLabelDir(imageDir), name)),
+                                  size[0], size[1])
+
+
+def testLetterboxMovesLabels(imageDir, makeDataset, tmp_path):
+    makeDataset(2, {0: ('KITTI', [2], [(8, 8, 40, 24)]), 1: ('YOLO', [5], [(0, 0, 64, 48)])})
+    outDir = str(tmp_path / 'out')
+    assert preprocessDataset(imageDir, outDir, (32, 32), 'letterbox', workers = 1) == (2, 0, [])
+    assert Image.open(os.path.join(outDir, 'img000.jpg')).size == (32, 32)
+    assert readLabels(outDir, 'img000.txt', (32, 32)) == ('KITTI', [2], [(4, 8, 20, 16)])
+    # YOLO labels stay YOLO, relative to the padded image
+    assert readLabels(outDir, 'img001.txt', (32, 32)) == ('YOLO', [5], [(0, 4, 32, 28)])
+
+
+def testRerunSkipsUpToDateOutputs(imageDir, makeDataset, tmp_path):
+    makeDataset(3, {0: ('KITTI', [1], [(1, 1, 9, 9)])})
+    outDir = str(tmp_path / 'out')
+    assert preprocessDataset(imageDir, outDir, (32, 32), workers = 1) == (3, 0, [])
+    assert preprocessDataset(imageDir, outDir, (32, 32), workers = 1) == (0, 3, [])
+    # the prefix only names the outputs, they are made once more under the new names
+    assert preprocessDataset(imageDir, outDir, (32, 32), prefix = 'sz-', workers = 1) == (3, 0, [])
+
+
+# Outputs made with other options are not up to date, they are made again
+def testChangedOptionsRedoOutputs(imageDir, makeDataset, tmp_path):
+    makeDataset(2, {0: ('KITTI', [1], [(8, 8, 40, 40)])})
+    outDir = str(tmp_path / 'out')
+    preprocessDataset(imageDir, outDir, (32, 32), workers = 1)
+    assert preprocessDataset(imageDir, outDir, (16, 16), workers = 1) == (2, 0, [])
+    assert Image.open(os.path.join(outDir, 'img001.jpg')).size == (16, 12)
+    assert readLabels(outDir, 'img000.txt', (16, 12)) == ('KITTI', [1], [(2, 2, 10, 10)])
+    assert preprocessDataset(imageDir, outDir, (16, 16), workers = 1) == (0, 2, [])
+    assert preprocessDataset(imageDir, outDir, (16, 16), outFormat = 'png', workers = 1) == (2, 0, [])
+    assert os.path.exists(os.path.join(outDir, 'img000.png'))
+    assert not [name for name in os.listdir(outDir) if name.endswith('.tmp')]
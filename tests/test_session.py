@@ -0,0 +1,104 @@
+import json
+import os
+import random
+
+from euclidcore import session
+from euclidcore.session import LabelBitmap, SessionState, decodeBitmap
+
+
+def testBitmapSearchMatchesLinearScan():
+    rng = random.Random(1)
+    for count in (1, 7, 8, 9, 63, 64, 200):
+        bitmap = LabelBitmap(count)
+        labelled = [rng.random() < 0.9 for index in range(count)]
+        for index, value in enumerate(labelled):
+            bitmap[index] = value
+        assert bitmap.countLabelled() == sum(labelled)
+        for start in range(-1, count + 1):
+            after = [index for index in range(start + 1, count) if not labelled[index]]
+            before = [index for index in range(min(start, count) - 1, -1, -1) if not labelled[index]]
+            assert bitmap.nextUnlabelled(start) == (after[0] if after else -1)
+            assert bitmap.prevUnlabelled(start) == (before[0] if before else -1)
+
+
+def testBitmapPaddingIsNeverUnlabelled():
+    bitmap = LabelBitmap(10)
+    for index in range(10):
+        bitmap[index] = True
+    assert bitmap.nextUnlabelled(-1) == -1
+    assert bitmap.prevUnlabelled(16) == -1
+    assert bitmap.countLabelled() == 10
+
+
+def testBitmapEncodeRoundtrip():
+    bitmap = LabelBitmap(100)
+    bitmap[3] = bitmap[99] = True
+    decoded = decodeBitmap(100, bitmap.encode())
+    assert decoded.bits == bitmap.bits
+    # a bitmap saved for another listing, or damaged, is not used
+    assert decodeBitmap(200, bitmap.encode()) is None
+    assert decodeBitmap(100, 'not base64!') is None
+
+
+def testAttachReadsLabelFilesWithoutSavedBitmap(imageDir):
+    imagePaths = [os.path.join(imageDir, name) for name in ('a.jpg', 'b.jpg', 'c.jpg')]
+    state = SessionState(imageDir)
+    state.setLabelled(imagePaths[2])    # before the listing is complete
+    state.attach(imagePaths, lambda: set(['a']))
+    assert [state.isLabelled(imagePath) for imagePath in imagePaths] == [True, False, True]
+
+
+def testAttachUsesSavedBitmapOfSameListing(imageDir):
+    imagePaths = [os.path.join(imageDir, name) for name in ('a.jpg', 'b.jpg')]
+    state = SessionState(imageDir)
+    state.attach(imagePaths, lambda: set())
+    state.setLabelled(imagePaths[1])
+    state.setLastPath(imagePaths[1])
+    assert state.queueSave()
+    state.save()
+
+    reopened = SessionState(imageDir)
+    reopened.attach(imagePaths, lambda: set(['a']))     # not asked, the bitmap fits
+    assert not reopened.isLabelled(imagePaths[0])
+    assert reopened.isLabelled(imagePaths[1])
+    assert reopened.getLastPath() == imagePaths[1]
+
+
+# Two annotators on one folder: both positions and both labelled images stay
+def testSaveMergesOtherAnnotators(imageDir):
+    imagePaths = [os.path.join(imageDir, 'img%d.jpg' % index) for index in range(20)]
+    first, second = SessionState(imageDir), SessionState(imageDir)
+    first.user, second.user = 'ann', 'bob'
+    first.attach(imagePaths, lambda: set())
+    second.attach(imagePaths, lambda: set())
+
+    first.setLabelled(imagePaths[3])
+    first.setLastPath(imagePaths[3])
+    first.queueSave()
+    first.save()
+    second.setLabelled(imagePaths[12])
+    second.setLastPath(imagePaths[12])
+    second.queueSave()
+    second.save()
+
+    with open(session.getSessionPath(imageDir)) as f:
+        saved = json.load(f)
+    assert saved['positions'] == {'ann': imagePaths[3], 'bob': imagePaths[12]}
+    bitmap = decodeBitmap(20, saved['labelled'])
+    assert [index for index in range(20) if bitmap[index]] == [3, 12]
+
+
+def testQueuedSavesAreMerged(imageDir):
+    imagePaths = [os.path.join(imageDir, 'img%d.jpg' % index) for index in range(4)]
+    state = SessionState(imageDir)
+    state.attach(imagePaths, lambda: set())
+    state.setLabelled(imagePaths[0])
+    assert state.queueSave()
+    state.setLabelled(imagePaths[2])
+    assert not state.queueSave()    # the first save has not run yet
+    state.save()
+    state.save()    # nothing left queued
+
+    reopened = SessionState(imageDir)
+    reopened.attach(imagePaths, lambda: set())
+    assert [reopened.isLabelled(imagePath) for imagePath in imagePaths] == [True, False, True, False]
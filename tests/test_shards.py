@@ -0,0 +1,70 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from euclidcore import formats
+from euclidcore.shards import ShardReader, exportShards
+
+
+LABELS = {0: ('KITTI', [1, 2], [(1, 2, 30, 40), (5, 5, 9, 9)]),
+          2: ('YOLO', [3], [(10, 10, 50, 40)])}
+
+
+def readAll(outDir):
+    reader = ShardReader(outDir)
+    items = [(name, bytes(data), [(int(box['class_id']), float(box['x1']), float(box['y1']),
+                                   float(box['x2']), float(box['y2'])) for box in boxes])
+             for name, data, boxes in (reader[index] for index in range(len(reader)))]
+    reader.close()
+    return items
+
+
+def testExportAndRead(imageDir, makeDataset, tmp_path):
+    imagePaths = makeDataset(3, LABELS)
+    outDir = str(tmp_path / 'shards')
+    written, kept, images, errors = exportShards(imageDir, outDir, workers = 1)
+    assert (written, kept, images, errors) == (1, 0, 2, [])
+
+    items = readAll(outDir)
+    assert [name for name, data, boxes in items] == ['img000.jpg', 'img002.jpg']
+    with open(imagePaths[0], 'rb') as f:
+        assert items[0][1] == f.read()
+    assert items[0][2] == [(1, 1, 2, 30, 40), (2, 5, 5, 9, 9)]
+    # YOLO boxes come back in pixels, as the labeller loads them
+    labelMode, classIds, bboxes = formats.parseLabelRows(
+        formats.readLabelRows(os.path.join(formats.getLabelDir(imageDir), 'img002.txt')), 64, 48)
+    assert items[1][2] == [(3,) + tuple(float(value) for value in bboxes[0])]
+
+    reader = ShardReader(outDir)
+    assert reader.openImage(-1).size == (64, 48)
+    with pytest.raises(IndexError):
+        reader[2]
+
+
+def testUnlabelledImagesOnRequest(imageDir, makeDataset, tmp_path):
+    makeDataset(3, LABELS)
+    outDir = str(tmp_path / 'shards')
+    assert exportShards(imageDir, outDir, workers = 1, includeUnlabelled = True)[2] == 3
+    items = readAll(outDir)
+    assert [name for name, data, boxes in items] == ['img000.jpg', 'img001.jpg', 'img002.jpg']
+    assert items[1][2] == []
+
+
+# Exporting again only rewrites the shards whose images or labels changed
+def testReexportKeepsUnchangedShards(imageDir, makeDataset, tmp_path):
+    makeDataset(3, LABELS)
+    outDir = str(tmp_path / 'shards')
+    assert exportShards(imageDir, outDir, shardMB = 0, workers = 1)[:3] == (2, 0, 2)
+    assert exportShards(imageDir, outDir, shardMB = 0, workers = 1)[:3] == (0, 2, 2)
+
+    time.sleep(0.01)
+    labelPath = os.path.join(formats.getLabelDir(imageDir), 'img002.txt')
+    formats.writeLabelRows(labelPath, [formats.formatKittiRow('Class0', (0, 0, 4, 4))])
+    os.remove(os.path.join(formats.getLabelDir(imageDir), 'img000.txt'))
+    assert exportShards(imageDir, outDir, shardMB = 0, workers = 1)[:3] == (1, 0, 1)
+    assert [(name, boxes) for name, data, boxes in readAll(outDir)] == [('img002.jpg', [(0, 0, 0, 4, 4)])]
+    assert sorted(os.listdir(outDir)) == ['index.json', 'shard-00002.bin', 'shard-00002.boxes.npy',
+                                          'shard-00002.images.npy']
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from euclidcore import formats
+from euclidcore.stats import analyzeDataset, hasProblems, main
+
+
+def testReportCountsAndProblems(imageDir, makeDataset):
+    makeDataset(4, {0: ('KITTI', [0, 0, 1], [(1, 1, 11, 21), (2, 2, 34, 18), (5, 5, 5, 9)]),
+                    1: ('KITTI', [2], [(40, 30, 70, 47)]),
+                    2: ('YOLO', [1], [(8, 8, 24, 40)])})
+    labelDir = formats.getLabelDir(imageDir)
+    formats.writeLabelRows(os.path.join(labelDir, 'gone.txt'), ['0 0.5 0.5 0.1 0.1\n'])
+
+    report = analyzeDataset(imageDir, workers = 1)
+    assert (report['images'], report['labelFiles'], report['boxes']) == (4, 4, 5)
+    assert report['classes'] == dict([('Class0', 2), ('Class1', 2), ('Class2', 1)] +
+                                     [('Class%d' % classId, 0) for classId in range(3, 8)])
+    assert sum(report['boxWidth']['counts']) == 5
+    assert sum(report['aspectRatio']['counts']) == 4     # the zero area box has none
+    problems = report['problems']
+    assert problems['outOfBounds']['examples'] == ['img001.txt']
+    assert problems['zeroArea']['examples'] == ['img000.txt']
+    assert problems['missingLabels']['examples'] == ['img003']
+    assert problems['orphanLabels']['examples'] == ['gone.txt']
+    assert problems['parseErrors']['count'] == 0
+    assert hasProblems(report)
+
+
+def testParseErrorsAreReported(imageDir, makeDataset):
+    makeDataset(1)
+    formats.writeLabelRows(os.path.join(formats.getLabelDir(imageDir), 'img000.txt'),
+                           [formats.formatKittiRow('NoSuchClass', (1, 1, 5, 5))])
+    report = analyzeDataset(imageDir, workers = 1)
+    assert report['problems']['parseErrors']['count'] == 1
+    assert report['boxes'] == 0
+
+
+def testStrictExitStatus(imageDir, makeDataset, tmp_path):
+    makeDataset(2, {0: ('KITTI', [0], [(1, 1, 10, 10)])})
+    output = str(tmp_path / 'report.json')
+    # images without labels are no problem on their own
+    assert main([imageDir, '--output', output, '--strict', '--workers', '1']) == 0
+    assert os.path.exists(output)
+    formats.writeLabelRows(os.path.join(formats.getLabelDir(imageDir), 'img001.txt'),
+                           [formats.formatKittiRow('Class0', (1, 1, 1, 10))])
+    assert main([imageDir, '--strict', '--workers', '1']) == 1
+
+
+def testClassIdsOutsideTheClassListAreProblems(imageDir, makeDataset):
+    makeDataset(3, {0: ('KITTI', [1], [(1, 1, 10, 10)])})
+    labelDir = formats.getLabelDir(imageDir)
+    formats.writeLabelRows(os.path.join(labelDir, 'img001.txt'),
+                           [formats.formatYoloRow(9, (0.5, 0.5, 0.2, 0.2)), formats.formatYoloRow(1, (0.5, 0.5, 0.2, 0.2))])
+    formats.writeLabelRows(os.path.join(labelDir, 'img002.txt'), [formats.formatYoloRow(-1, (0.5, 0.5, 0.2, 0.2))])
+    report = analyzeDataset(imageDir, workers = 1)
+    assert report['problems']['badClass']['examples'] == ['img001.txt', 'img002.txt']
+    assert report['boxes'] == 2
+    assert report['classes']['Class1'] == 2
+    assert sorted(report['classes']) == formats.CLASSES
+    assert hasProblems(report)
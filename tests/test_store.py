@@ -0,0 +1,50 @@
+import os
+import sqlite3
+
+from euclidcore import formats
+from euclidcore.store import AnnotationStore, getStorePath
+
+
+def readLabels(labelDir, name, size = (64, 48)):
+    return formats.parseLabelRows(formats.readLabelRows(os.path.join(labelDir, name)), size[0], size[1])
+
+
+# WAL needs memory shared between the processes using the file, which hosts
+# sharing the folder over a network file system do not have
+def testStoreUsesRollbackJournal(imageDir):
+    formats.makeDirs(formats.getCacheDir(imageDir))
+    store = AnnotationStore(getStorePath(imageDir))
+    store.setBoxes('img000', 'KITTI', [1], [(1, 2, 3, 4)])
+    store.close()
+    conn = sqlite3.connect(getStorePath(imageDir))
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    conn.close()
+    assert not any(name.endswith(('-wal', '-shm')) for name in os.listdir(formats.getCacheDir(imageDir)))
+
+
+def testImportExportRoundtrip(imageDir, makeDataset, tmp_path):
+    kittiBoxes = [(1, 2, 30, 40), (10, 11, 63, 47)]
+    makeDataset(3, {0: ('KITTI', [0, 7], kittiBoxes), 1: ('YOLO', [3], [(4, 4, 20, 20)]), 2: ('KITTI', [], [])})
+    labelDir = formats.getLabelDir(imageDir)
+    formats.writeLabelRows(os.path.join(labelDir, 'gone.txt'), [formats.formatYoloRow(1, (0.5, 0.5, 0.2, 0.2))])
+    formats.makeDirs(formats.getCacheDir(imageDir))
+    store = AnnotationStore(getStorePath(imageDir))
+
+    imported, errors = store.importLabels(imageDir)
+    assert imported == 3
+    assert errors == ['gone.txt: no image found for YOLO label file']
+    assert store.listNames() == {'img000', 'img001', 'img002'}
+    assert store.getBoxes('img000') == ('KITTI', [0, 7], kittiBoxes)
+    assert store.getBoxes('img001') == readLabels(labelDir, 'img001.txt')
+    assert store.getBoxes('img002') == (None, [], [])
+    assert store.getBoxes('gone') is None
+    assert store.classCounts() == [(0, 1), (3, 1), (7, 1)]
+
+    # every image is written back in the format it was imported from
+    outDir = str(tmp_path / 'out')
+    assert store.exportLabels(imageDir, outDir = outDir) == (3, [])
+    assert readLabels(outDir, 'img000.txt') == ('KITTI', [0, 7], kittiBoxes)
+    with open(os.path.join(outDir, 'img001.txt')) as f:
+        assert f.read() == ''.join(formats.formatLabelRows('YOLO', [3], store.getBoxes('img001')[2], 64, 48))
+    assert readLabels(outDir, 'img002.txt') == (None, [], [])
+    store.close()
@@ -0,0 +1,52 @@
+import os
+
+from euclidcore import formats, scan
+from euclidcore.trainlist import TRAIN_LIST_NAME, TrainingList, getTrainListPath, rebuildTrainingList
+
+
+def readLines(path):
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+# Writing train.txt leaves the image folder untouched, so the scan manifest
+# stays valid and the next scan does not list the folder again
+def testFlushKeepsScanManifestValid(imageDir, makeDataset):
+    imagePaths = makeDataset(3)
+    assert sorted(scan.listImages(imageDir)) == imagePaths
+    manifest = scan.readManifest(imageDir)
+    trainList = TrainingList(imageDir)
+    trainList.add(imagePaths[1])
+    trainList.flush()
+    assert readLines(getTrainListPath(imageDir)) == [imagePaths[1]]
+    assert sorted(os.listdir(imageDir)) == ['LabelData', 'img000.jpg', 'img001.jpg', 'img002.jpg']
+    assert os.stat(imageDir).st_mtime_ns == manifest['mtime']
+
+
+def testMergeKeepsOtherAnnotatorsEntries(imageDir):
+    first, second = TrainingList(imageDir), TrainingList(imageDir)
+    first.add('/data/a.jpg')
+    first.add('/data/b.jpg')
+    first.flush()
+    second.add('/data/c.jpg')
+    second.remove('/data/a.jpg')
+    second.flush()
+    assert readLines(getTrainListPath(imageDir)) == ['/data/b.jpg', '/data/c.jpg']
+
+
+def testLegacyListIsCarriedOver(imageDir):
+    with open(os.path.join(imageDir, TRAIN_LIST_NAME), 'w') as f:
+        f.write('/data/old.jpg\n')
+    trainList = TrainingList(imageDir)
+    assert '/data/old.jpg' in trainList
+    trainList.add('/data/new.jpg')
+    trainList.flush()
+    assert readLines(getTrainListPath(imageDir)) == ['/data/old.jpg', '/data/new.jpg']
+
+
+def testRebuildListsYoloLabelledImages(imageDir, makeDataset):
+    imagePaths = makeDataset(3, {0: ('YOLO', [1], [(1, 1, 9, 9)]), 1: ('KITTI', [1], [(1, 1, 9, 9)]),
+                                 2: ('YOLO', [], [])})
+    rebuildTrainingList(imageDir, workers = 1)
+    assert readLines(getTrainListPath(imageDir)) == [imagePaths[0]]
+    assert not os.path.exists(os.path.join(formats.getLabelDir(imageDir), TRAIN_LIST_NAME))
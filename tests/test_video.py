@@ -0,0 +1,21 @@
+from euclidcore.video import interpolateBoxes
+
+
+# Boxes pair up by class, nearest centres first, and move linearly from
+# the first frame to the second
+def testBoxesArePairedByClassAndNearestCentre():
+    classIdsA = [1, 1, 2]
+    bboxesA = [(0, 0, 10, 10), (100, 100, 110, 110), (50, 50, 60, 60)]
+    classIdsB = [1, 1, 2]
+    bboxesB = [(110, 120, 130, 140), (10, 20, 30, 40), (60, 50, 70, 60)]
+    classIds, bboxes = interpolateBoxes(classIdsA, bboxesA, classIdsB, bboxesB, 0.5)
+    assert sorted(zip(classIds, bboxes)) == [(1, (5.0, 10.0, 20.0, 25.0)), (1, (105.0, 110.0, 120.0, 125.0)),
+                                             (2, (55.0, 50.0, 65.0, 60.0))]
+    assert sorted(interpolateBoxes(classIdsA, bboxesA, classIdsB, bboxesB, 0.0)[1]) == sorted(bboxesA)
+
+
+def testBoxesWithoutPartnerAreLeftOut():
+    classIds, bboxes = interpolateBoxes([1, 3], [(0, 0, 10, 10), (5, 5, 8, 8)],
+                                        [1, 1, 4], [(0, 0, 20, 20), (400, 400, 410, 410), (5, 5, 8, 8)], 0.25)
+    assert (classIds, bboxes) == ([1], [(0.0, 0.0, 12.5, 12.5)])
+    assert interpolateBoxes([], [], [1], [(0, 0, 1, 1)], 0.5) == ([], [])